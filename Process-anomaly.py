@@ -9,66 +9,156 @@ adds the Automate Solar logo, and saves them to a dedicated output folder.
 import os
 import cv2
 import numpy as np
-from PIL import Image
+from PIL import Image, JpegImagePlugin
 import argparse
 import glob
+import shutil
+import subprocess
+import tempfile
 
-def has_bounding_box(image_path):
+import tiled_image
+
+# Detection thresholds for has_bounding_box. Measure the effect of any change
+# with benchmark_bounding_box.py before editing these.
+MIN_RED_PIXELS = 500
+BOX_VERTICES = 4
+
+# jpegtran (libjpeg-turbo 2.1+ / IJG 9 / mozjpeg) lets us stamp the logo
+# without re-encoding the whole JPEG. Probed once; see _jpegtran_drop_switches.
+JPEGTRAN = shutil.which('jpegtran')
+_JPEGTRAN_SWITCHES = False
+
+def red_masks(img):
+    """
+    Build the red pixel masks used for bounding box detection.
+    
+    Returns:
+        (red_mask, closed_mask) where closed_mask has small gaps in red lines
+        filled so that box outlines form single contours
+    """
+    # Convert to HSV space for easier color detection
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    
+    # Define red color range in HSV
+    # Red has two ranges in HSV, so we need to check both
+    lower_red1 = np.array([0, 120, 70])
+    upper_red1 = np.array([10, 255, 255])
+    mask1 = cv2.inRange(hsv, lower_red1, upper_red1)
+    
+    lower_red2 = np.array([170, 120, 70])  
+    upper_red2 = np.array([180, 255, 255])
+    mask2 = cv2.inRange(hsv, lower_red2, upper_red2)
+    
+    # Combine masks
+    red_mask = cv2.bitwise_or(mask1, mask2)
+    
+    # Detect if red pixels form lines (potential bounding boxes)
+    # We'll apply morphological operations to identify line segments
+    kernel = np.ones((3, 3), np.uint8)
+    dilated = cv2.dilate(red_mask, kernel, iterations=1)
+    eroded = cv2.erode(dilated, kernel, iterations=1)
+    return red_mask, eroded
+
+def red_contours(closed_mask, box_vertices=BOX_VERTICES):
+    """
+    Find red contours and check which ones could be bounding boxes.
+    
+    Returns:
+        List of ((x, y, w, h), is_box) for every external red contour
+    """
+    contours, _ = cv2.findContours(closed_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    
+    results = []
+    for contour in contours:
+        # Approximate the contour to a polygon
+        perimeter = cv2.arcLength(contour, True)
+        approx = cv2.approxPolyDP(contour, 0.04 * perimeter, True)
+        
+        # If it has 4 points, it could be a rectangle
+        results.append((cv2.boundingRect(contour), len(approx) == box_vertices))
+    return results
+
+def find_red_boxes_tiled(image_path, box_vertices=BOX_VERTICES,
+                         tile_size=tiled_image.DEFAULT_TILE_SIZE, overlap=tiled_image.DEFAULT_OVERLAP):
+    """
+    Find red bounding boxes in an image too large to load whole.
+    
+    The image is read in overlapping tiles. Red pixels are only counted in
+    each tile's core so overlaps are not counted twice. Contours cut by a tile
+    seam are merged with their neighbours and re-checked on the merged region.
+    
+    Returns:
+        Dict with 'red_pixels' and 'boxes' (list of (x, y, w, h) in image coordinates)
+    """
+    red_pixel_count = 0
+    boxes = []
+    fragments = []
+    
+    with tiled_image.TiledImage(image_path, tile_size=tile_size, overlap=overlap) as mosaic:
+        for tile in mosaic.tiles():
+            red_mask, closed = red_masks(tile.image)
+            core_x0, core_y0, core_x1, core_y1 = tile.core
+            red_pixel_count += cv2.countNonZero(
+                red_mask[core_y0 - tile.y:core_y1 - tile.y, core_x0 - tile.x:core_x1 - tile.x])
+            
+            tile_h, tile_w = tile.image.shape[:2]
+            for (x, y, w, h), is_box in red_contours(closed, box_vertices):
+                # A contour touching an inner seam may continue in the next tile
+                cut = ((x == 0 and tile.x > 0) or (y == 0 and tile.y > 0) or
+                       (x + w >= tile_w and tile.x + tile_w < mosaic.width) or
+                       (y + h >= tile_h and tile.y + tile_h < mosaic.height))
+                rect = (tile.x + x, tile.y + y, w, h)
+                if cut:
+                    fragments.append(rect)
+                elif is_box:
+                    boxes.append(rect)
+        
+        for x, y, w, h in tiled_image.merge_boxes(fragments):
+            region = mosaic.read_region(x - 2, y - 2, w + 4, h + 4)
+            _, closed = red_masks(region)
+            if any(is_box for _, is_box in red_contours(closed, box_vertices)):
+                boxes.append((x, y, w, h))
+    
+    return {'red_pixels': red_pixel_count, 'boxes': tiled_image.merge_boxes(boxes)}
+
+def has_bounding_box(image_path, min_red_pixels=MIN_RED_PIXELS, box_vertices=BOX_VERTICES):
     """
     Check if an image has red bounding boxes indicating anomalies.
     Returns True if red rectangles are detected, False otherwise.
+    
+    Panoramas and orthomosaics above tiled_image.LARGE_IMAGE_PIXELS are
+    processed in tiles with bounded memory.
+    
+    Args:
+        image_path: Path to the image to inspect
+        min_red_pixels: Red pixel count above which the image is flagged
+        box_vertices: Vertex count of an approximated contour treated as a box
     """
     try:
+        if tiled_image.is_large_image(image_path):
+            found = find_red_boxes_tiled(image_path, box_vertices)
+            return bool(found['boxes']) or found['red_pixels'] > min_red_pixels
+        
         # Read the image
         img = cv2.imread(image_path)
         if img is None:
             print(f"Could not read image: {image_path}")
             return False
         
-        # Convert to HSV space for easier color detection
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        
-        # Define red color range in HSV
-        # Red has two ranges in HSV, so we need to check both
-        lower_red1 = np.array([0, 120, 70])
-        upper_red1 = np.array([10, 255, 255])
-        mask1 = cv2.inRange(hsv, lower_red1, upper_red1)
-        
-        lower_red2 = np.array([170, 120, 70])  
-        upper_red2 = np.array([180, 255, 255])
-        mask2 = cv2.inRange(hsv, lower_red2, upper_red2)
-        
-        # Combine masks
-        red_mask = cv2.bitwise_or(mask1, mask2)
-        
         # To consider an image as having a bounding box, we look for:
         # - Sufficient red pixels in a pattern consistent with a bounding box
+        red_mask, closed = red_masks(img)
         
         # Count red pixels
         red_pixel_count = cv2.countNonZero(red_mask)
         
-        # Detect if red pixels form lines (potential bounding boxes)
-        # We'll apply morphological operations to identify line segments
-        kernel = np.ones((3, 3), np.uint8)
-        dilated = cv2.dilate(red_mask, kernel, iterations=1)
-        eroded = cv2.erode(dilated, kernel, iterations=1)
-        
-        # Find contours that could be rectangles
-        contours, _ = cv2.findContours(eroded, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
         # Check if any contour could be a bounding box
-        for contour in contours:
-            # Approximate the contour to a polygon
-            perimeter = cv2.arcLength(contour, True)
-            approx = cv2.approxPolyDP(contour, 0.04 * perimeter, True)
-            
-            # If it has 4 points, it could be a rectangle
-            if len(approx) == 4:
-                return True
+        if any(is_box for _, is_box in red_contours(closed, box_vertices)):
+            return True
         
         # Also check if there's a reasonable number of red pixels that could be a bounding box
         # A typical bounding box may have at least 500 red pixels
-        if red_pixel_count > 500:
+        if red_pixel_count > min_red_pixels:
             return True
             
         return False
@@ -77,16 +167,223 @@ def has_bounding_box(image_path):
         print(f"Error checking for bounding boxes in {image_path}: {e}")
         return False
 
-def add_logo_to_image(image_path, logo_path, output_path):
+def load_logo(logo_path):
+    """
+    Read the logo with its alpha channel, adding an opaque one if missing.
+    Returns None if the logo cannot be read.
+    """
+    logo = cv2.imread(logo_path, cv2.IMREAD_UNCHANGED)
+    if logo is None:
+        return None
+    
+    # Make sure logo has an alpha channel
+    if logo.shape[2] == 3:  # Convert BGR to BGRA
+        b, g, r = cv2.split(logo)
+        alpha = np.ones(b.shape, dtype=b.dtype) * 255
+        logo = cv2.merge((b, g, r, alpha))
+    return logo
+
+def logo_placement(img_w, img_h, logo):
+    """
+    Work out where the logo goes on an image of the given size.
+    
+    Returns:
+        (roi_x, roi_y, logo_width, logo_height)
+    """
+    logo_aspect_ratio = logo.shape[1] / logo.shape[0]
+    logo_width = int(img_w * 0.2)  # Logo width is 20% of image width
+    logo_height = int(logo_width / logo_aspect_ratio)
+    
+    roi_y = img_h - logo_height - 20  # 20 pixels from bottom
+    roi_x = 20  # 20 pixels from left
+    return roi_x, roi_y, logo_width, logo_height
+
+def blend_logo(img, logo, roi_x, roi_y):
+    """
+    Alpha-blend an already resized BGRA logo into img in place, with its
+    top-left corner at (roi_x, roi_y).
+    """
+    logo_height, logo_width = logo.shape[:2]
+    
+    # Get region of interest from source image
+    roi = img[roi_y:roi_y + logo_height, roi_x:roi_x + logo_width]
+    
+    # Create mask from logo alpha channel (float32 and one channel at a time,
+    # since logos scaled to a mosaic are large)
+    logo_alpha = logo[:, :, 3].astype(np.float32) / 255.0
+    
+    # Blend logo with image region
+    for c in range(0, 3):
+        roi[:, :, c] = roi[:, :, c] * (1 - logo_alpha) + logo[:, :, c] * logo_alpha
+    
+    # Place the blended region back in the image
+    img[roi_y:roi_y + logo_height, roi_x:roi_x + logo_width] = roi
+    return img
+
+def _jpegtran_drop_switches():
+    """
+    Check once whether the installed jpegtran has the -drop switch.
+    
+    Returns:
+        None if block-wise stamping is unavailable, otherwise the extra
+        switches to pass to jpegtran
+    """
+    global _JPEGTRAN_SWITCHES
+    if _JPEGTRAN_SWITCHES is False:
+        _JPEGTRAN_SWITCHES = None
+        if JPEGTRAN:
+            try:
+                # jpegtran prints its usage to stderr for unknown switches
+                result = subprocess.run([JPEGTRAN, '-help'], capture_output=True, timeout=10)
+                usage = result.stdout + result.stderr
+                if b'-drop' in usage:
+                    # mozjpeg re-optimizes progressive scans by default, which
+                    # costs more than the re-encode we are trying to avoid
+                    _JPEGTRAN_SWITCHES = ['-revert'] if b'-revert' in usage else []
+            except (OSError, subprocess.SubprocessError):
+                pass
+    return _JPEGTRAN_SWITCHES
+
+def add_logo_to_jpeg_lossless(image_path, logo_path, output_path):
+    """
+    Stamp the logo onto a JPEG without re-encoding the whole frame.
+    
+    Only the iMCU blocks under the logo are cut out (losslessly), decoded,
+    blended and re-encoded with the source quantization tables; jpegtran then
+    drops them back in and copies every other coefficient block unchanged,
+    along with the EXIF/XMP metadata. No IDCT runs outside the logo area.
+    
+    Returns:
+        True if the stamped image was written, False if this image cannot be
+        stamped this way (caller should fall back to a full re-encode)
+    """
+    switches = _jpegtran_drop_switches()
+    if switches is None or not image_path.lower().endswith(('.jpg', '.jpeg')):
+        return False
+    
+    # Reading the header is enough for size, sampling and quantization tables.
+    # Mosaics are far past Pillow's decompression bomb limit, but nothing is
+    # decoded here.
+    limit = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        with Image.open(image_path) as src:
+            if src.format != 'JPEG' or src.mode not in ('RGB', 'L'):
+                return False
+            img_w, img_h = src.size
+            qtables = src.quantization
+            sampling = JpegImagePlugin.get_sampling(src) if src.mode == 'RGB' else -1
+            # iMCU size is 8 pixels times the largest sampling factor
+            mcu_w = 8 * max(h for _, h, _, _ in src.layer)
+            mcu_h = 8 * max(v for _, _, v, _ in src.layer)
+            mode = src.mode
+    finally:
+        Image.MAX_IMAGE_PIXELS = limit
+    if sampling is None or (mode == 'RGB' and sampling == -1):
+        # Subsampling Pillow cannot write back; the patch would not match
+        return False
+    
+    logo = load_logo(logo_path)
+    if logo is None:
+        print(f"Could not read logo: {logo_path}")
+        return False
+    roi_x, roi_y, logo_width, logo_height = logo_placement(img_w, img_h, logo)
+    if roi_y < 0 or logo_width <= 0 or logo_height <= 0:
+        return False
+    logo = cv2.resize(logo, (logo_width, logo_height))
+    
+    # Grow the logo area outwards to whole iMCUs; the patch may not run off
+    # the image, since partial edge blocks cannot be dropped back in.
+    x0 = (roi_x // mcu_w) * mcu_w
+    y0 = (roi_y // mcu_h) * mcu_h
+    x1 = -(-(roi_x + logo_width) // mcu_w) * mcu_w
+    y1 = -(-(roi_y + logo_height) // mcu_h) * mcu_h
+    if x1 > img_w or y1 > img_h:
+        return False
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        patch_path = os.path.join(temp_dir, 'patch.jpg')
+        stamped_path = os.path.join(temp_dir, 'stamped.jpg')
+        subprocess.run([JPEGTRAN, *switches, '-maxmemory', tiled_image.JPEGTRAN_MAXMEMORY, '-copy', 'none', '-crop', f"{x1 - x0}x{y1 - y0}+{x0}+{y0}",
+                        '-outfile', patch_path, image_path], check=True, capture_output=True)
+        
+        patch = cv2.imread(patch_path, cv2.IMREAD_COLOR if mode == 'RGB' else cv2.IMREAD_GRAYSCALE)
+        if patch is None or patch.shape[:2] != (y1 - y0, x1 - x0):
+            return False
+        if mode == 'L':
+            patch = cv2.cvtColor(patch, cv2.COLOR_GRAY2BGR)
+        blend_logo(patch, logo, roi_x - x0, roi_y - y0)
+        
+        stamped = Image.fromarray(cv2.cvtColor(patch, cv2.COLOR_BGR2RGB)).convert(mode)
+        save_options = {'qtables': qtables}
+        if mode == 'RGB':
+            save_options['subsampling'] = sampling
+        stamped.save(stamped_path, 'JPEG', **save_options)
+        
+        subprocess.run([JPEGTRAN, *switches, '-maxmemory', tiled_image.JPEGTRAN_MAXMEMORY, '-copy', 'all', '-drop', f"+{x0}+{y0}", stamped_path,
+                        '-outfile', output_path, image_path], check=True, capture_output=True)
+    return True
+
+def add_logo_to_large_tiff(image_path, logo_path, output_path):
+    """
+    Stamp the logo onto an uncompressed TIFF mosaic without loading it.
+    
+    The file is copied and only the pixels under the logo are rewritten
+    through a memory map.
+    
+    Returns:
+        True if the stamped image was written, False if the TIFF cannot be
+        memory-mapped (caller should fall back to a full re-encode)
+    """
+    if not image_path.lower().endswith(('.tif', '.tiff')):
+        return False
+    layout = tiled_image.tiff_layout(image_path)
+    if layout is None or layout[1][2] not in (3, 4):
+        return False
+    
+    logo = load_logo(logo_path)
+    if logo is None:
+        print(f"Could not read logo: {logo_path}")
+        return False
+    
+    shutil.copyfile(image_path, output_path)
+    img_h, img_w = layout[1][:2]
+    roi_x, roi_y, logo_width, logo_height = logo_placement(img_w, img_h, logo)
+    logo = cv2.resize(logo, (logo_width, logo_height))
+    
+    pixels, is_rgb = tiled_image.tiff_memmap(output_path, mode='r+', rows=(roi_y, logo_height))
+    region = pixels[:, roi_x:roi_x + logo_width, :3]
+    patch = cv2.cvtColor(region, cv2.COLOR_RGB2BGR) if is_rgb else np.ascontiguousarray(region)
+    blend_logo(patch, logo, 0, 0)
+    region[:] = cv2.cvtColor(patch, cv2.COLOR_BGR2RGB) if is_rgb else patch
+    pixels.flush()
+    return True
+
+def add_logo_to_image(image_path, logo_path, output_path, lossless=True):
     """
     Add the Automate Solar logo to an image.
     
+    JPEGs are stamped block-wise with add_logo_to_jpeg_lossless when possible,
+    and large uncompressed TIFFs in place with add_logo_to_large_tiff;
+    anything else falls back to decoding and re-encoding the whole image.
+    
     Args:
         image_path: Path to the source image
         logo_path: Path to the logo image
         output_path: Path where the image with logo should be saved
+        lossless: Try the block-wise JPEG stamping first
     """
     try:
+        if lossless:
+            try:
+                if add_logo_to_jpeg_lossless(image_path, logo_path, output_path):
+                    return True
+            except (OSError, subprocess.CalledProcessError) as e:
+                print(f"Block-wise stamping failed for {image_path}, re-encoding instead: {e}")
+        
+        if tiled_image.is_large_image(image_path) and add_logo_to_large_tiff(image_path, logo_path, output_path):
+            return True
+        
         # Read the source image
         img = cv2.imread(image_path)
         if img is None:
@@ -94,51 +391,17 @@ def add_logo_to_image(image_path, logo_path, output_path):
             return False
         
         # Read the logo
-        logo = cv2.imread(logo_path, cv2.IMREAD_UNCHANGED)
+        logo = load_logo(logo_path)
         if logo is None:
             print(f"Could not read logo: {logo_path}")
             return False
         
-        # Make sure logo has an alpha channel
-        if logo.shape[2] == 3:  # Convert BGR to BGRA
-            b, g, r = cv2.split(logo)
-            alpha = np.ones(b.shape, dtype=b.dtype) * 255
-            logo = cv2.merge((b, g, r, alpha))
-        
-        # Calculate logo size (30% of image width)
+        # Calculate logo size and position, then resize the logo
         img_h, img_w = img.shape[:2]
-        logo_aspect_ratio = logo.shape[1] / logo.shape[0]
-        logo_width = int(img_w * 0.2)  # Logo width is 20% of image width
-        logo_height = int(logo_width / logo_aspect_ratio)
-        
-        # Resize logo
+        roi_x, roi_y, logo_width, logo_height = logo_placement(img_w, img_h, logo)
         logo = cv2.resize(logo, (logo_width, logo_height))
         
-        # Define region of interest
-        roi_y = img_h - logo_height - 20  # 20 pixels from bottom
-        roi_x = 20  # 20 pixels from left
-        
-        # Get region of interest from source image
-        roi = img[roi_y:roi_y + logo_height, roi_x:roi_x + logo_width]
-        
-        # Create mask from logo alpha channel
-        if logo.shape[2] == 4:  # If logo has alpha channel
-            logo_alpha = logo[:, :, 3] / 255.0
-            alpha_3channel = cv2.merge([logo_alpha, logo_alpha, logo_alpha])
-            
-            # Extract BGR channels from logo
-            logo_bgr = logo[:, :, :3]
-            
-            # Blend logo with image region
-            for c in range(0, 3):
-                roi[:, :, c] = roi[:, :, c] * (1 - alpha_3channel[:, :, c]) + \
-                               logo_bgr[:, :, c] * alpha_3channel[:, :, c]
-            
-            # Place the blended region back in the image
-            img[roi_y:roi_y + logo_height, roi_x:roi_x + logo_width] = roi
-        else:
-            # If no alpha channel, just overlay logo
-            img[roi_y:roi_y + logo_height, roi_x:roi_x + logo_width] = logo[:, :, :3]
+        blend_logo(img, logo, roi_x, roi_y)
         
         # Save the result
         cv2.imwrite(output_path, img)
@@ -148,7 +411,7 @@ def add_logo_to_image(image_path, logo_path, output_path):
         print(f"Error adding logo to {image_path}: {e}")
         return False
 
-def process_images(input_folder, output_folder, logo_path):
+def process_images(input_folder, output_folder, logo_path, lossless=True):
     """
     Process all annotated images in the input folder:
     - Check if they have bounding boxes (indicating anomalies)
@@ -158,6 +421,7 @@ def process_images(input_folder, output_folder, logo_path):
         input_folder: Folder containing annotated images
         output_folder: Folder where processed images will be saved
         logo_path: Path to the logo file
+        lossless: Stamp JPEGs block-wise instead of re-encoding them
     """
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
@@ -189,7 +453,7 @@ def process_images(input_folder, output_folder, logo_path):
                 output_path = os.path.join(output_folder, filename)
                 
                 # Add logo and save
-                if add_logo_to_image(image_path, logo_path, output_path):
+                if add_logo_to_image(image_path, logo_path, output_path, lossless=lossless):
                     print(f"âœ“ Added logo to {filename} and saved to {output_folder}")
                 else:
                     print(f"âœ— Failed to process {filename}")
@@ -207,6 +471,8 @@ def main():
     parser.add_argument('--input', default='Thermal_outputsA', help='Input folder containing annotated images')
     parser.add_argument('--output', default='Processed_Anomaly_Images', help='Output folder for processed images')
     parser.add_argument('--logo', default='Pic_Logo.png', help='Path to logo file')
+    parser.add_argument('--reencode', action='store_true',
+                        help='Always decode and re-encode the whole image when stamping the logo')
     
     args = parser.parse_args()
     
@@ -216,7 +482,7 @@ def main():
         return
     
     # Process images
-    process_images(args.input, args.output, args.logo)
+    process_images(args.input, args.output, args.logo, lossless=not args.reencode)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
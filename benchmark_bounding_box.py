@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+"""
+Benchmark the Red Bounding Box Detector
+
+This script measures the accuracy and speed of has_bounding_box (from
+Process-anomaly.py) and any alternative detectors against a labeled corpus.
+The corpus is made of synthetic thermal-style frames at DJI resolutions, with
+and without red rectangles, plus optional real labeled samples.
+
+Real samples go in a folder with two sub-folders:
+    <samples>/anomaly/   images that contain a red bounding box
+    <samples>/clean/     images that do not
+
+Alternative detectors are given as module:function (the module may also be a
+path to a .py file). The function must take an image path and return a bool.
+
+Usage:
+    python benchmark_bounding_box.py --per-class 20 --sweep 250,500,1000
+    python benchmark_bounding_box.py --samples labeled/ --detector my_detector.py:detect
+"""
+
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+import resource
+import importlib
+import importlib.util
+import multiprocessing
+from functools import partial
+
+import cv2
+import numpy as np
+
+# Frame sizes of the DJI cameras we fly (width, height)
+DJI_RESOLUTIONS = {
+    'thermal': (640, 512),        # M30T / H20T thermal sensor
+    'thermal_sr': (1280, 1024),   # thermal super-resolution mode
+    'wide': (4000, 3000),         # M30T wide camera
+}
+
+# Palettes used by the DJI pilot app. Iron red is the one most likely to
+# produce false positives, so it is weighted in deliberately.
+PALETTES = {
+    'white_hot': None,
+    'iron_red': cv2.COLORMAP_INFERNO,
+    'rainbow': cv2.COLORMAP_JET,
+}
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff')
+PROCESS_ANOMALY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Process-anomaly.py')
+
+
+def load_process_anomaly():
+    """Import Process-anomaly.py, whose file name is not a valid module name."""
+    spec = importlib.util.spec_from_file_location('process_anomaly', PROCESS_ANOMALY_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_detector(spec):
+    """
+    Resolve a detector spec to a callable.
+
+    Args:
+        spec: 'current', 'current:min_red_pixels=N', or 'module:function'
+              where module may be a dotted name or a path to a .py file
+    """
+    if spec == 'current' or spec.startswith('current:'):
+        module = load_process_anomaly()
+        kwargs = {}
+        if ':' in spec:
+            for option in spec.split(':', 1)[1].split(','):
+                key, value = option.split('=')
+                kwargs[key] = int(value)
+        return partial(module.has_bounding_box, **kwargs)
+
+    module_name, _, function_name = spec.rpartition(':')
+    if not module_name:
+        raise ValueError(f"Detector must be given as module:function, got {spec!r}")
+    if module_name.endswith('.py'):
+        mod_spec = importlib.util.spec_from_file_location(
+            os.path.splitext(os.path.basename(module_name))[0], module_name)
+        module = importlib.util.module_from_spec(mod_spec)
+        mod_spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(module_name)
+    return getattr(module, function_name)
+
+
+def make_thermal_frame(rng, width, height, palette, noise_sigma):
+    """
+    Build a thermal-style frame: a smooth background gradient, a few warm
+    blobs (panels, inverters) and sensor noise, rendered through a palette.
+    """
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    angle = rng.uniform(0, np.pi)
+    gradient = (np.cos(angle) * xx / width + np.sin(angle) * yy / height)
+    frame = 90 + 60 * gradient
+
+    for _ in range(rng.integers(2, 8)):
+        cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+        radius = rng.uniform(0.02, 0.12) * min(width, height)
+        blob = np.exp(-((xx - cx) ** 2 + (yy - cy) ** 2) / (2 * radius ** 2))
+        frame += rng.uniform(20, 90) * blob
+
+    if noise_sigma > 0:
+        frame += rng.normal(0, noise_sigma, frame.shape).astype(np.float32)
+
+    gray = np.clip(frame, 0, 255).astype(np.uint8)
+    if PALETTES[palette] is None:
+        return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+    return cv2.applyColorMap(gray, PALETTES[palette])
+
+
+def draw_red_boxes(rng, img):
+    """Draw one to three red rectangles the way the annotation tools do."""
+    height, width = img.shape[:2]
+    thickness = max(1, int(round(min(width, height) / 250)))
+    for _ in range(rng.integers(1, 4)):
+        box_w = int(rng.uniform(0.04, 0.25) * width)
+        box_h = int(rng.uniform(0.04, 0.25) * height)
+        x = int(rng.uniform(0, width - box_w - 1))
+        y = int(rng.uniform(0, height - box_h - 1))
+        cv2.rectangle(img, (x, y), (x + box_w, y + box_h), (0, 0, 255), thickness)
+    return img
+
+
+def generate_corpus(output_folder, per_class, resolutions, noise_levels, seed=0, jpeg_quality=90):
+    """
+    Write a synthetic labeled corpus to output_folder.
+
+    Returns:
+        List of (image_path, label) tuples, label True for anomalies
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_folder, exist_ok=True)
+    corpus = []
+    palettes = list(PALETTES)
+
+    for resolution in resolutions:
+        width, height = DJI_RESOLUTIONS[resolution]
+        for noise_sigma in noise_levels:
+            for index in range(per_class):
+                palette = palettes[index % len(palettes)]
+                for label in (True, False):
+                    img = make_thermal_frame(rng, width, height, palette, noise_sigma)
+                    if label:
+                        draw_red_boxes(rng, img)
+                    suffix = 'TA' if label else 'T'
+                    filename = f"{resolution}_n{noise_sigma}_{palette}_{index:04d}_{suffix}.jpg"
+                    image_path = os.path.join(output_folder, filename)
+                    cv2.imwrite(image_path, img, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+                    corpus.append((image_path, label))
+
+    return corpus
+
+
+def load_labeled_samples(samples_folder):
+    """Collect real samples from <samples>/anomaly and <samples>/clean."""
+    corpus = []
+    for sub_folder, label in (('anomaly', True), ('clean', False)):
+        folder = os.path.join(samples_folder, sub_folder)
+        if not os.path.isdir(folder):
+            print(f"Warning: labeled samples folder not found: {folder}")
+            continue
+        for filename in sorted(os.listdir(folder)):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                corpus.append((os.path.join(folder, filename), label))
+    return corpus
+
+
+def _peak_rss_bytes():
+    # On Linux ru_maxrss survives fork+exec, so a spawned worker would report
+    # the parent's peak. VmHWM is per address space and starts fresh.
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_detector(spec, corpus, warmup=3):
+    """
+    Run one detector over the corpus and score it.
+
+    Meant to be called in a fresh process so the peak memory figure is not
+    polluted by other detectors or by corpus generation.
+    """
+    detector = load_detector(spec)
+    baseline_rss = _peak_rss_bytes()
+    for image_path, _ in corpus[:warmup]:
+        detector(image_path)
+
+    tp = fp = fn = tn = 0
+    start = time.perf_counter()
+    for image_path, label in corpus:
+        predicted = bool(detector(image_path))
+        if predicted and label:
+            tp += 1
+        elif predicted:
+            fp += 1
+        elif label:
+            fn += 1
+        else:
+            tn += 1
+    elapsed = time.perf_counter() - start
+
+    return {
+        'detector': spec,
+        'images': len(corpus),
+        'tp': tp, 'fp': fp, 'fn': fn, 'tn': tn,
+        'precision': tp / (tp + fp) if tp + fp else 0.0,
+        'recall': tp / (tp + fn) if tp + fn else 0.0,
+        'images_per_second': len(corpus) / elapsed if elapsed > 0 else 0.0,
+        'peak_memory_mb': max(0, _peak_rss_bytes() - baseline_rss) / (1024 * 1024),
+    }
+
+
+def benchmark(specs, corpus):
+    """Score every detector, each in its own spawned process."""
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for spec in specs:
+        with context.Pool(1) as pool:
+            results.append(pool.apply(run_detector, (spec, corpus)))
+    return results
+
+
+def print_results(results):
+    header = f"{'Detector':<40} {'Prec':>6} {'Recall':>6} {'TP':>5} {'FP':>5} {'FN':>5} {'TN':>5} {'img/s':>8} {'Peak MB':>8}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['detector']:<40} {r['precision']:>6.3f} {r['recall']:>6.3f} "
+              f"{r['tp']:>5} {r['fp']:>5} {r['fn']:>5} {r['tn']:>5} "
+              f"{r['images_per_second']:>8.1f} {r['peak_memory_mb']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark red bounding box detectors.')
+    parser.add_argument('--per-class', type=int, default=10,
+                        help='Synthetic images per class, per resolution and noise level')
+    parser.add_argument('--resolutions', default='thermal,wide',
+                        help=f"Comma separated subset of: {', '.join(DJI_RESOLUTIONS)}")
+    parser.add_argument('--noise', default='0,4,12', help='Comma separated noise sigmas')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the synthetic corpus')
+    parser.add_argument('--samples', help='Folder of real labeled samples (anomaly/ and clean/)')
+    parser.add_argument('--no-synthetic', action='store_true', help='Only use real labeled samples')
+    parser.add_argument('--corpus-dir', help='Keep the synthetic corpus in this folder')
+    parser.add_argument('--sweep', help='Comma separated min_red_pixels values to try with the current detector')
+    parser.add_argument('--detector', action='append', default=[],
+                        help='Alternative detector as module:function (repeatable)')
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+
+    args = parser.parse_args()
+
+    specs = ['current']
+    if args.sweep:
+        specs += [f"current:min_red_pixels={value}" for value in args.sweep.split(',')]
+    specs += args.detector
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        corpus = []
+        if not args.no_synthetic:
+            corpus_dir = args.corpus_dir or temp_dir
+            resolutions = args.resolutions.split(',')
+            noise_levels = [int(n) for n in args.noise.split(',')]
+            print(f"Generating synthetic corpus in {corpus_dir}...")
+            corpus += generate_corpus(corpus_dir, args.per_class, resolutions, noise_levels, seed=args.seed)
+        if args.samples:
+            corpus += load_labeled_samples(args.samples)
+
+        if not corpus:
+            print("Error: corpus is empty")
+            return
+
+        positives = sum(1 for _, label in corpus if label)
+        print(f"Corpus: {len(corpus)} images ({positives} anomaly, {len(corpus) - positives} clean)\n")
+        results = benchmark(specs, corpus)
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to: {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,31 @@
-"""Generate a PDF report from the processed Excel workbook."""
+"""Generate a PDF report from the processed Parquet table (or an older Excel workbook)."""
 
 from __future__ import annotations
 
+import io
 import json
 import sys
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Iterator
 
 import pandas as pd
+import pyarrow.parquet as pq
 from reportlab.lib.pagesizes import LETTER
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.units import inch
 from reportlab.pdfgen import canvas
 
+from Drone_Data_Process import SUMMARY_KEY
 
-def load_summary(excel_path: Path, metadata_path: Path | None = None) -> Dict[str, int]:
+# Columns the report lists; the rest of the table is never read
+REPORT_COLUMNS = ("file_name", "anomaly_detected", "notes")
+
+
+def _is_parquet(table_path: Path) -> bool:
+    return table_path.suffix.lower() == ".parquet"
+
+
+def load_summary(table_path: Path, metadata_path: Path | None = None) -> Dict[str, int]:
     if metadata_path and metadata_path.exists():
         try:
             return json.loads(metadata_path.read_text())
@@ -22,16 +33,30 @@ def load_summary(excel_path: Path, metadata_path: Path | None = None) -> Dict[st
             pass
 
     try:
-        summary_df = pd.read_excel(excel_path, sheet_name="Summary")
+        if _is_parquet(table_path):
+            return json.loads(pq.read_schema(table_path).metadata[SUMMARY_KEY])
+        summary_df = pd.read_excel(table_path, sheet_name="Summary")
         summary = summary_df.iloc[0].to_dict()
         return {k: int(v) for k, v in summary.items() if isinstance(v, (int, float))}
     except Exception:
         return {"total_files": 0, "anomalies_found": 0}
 
 
-def build_report(excel_path: Path, pdf_path: Path, metadata_path: Path | None = None) -> None:
-    summary = load_summary(excel_path, metadata_path)
-    anomalies_df = pd.read_excel(excel_path, sheet_name="Anomalies")
+def iter_rows(table_path: Path) -> Iterator[Dict[str, object]]:
+    """The report columns of each file's row, a batch at a time from Parquet."""
+    if not _is_parquet(table_path):
+        yield from pd.read_excel(table_path, sheet_name="Anomalies").to_dict("records")
+        return
+    source = pq.ParquetFile(table_path)
+    columns = [name for name in REPORT_COLUMNS if name in source.schema_arrow.names]
+    if not columns:
+        return
+    for batch in source.iter_batches(columns=columns):
+        yield from batch.to_pylist()
+
+
+def build_report(table_path: Path, pdf_path: Path, metadata_path: Path | None = None) -> None:
+    summary = load_summary(table_path, metadata_path)
 
     c = canvas.Canvas(str(pdf_path), pagesize=LETTER)
     width, height = LETTER
@@ -43,7 +68,7 @@ def build_report(excel_path: Path, pdf_path: Path, metadata_path: Path | None =
     textobject.setFont("Helvetica", 12)
     textobject.textLine("")
 
-    textobject.textLine(f"Total files processed: {summary.get('total_files', len(anomalies_df))}")
+    textobject.textLine(f"Total files processed: {summary.get('total_files', 0)}")
     textobject.textLine(f"Anomalies detected: {summary.get('anomalies_found', 0)}")
     textobject.textLine("")
 
@@ -51,7 +76,7 @@ def build_report(excel_path: Path, pdf_path: Path, metadata_path: Path | None =
     textobject.textLine("Detected Files")
     textobject.setFont("Helvetica", 10)
 
-    for _, row in anomalies_df.iterrows():
+    for row in iter_rows(table_path):
         flag = "YES" if bool(row.get("anomaly_detected")) else "NO"
         textobject.textLine(
             f"• {row.get('file_name')} — anomaly: {flag} — notes: {row.get('notes', '')}"
@@ -67,17 +92,26 @@ def build_report(excel_path: Path, pdf_path: Path, metadata_path: Path | None =
     c.save()
 
 
+def warm_up() -> None:
+    """Load styles and font metrics so the first report in a worker is not slower."""
+    getSampleStyleSheet()
+    c = canvas.Canvas(io.BytesIO(), pagesize=LETTER)
+    c.setFont("Helvetica", 12)
+    c.drawString(1 * inch, 1 * inch, "warm up")
+    c.save()
+
+
 def main() -> None:
     if len(sys.argv) < 3:
-        print("Usage: python ClaudeMain1_fixed.py <excel_path> <pdf_path> [metadata_path]", file=sys.stderr)
+        print("Usage: python ClaudeMain1_fixed.py <table_path> <pdf_path> [metadata_path]", file=sys.stderr)
         sys.exit(1)
 
-    excel_path = Path(sys.argv[1]).expanduser().resolve()
+    table_path = Path(sys.argv[1]).expanduser().resolve()
     pdf_path = Path(sys.argv[2]).expanduser().resolve()
-    metadata_path = Path(sys.argv[3]).expanduser().resolve() if len(sys.argv) > 3 else excel_path.with_suffix(".json")
+    metadata_path = Path(sys.argv[3]).expanduser().resolve() if len(sys.argv) > 3 else table_path.with_suffix(".json")
 
     pdf_path.parent.mkdir(parents=True, exist_ok=True)
-    build_report(excel_path, pdf_path, metadata_path)
+    build_report(table_path, pdf_path, metadata_path)
     print(f"PDF report created at {pdf_path}")
 
 
@@ -1,112 +1,444 @@
-"""Utility script to process uploaded drone files and build an Excel workbook."""
+"""Utility script to process uploaded drone files into a Parquet table, and an Excel workbook on request."""
 
 from __future__ import annotations
 
+import io
+import os
 import sys
 import json
+import zlib
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Dict
+from typing import Deque, Iterable, Iterator, List, Dict, Optional, Tuple
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+
+import fileops
+import inference
+import radiometric
+from blob_store import BlobStore
 
 IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".tif", ".tiff"}
 THERMAL_KEYWORDS = {"hot", "anomaly", "thermal", "hotspot"}
+# Records of files processed while the upload was still arriving, one JSON object per line
+RECORDS_FILE = ".records.jsonl"
+# Files stat'ed and hashed at once; on network volumes the round trips overlap.
+SCAN_WORKERS = 8
+# Key in the Parquet file's metadata holding the JSON summary
+SUMMARY_KEY = b"compliancedrone.summary"
+# Rows read from the table at a time while writing the workbook
+WORKBOOK_BATCH_ROWS = 2048
 
 
 def detect_anomaly(file_path: Path) -> bool:
-    """Simple heuristic to decide if an anomaly is present."""
+    """Simple heuristic to decide if an anomaly is present, for files no model or measurement covers."""
     stem = file_path.stem.lower()
     if any(keyword in stem for keyword in THERMAL_KEYWORDS):
         return True
-    # provide deterministic pseudo-random fallback
-    return hash(file_path.stem) % 5 == 0
+    # Pseudo-random but stable across processes, unlike the salted hash()
+    return zlib.crc32(file_path.stem.encode()) % 5 == 0
 
 
-def build_record(file_path: Path) -> Dict[str, object]:
-    anomaly = detect_anomaly(file_path)
-    return {
+def detect_images(paths: Iterable[Path]) -> Dict[Path, List[Dict[str, object]]]:
+    """Model detections for the image files among `paths`; empty when no model is configured."""
+    return inference.detect_images(p for p in paths if p.suffix.lower() in IMAGE_EXTENSIONS)
+
+
+def build_record(
+    file_path: Path,
+    thermal: Optional[Dict[str, object]] = None,
+    size: Optional[int] = None,
+    sha256: Optional[str] = None,
+    detections: Optional[List[Dict[str, object]]] = None,
+    relative_path: Optional[str] = None,
+) -> Dict[str, object]:
+    """Build the per-file record, preferring measured temperatures, then model detections.
+
+    `relative_path` is the file's path within the job folder; uploads in
+    different subfolders may share a name, so records are matched on it.
+    """
+    if thermal is not None:
+        anomaly = bool(thermal["anomaly_detected"])
+        notes = (
+            f"Hotspot: max {thermal['max_temp_c']}°C, dT {thermal['delta_t_c']}°C"
+            if anomaly
+            else f"No hotspot (max {thermal['max_temp_c']}°C)"
+        )
+    elif detections is not None:
+        anomaly = bool(detections)
+        notes = (
+            f"{len(detections)} detection(s), top {detections[0]['class']} at {detections[0]['confidence']:.2f}"
+            if anomaly
+            else "No detections"
+        )
+    else:
+        anomaly = detect_anomaly(file_path)
+        notes = "Flagged as potential issue" if anomaly else "No anomaly detected"
+    thermal = thermal or {}
+    record = {
         "file_name": file_path.name,
+        **({"path": relative_path} if relative_path else {}),
         "file_type": file_path.suffix.lower() or "unknown",
-        "size_bytes": file_path.stat().st_size,
+        "size_bytes": size if size is not None else file_path.stat().st_size,
         "anomaly_detected": anomaly,
-        "notes": "Flagged as potential issue" if anomaly else "No anomaly detected",
+        "notes": notes,
+        "max_temp_c": thermal.get("max_temp_c"),
+        "mean_temp_c": thermal.get("mean_temp_c"),
+        "delta_t_c": thermal.get("delta_t_c"),
     }
+    if sha256:
+        record["sha256"] = sha256
+    if detections is not None:
+        record["detections"] = detections
+    return record
+
+
+@dataclass
+class ScannedFile:
+    path: Path
+    # None when the file vanished before it could be read
+    size: Optional[int]
+    sha256: Optional[str] = None
+
+
+def _walk(directory: Path, top_level: bool) -> Iterator[Path]:
+    with os.scandir(directory) as entries:
+        ordered = sorted(entries, key=lambda entry: entry.name)
+    for entry in ordered:
+        if entry.name.startswith("."):
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            if not (top_level and entry.name == "annotated"):
+                yield from _walk(Path(entry.path), top_level=False)
+        elif entry.is_file():
+            yield Path(entry.path)
+
+
+def list_input_files(input_dir: Path) -> List[Path]:
+    """Uploaded files in the job folder, by path, skipping outputs and hidden bookkeeping files."""
+    return list(_walk(input_dir, top_level=True))
+
+
+def _scan_one(path: Path, hash_contents: bool) -> ScannedFile:
+    try:
+        with path.open("rb") as handle:
+            size = os.fstat(handle.fileno()).st_size
+            digest = hashlib.file_digest(handle, "sha256").hexdigest() if hash_contents else None
+    except (FileNotFoundError, IsADirectoryError):
+        return ScannedFile(path, None)
+    return ScannedFile(path, size, digest)
 
 
-def process_directory(input_dir: Path) -> Dict[str, object]:
+def scan_files(
+    paths: Iterable[Path], workers: int = SCAN_WORKERS, hash_contents: bool = True
+) -> Iterator[ScannedFile]:
+    """Size and SHA-256 of each file, yielded in the order of `paths` as they finish.
+
+    At most `workers` files are read at a time and only a few results wait
+    for an earlier slow file, so memory stays flat for any folder size.
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan") as pool:
+        pending: Deque = deque()
+        for path in paths:
+            pending.append(pool.submit(_scan_one, path, hash_contents))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def process_file(file_path: Path, annotated_dir: Path) -> List[Dict[str, object]]:
+    """Run the per-file stages on a single upload."""
+    thermal = radiometric.analyze_images([file_path], workers=1).get(file_path)
+    detections = detect_images([file_path]).get(file_path) if thermal is None else None
+    return _handle_file(file_path, annotated_dir, thermal, detections=detections)
+
+
+def analyze_files(
+    files: List[ScannedFile], store: Optional[BlobStore] = None
+) -> Tuple[Dict[Path, Dict[str, object]], Dict[Path, List[Dict[str, object]]]]:
+    """Temperatures and model detections for `files`, keyed by path.
+
+    Results are looked up in the blob store's cache by content digest first,
+    the same entries the streaming stage uses, and only the misses are
+    batched through the radiometric reader and the model.
+    """
+    cacheable = store is not None
+    thermal_kind = f"thermal-{radiometric.settings_fingerprint()}"
+    thermal: Dict[Path, Optional[Dict[str, object]]] = {}
+    for item in files:
+        cached = store.get_result(item.sha256, thermal_kind) if cacheable and item.sha256 else None
+        if cached is not None:
+            thermal[item.path] = cached["thermal"]
+    misses = [item for item in files if item.path not in thermal]
+    # Radiometric frames are thresholded in batches on real temperatures
+    measured = radiometric.analyze_images(item.path for item in misses)
+    for item in misses:
+        thermal[item.path] = measured.get(item.path)
+        if cacheable and item.sha256:
+            store.put_result(item.sha256, thermal_kind, {"thermal": thermal[item.path]})
+
+    detections: Dict[Path, List[Dict[str, object]]] = {}
+    unmeasured = [
+        item for item in files if thermal[item.path] is None and item.path.suffix.lower() in IMAGE_EXTENSIONS
+    ]
+    if unmeasured and inference.default_detector() is not None:
+        detect_kind = f"detect-{inference.settings_fingerprint()}"
+        misses = []
+        for item in unmeasured:
+            cached = store.get_result(item.sha256, detect_kind) if cacheable and item.sha256 else None
+            if cached is None:
+                misses.append(item)
+            elif cached["detections"] is not None:
+                detections[item.path] = cached["detections"]
+        # Frames without temperatures go through the model in batches
+        found = detect_images(item.path for item in misses)
+        for item in misses:
+            if item.path in found:
+                detections[item.path] = found[item.path]
+            if cacheable and item.sha256:
+                store.put_result(item.sha256, detect_kind, {"detections": found.get(item.path)})
+    return {path: value for path, value in thermal.items() if value is not None}, detections
+
+
+def load_records(records_path: Path) -> Dict[str, Dict[str, object]]:
+    """Records already written by the streaming stage, keyed by path in the job folder (last one wins)."""
+    done: Dict[str, Dict[str, object]] = {}
+    if not records_path.exists():
+        return done
+    with records_path.open() as handle:
+        for line in handle:
+            if line.strip():
+                record = json.loads(line)
+                # Records from before paths were stored only ever came from the top level
+                done[record.get("path", record["file_name"])] = record
+    return done
+
+
+def _process_files(
+    paths: List[Path], annotated_dir: Path, blob_root: Optional[Path]
+) -> Dict[Path, List[Dict[str, object]]]:
+    """Records for each of `paths`; a file that vanished before it could be read gets none."""
+    # Hashed up front so frames analysed before, in any job, come from the result cache
+    scanned = {item.path: item for item in scan_files(paths)}
+    thermal, detections = analyze_files(
+        [item for item in scanned.values() if item.size is not None],
+        BlobStore(blob_root) if blob_root is not None else None,
+    )
+    return {
+        path: _handle_file(path, annotated_dir, thermal.get(path), scanned[path], detections.get(path))
+        for path in paths
+    }
+
+
+def _pending_files(
+    input_dir: Path, records_path: Optional[Path]
+) -> Tuple[List[Path], Dict[str, Dict[str, object]], Dict[Path, str], List[Path]]:
+    """Every input file, the records already written by path, each file's path, and the files without one."""
+    files = list_input_files(input_dir)
+    done = load_records(records_path) if records_path else {}
+    keys = {file_path: file_path.relative_to(input_dir).as_posix() for file_path in files}
+    return files, done, keys, [f for f in files if keys[f] not in done]
+
+
+def process_batch(
+    input_dir: Path, records_path: Path, limit: int, blob_root: Optional[Path] = None
+) -> Tuple[int, int]:
+    """Process up to `limit` files that have no record yet, appending theirs to `records_path`.
+
+    Lets a large job's processing be split into work items that are
+    scheduled one at a time. Returns the files handled so far and the total.
+    """
+    annotated_dir = input_dir / "annotated"
+    annotated_dir.mkdir(exist_ok=True)
+    files, done, _, pending = _pending_files(input_dir, records_path)
+    batch = pending[:limit]
+    processed = _process_files(batch, annotated_dir, blob_root)
+    with records_path.open("a") as handle:
+        for path in batch:
+            handle.write("".join(json.dumps(record) + "\n" for record in processed[path]))
+    return len(files) - len(pending) + len(batch), len(files)
+
+
+def process_directory(
+    input_dir: Path, records_path: Optional[Path] = None, blob_root: Optional[Path] = None
+) -> Dict[str, object]:
     records: List[Dict[str, object]] = []
     annotated_dir = input_dir / "annotated"
     annotated_dir.mkdir(exist_ok=True)
 
-    for item in input_dir.iterdir():
-        if item.is_dir():
-            if item.name != "annotated":
-                for nested in item.rglob("*"):
-                    if nested.is_file():
-                        records.extend(_handle_file(nested, annotated_dir))
-            continue
-        records.extend(_handle_file(item, annotated_dir))
+    files, done, keys, pending = _pending_files(input_dir, records_path)
+    processed = _process_files(pending, annotated_dir, blob_root)
+    for file_path in files:
+        if keys[file_path] in done:
+            records.append(done[keys[file_path]])
+        else:
+            records.extend(processed[file_path])
 
+    df, summary = summarize(records)
+    return {"records": df, "rows": records, "summary": summary, "annotated_dir": annotated_dir}
+
+
+def summarize(records: List[Dict[str, object]]) -> Tuple[pd.DataFrame, Dict[str, int]]:
     df = pd.DataFrame(records)
     summary = {
         "total_files": int(len(df)),
         "anomalies_found": int(df[df["anomaly_detected"]].shape[0]) if not df.empty else 0,
     }
-    return {"records": df, "summary": summary, "annotated_dir": annotated_dir}
+    return df, summary
 
 
-def _handle_file(file_path: Path, annotated_dir: Path) -> List[Dict[str, object]]:
-    if not file_path.is_file():
+def _handle_file(
+    file_path: Path,
+    annotated_dir: Path,
+    thermal: Optional[Dict[str, object]] = None,
+    scanned: Optional[ScannedFile] = None,
+    detections: Optional[List[Dict[str, object]]] = None,
+) -> List[Dict[str, object]]:
+    scanned = scanned or _scan_one(file_path, hash_contents=True)
+    if scanned.size is None:
         return []
     records: List[Dict[str, object]] = []
-    record = build_record(file_path)
+    job_dir = annotated_dir.parent
+    relative_path = file_path.relative_to(job_dir).as_posix()
+    record = build_record(file_path, thermal, scanned.size, scanned.sha256, detections, relative_path)
     records.append(record)
 
     if file_path.suffix.lower() in IMAGE_EXTENSIONS:
-        target = annotated_dir / file_path.name
-        try:
-            target.write_bytes(file_path.read_bytes())
-        except Exception:
-            target.write_text("Annotated version unavailable")
+        if record["anomaly_detected"]:
+            # Mirrors the upload's folders so same-named frames do not overwrite each other
+            target = annotated_dir / relative_path
+            target.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                fileops.clone_file(file_path, target)
+            except OSError:
+                target.write_text("Annotated version unavailable")
+            record["annotated_path"] = target.relative_to(job_dir).as_posix()
+        else:
+            # Nothing to mark up, so the upload itself is the frame to show
+            record["annotated_path"] = relative_path
     return records
 
 
-def write_outputs(input_dir: Path, excel_path: Path, metadata_path: Path) -> None:
-    results = process_directory(input_dir)
-    df: pd.DataFrame = results["records"]
-    summary = results["summary"]
+def write_outputs(
+    input_dir: Path,
+    table_path: Path,
+    metadata_path: Path,
+    records_path: Optional[Path] = None,
+    blob_root: Optional[Path] = None,
+) -> List[Dict[str, object]]:
+    """Write the Parquet table and summary; returns the per-file records for the database.
+
+    With `blob_root`, per-image results are shared through that blob store's cache.
+    """
+    results = process_directory(input_dir, records_path, blob_root)
+    write_table(results["records"], results["summary"], table_path, metadata_path)
+    # The records as built, without the NaN padding a DataFrame gives keys only some files have
+    return results["rows"]
 
-    if df.empty:
-        df = pd.DataFrame([{
+
+def write_table(df: pd.DataFrame, summary: Dict[str, int], table_path: Path, metadata_path: Path) -> None:
+    """Write the records as Parquet, the format every later stage reads, with the summary in its metadata."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), SUMMARY_KEY: json.dumps(summary)})
+    pq.write_table(table, table_path, compression="zstd")
+    metadata_path.write_text(json.dumps(summary, indent=2))
+
+
+def read_summary(table_path: Path) -> Dict[str, int]:
+    """The summary stored in a Parquet table by `write_table`, read from the footer alone."""
+    metadata = pq.read_schema(table_path).metadata or {}
+    return json.loads(metadata[SUMMARY_KEY])
+
+
+def _cell(value: object) -> object:
+    # Detection lists go into cells as JSON text
+    return json.dumps(value) if isinstance(value, (list, dict)) else value
+
+
+def write_workbook(table_path: Path, excel_path: Path) -> None:
+    """Write the customer-facing Excel workbook from the Parquet table, in constant memory.
+
+    Rows are read a batch at a time and streamed through openpyxl's
+    write-only mode, which spools them to disk, so a 10,000-file job costs
+    no more memory than a small one. The workbook appears atomically.
+    """
+    source = pq.ParquetFile(table_path)
+    columns = source.schema_arrow.names
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Anomalies")
+    if source.metadata.num_rows:
+        sheet.append(columns)
+        for batch in source.iter_batches(batch_size=WORKBOOK_BATCH_ROWS):
+            for row in zip(*(batch.column(name).to_pylist() for name in columns)):
+                sheet.append([_cell(value) for value in row])
+    else:
+        placeholder = {
             "file_name": "No files processed",
             "file_type": "n/a",
             "size_bytes": 0,
             "anomaly_detected": False,
             "notes": "Upload files to generate a report",
-        }])
+            "max_temp_c": None,
+            "mean_temp_c": None,
+            "delta_t_c": None,
+        }
+        sheet.append(list(placeholder))
+        sheet.append(list(placeholder.values()))
 
-    with pd.ExcelWriter(excel_path) as writer:
-        df.to_excel(writer, index=False, sheet_name="Anomalies")
-        summary_df = pd.DataFrame([summary])
-        summary_df.to_excel(writer, index=False, sheet_name="Summary")
+    summary = json.loads((source.schema_arrow.metadata or {}).get(SUMMARY_KEY, b"{}"))
+    summary_sheet = workbook.create_sheet("Summary")
+    summary_sheet.append(list(summary))
+    summary_sheet.append(list(summary.values()))
 
-    metadata_path.write_text(json.dumps(summary, indent=2))
+    tmp = excel_path.with_name(f".{excel_path.name}.{os.getpid()}")
+    try:
+        workbook.save(tmp)
+        os.replace(tmp, excel_path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def warm_up() -> None:
+    """Import the Parquet and workbook writers once so the first job in a worker is not slower."""
+    pq.write_table(pa.Table.from_pandas(pd.DataFrame([{"file_name": ""}])), io.BytesIO())
+    workbook = Workbook(write_only=True)
+    workbook.create_sheet("Anomalies").append(["file_name"])
+    workbook.save(io.BytesIO())
 
 
 def main() -> None:
     if len(sys.argv) < 3:
-        print("Usage: python Drone_Data_Process.py <input_dir> <excel_path> [metadata_path]", file=sys.stderr)
+        print(
+            "Usage: python Drone_Data_Process.py <input_dir> <table_path.parquet|excel_path.xlsx>"
+            " [metadata_path] [records_path]",
+            file=sys.stderr,
+        )
         sys.exit(1)
 
     input_dir = Path(sys.argv[1]).expanduser().resolve()
-    excel_path = Path(sys.argv[2]).expanduser().resolve()
-    metadata_path = Path(sys.argv[3]).expanduser().resolve() if len(sys.argv) > 3 else excel_path.with_suffix(".json")
+    output_path = Path(sys.argv[2]).expanduser().resolve()
+    # An .xlsx output asks for the workbook too, next to the table it is built from
+    table_path = output_path.with_suffix(".parquet")
+    metadata_path = Path(sys.argv[3]).expanduser().resolve() if len(sys.argv) > 3 else table_path.with_suffix(".json")
+    records_path = Path(sys.argv[4]).expanduser().resolve() if len(sys.argv) > 4 else None
 
-    excel_path.parent.mkdir(parents=True, exist_ok=True)
+    table_path.parent.mkdir(parents=True, exist_ok=True)
     metadata_path.parent.mkdir(parents=True, exist_ok=True)
 
-    write_outputs(input_dir, excel_path, metadata_path)
-    print(f"Excel report generated at {excel_path}")
+    write_outputs(input_dir, table_path, metadata_path, records_path)
+    print(f"Parquet table written at {table_path}")
+    if output_path.suffix.lower() == ".xlsx":
+        write_workbook(table_path, output_path)
+        print(f"Excel report generated at {output_path}")
     print(f"Metadata summary saved at {metadata_path}")
 
 
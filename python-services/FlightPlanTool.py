@@ -37,8 +37,7 @@ def generate_paths(output_dir: Path) -> Dict[str, Path]:
   </Document>
 </kml>
 """.format(
-        coords="
-".join([f"        {lon},{lat},0" for lon, lat in EXAMPLE_COORDS])
+        coords="\n".join([f"        {lon},{lat},0" for lon, lat in EXAMPLE_COORDS])
     )
     kml_path.write_text(kml_content)
 
@@ -0,0 +1,164 @@
+"""Admission control: refuse new work up front instead of slowing down every job."""
+
+from __future__ import annotations
+
+import logging
+import math
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(RuntimeError):
+    """Over a limit; `status_code` is 429 or 503 and `retry_after` is in seconds."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int, reason: str) -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class _Rate:
+    """Exponentially weighted moving average of a per-event measurement."""
+
+    def __init__(self, initial: float, weight: float = 0.2) -> None:
+        self.value = initial
+        self.weight = weight
+        self.samples = 0
+
+    def update(self, sample: float) -> None:
+        self.value = sample if self.samples == 0 else self.weight * sample + (1 - self.weight) * self.value
+        self.samples += 1
+
+
+class AdmissionController:
+    """Caps waiting jobs, upload bytes in flight and disk use.
+
+    `backlog()` returns the queued and running job counts shared by every
+    replica; jobs still being received by this replica count as queued, so
+    at most `max_queued` jobs wait at any time. How many run at once is up to
+    the workers' own concurrency. Retry-After is estimated from the recent
+    average job duration and upload throughput. When `backlog()` raises one
+    of `backlog_errors` (the database is unreachable), new jobs get a 503
+    with `backlog_retry_after` rather than an error.
+    """
+
+    def __init__(
+        self,
+        disk_path: Path,
+        max_queued: int,
+        max_inflight_bytes: int,
+        min_free_bytes: int,
+        backlog: Callable[[], Tuple[int, int]],
+        backlog_errors: Tuple[Type[BaseException], ...] = (),
+        disk_retry_after: int = 300,
+        backlog_retry_after: int = 5,
+        max_retry_after: int = 600,
+    ) -> None:
+        self.disk_path = disk_path
+        self.max_queued = max(1, max_queued)
+        self.backlog = backlog
+        self.backlog_errors = backlog_errors
+        self.backlog_retry_after = backlog_retry_after
+        self.max_inflight_bytes = max_inflight_bytes
+        self.min_free_bytes = min_free_bytes
+        self.disk_retry_after = disk_retry_after
+        self.max_retry_after = max_retry_after
+        self._lock = threading.Lock()
+        self._receiving = 0
+        self._inflight_bytes = 0
+        self._job_seconds = _Rate(initial=30.0)
+        self._upload_rate = _Rate(initial=10 * 1024 * 1024)
+
+    def _clamp(self, seconds: float) -> int:
+        return max(1, min(self.max_retry_after, math.ceil(seconds)))
+
+    def _reject(self, status_code: int, reason: str, detail: str, retry_after: float) -> None:
+        raise AdmissionRejected(status_code, detail, self._clamp(retry_after), reason)
+
+    def check_disk(self, needed_bytes: int = 0) -> None:
+        free = shutil.disk_usage(self.disk_path).free
+        if free - needed_bytes < self.min_free_bytes:
+            self._reject(503, "disk", "Not enough free disk space to accept uploads", self.disk_retry_after)
+
+    def admit_job(self, expected_bytes: int = 0) -> None:
+        """Take a slot for a job about to be received; `release_job` once it is queued or abandoned."""
+        self.check_disk(expected_bytes)
+        try:
+            queued, running = self.backlog()
+        except self.backlog_errors as exc:
+            logger.warning("Could not read the job backlog for admission: %s", exc)
+            self._reject(503, "backlog", "Job queue temporarily unavailable", self.backlog_retry_after)
+        with self._lock:
+            waiting = queued + self._receiving
+            if waiting >= self.max_queued:
+                # The backlog drains as many at a time as are running now
+                waves = (waiting - self.max_queued) // max(running, 1) + 1
+                self._reject(429, "jobs", "Too many jobs waiting", waves * self._job_seconds.value)
+            self._receiving += 1
+
+    def release_job(self) -> None:
+        with self._lock:
+            self._receiving = max(0, self._receiving - 1)
+
+    def observe_job_duration(self, seconds: float) -> None:
+        with self._lock:
+            self._job_seconds.update(seconds)
+
+    def reserve_upload(self, expected: int) -> "UploadReservation":
+        """Count `expected` upload bytes as in flight until the reservation is released."""
+        with self._lock:
+            # A lone upload is always let through, however large, so it cannot be starved
+            if self._inflight_bytes and self._inflight_bytes + expected > self.max_inflight_bytes:
+                excess = self._inflight_bytes + expected - self.max_inflight_bytes
+                self._reject(429, "bytes", "Too many uploads in progress", excess / self._upload_rate.value)
+            self._inflight_bytes += expected
+        return UploadReservation(self, expected)
+
+    def _grow(self, amount: int) -> None:
+        with self._lock:
+            self._inflight_bytes += amount
+
+    def _release_upload(self, reservation: "UploadReservation") -> None:
+        elapsed = time.monotonic() - reservation.started
+        with self._lock:
+            self._inflight_bytes -= reservation.reserved
+            if reservation.received and elapsed > 0.05:
+                self._upload_rate.update(reservation.received / elapsed)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "receiving_jobs": self._receiving,
+                "max_queued_jobs": self.max_queued,
+                "inflight_bytes": self._inflight_bytes,
+                "avg_job_seconds": round(self._job_seconds.value, 3),
+                "upload_bytes_per_second": round(self._upload_rate.value),
+            }
+
+
+class UploadReservation:
+    def __init__(self, controller: AdmissionController, reserved: int) -> None:
+        self._controller = controller
+        self.reserved = reserved
+        self.received = 0
+        self.started = time.monotonic()
+        self._released = False
+
+    def received_bytes(self, amount: int) -> None:
+        """Count body bytes; bodies without a length grow the reservation as they arrive."""
+        self.received += amount
+        if self.received > self.reserved:
+            self._controller._grow(self.received - self.reserved)
+            self.reserved = self.received
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release_upload(self)
@@ -0,0 +1,432 @@
+"""Streaming extraction of zip and tar(.gz) uploads, one member at a time."""
+
+from __future__ import annotations
+
+import struct
+import zlib
+from pathlib import PurePosixPath
+from typing import Callable, Optional
+
+from blob_store import BlobStore, BlobWriter
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz")
+
+# Limits per archive; a zip bomb or tarball of junk fails fast instead of filling the disk
+MAX_MEMBERS = 20000
+MAX_MEMBER_BYTES = 1024 * 1024 * 1024
+MAX_TOTAL_BYTES = 50 * 1024 * 1024 * 1024
+# Extracted bytes per compressed byte; deflate tops out near 1030, imagery far below 250
+MAX_RATIO = 250
+# Decompressed output is produced in pieces of this size at most
+OUT_CHUNK = 1024 * 1024
+# Path and pax header blocks are read into memory
+MAX_META_BYTES = 64 * 1024
+
+_ZIP_LOCAL = b"PK\x03\x04"
+_ZIP_DESCRIPTOR = b"PK\x07\x08"
+# Central directory, end of central directory (plain and zip64) and signature records
+_ZIP_TRAILERS = (b"PK\x01\x02", b"PK\x05\x06", b"PK\x06\x06", b"PK\x06\x07", b"PK\x05\x05")
+_TAR_BLOCK = 512
+
+
+class ArchiveError(ValueError):
+    """The archive is malformed, unsupported or over a limit."""
+
+
+def is_archive(filename: str) -> bool:
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def member_name(raw: str) -> Optional[str]:
+    """The file name a member is extracted as, or None to skip it.
+
+    Members are flattened into the job folder. Anything under a hidden or
+    `__MACOSX` directory, or hidden itself, is skipped; `..` anywhere in the
+    path rejects the whole archive.
+    """
+    parts = [part for part in raw.replace("\\", "/").split("/") if part not in ("", ".")]
+    if ".." in parts:
+        raise ArchiveError(f"Archive member escapes the job folder: {raw!r}")
+    if not parts or any(part.startswith(".") or part == "__MACOSX" for part in parts):
+        return None
+    name = PurePosixPath(parts[-1]).name
+    if ":" in name or "\x00" in name:
+        return None
+    return name
+
+
+def open_extractor(
+    filename: str, store: BlobStore, on_member: Callable[[str, str], None]
+) -> "StreamExtractor":
+    """Extractor for an upload named `filename`, chosen by its suffix."""
+    if filename.lower().endswith(".zip"):
+        return ZipExtractor(store, on_member)
+    return TarExtractor(store, on_member)
+
+
+class StreamExtractor:
+    """Push parser: `write` archive bytes as they arrive, `finish` at the end.
+
+    Each regular file member is streamed into the blob store and
+    `on_member(name, digest)` is called as soon as it is complete, with the
+    name from `member_name`. Directories, links and devices are skipped.
+    """
+
+    def __init__(self, store: BlobStore, on_member: Callable[[str, str], None]) -> None:
+        self.store = store
+        self.on_member = on_member
+        self.members = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._buf = bytearray()
+        self._name: Optional[str] = None
+        self._blob: Optional[BlobWriter] = None
+        self._member_bytes = 0
+        self._done = False
+
+    def write(self, data: bytes) -> None:
+        self.bytes_in += len(data)
+        if not self._done:
+            try:
+                self._feed(data)
+            except (zlib.error, struct.error, UnicodeDecodeError) as exc:
+                raise ArchiveError(f"Archive is corrupt: {exc}") from exc
+
+    def finish(self) -> None:
+        if not self._done:
+            raise ArchiveError("Archive is truncated")
+
+    def close(self) -> None:
+        if self._blob is not None:
+            self._blob.abort()
+            self._blob = None
+
+    def _feed(self, data: bytes) -> None:
+        raise NotImplementedError
+
+    def _begin_member(self, raw_name: str, regular: bool = True) -> None:
+        self.members += 1
+        if self.members > MAX_MEMBERS:
+            raise ArchiveError(f"Archive has more than {MAX_MEMBERS} members")
+        self._name = member_name(raw_name) if regular else None
+        self._member_bytes = 0
+        if self._name is not None:
+            self._blob = self.store.writer()
+
+    def _member_data(self, data: bytes) -> None:
+        self._member_bytes += len(data)
+        self.bytes_out += len(data)
+        if self._member_bytes > MAX_MEMBER_BYTES:
+            raise ArchiveError(f"Archive member is larger than {MAX_MEMBER_BYTES} bytes")
+        if self.bytes_out > MAX_TOTAL_BYTES:
+            raise ArchiveError(f"Archive expands to more than {MAX_TOTAL_BYTES} bytes")
+        if self.bytes_out > OUT_CHUNK and self.bytes_out > MAX_RATIO * self.bytes_in:
+            raise ArchiveError("Archive compression ratio is implausibly high")
+        if self._blob is not None:
+            self._blob.write(data)
+
+    def _end_member(self) -> None:
+        if self._blob is not None:
+            digest = self._blob.commit()
+            self._blob = None
+            self.on_member(self._name, digest)
+        self._name = None
+
+
+class ZipExtractor(StreamExtractor):
+    """Reads zip local file headers in order, without the central directory.
+
+    Stored and deflated members are supported. A deflated member may put its
+    sizes in a trailing data descriptor, since deflate marks its own end; a
+    stored one must have them up front.
+    """
+
+    def __init__(self, store: BlobStore, on_member: Callable[[str, str], None]) -> None:
+        super().__init__(store, on_member)
+        self._state = "header"
+        self._remaining = 0
+        self._inflater = None
+        self._crc = 0
+        self._expect_crc = 0
+        self._expect_size = 0
+        self._descriptor = False
+        self._zip64 = False
+
+    def _feed(self, data: bytes) -> None:
+        self._buf += data
+        while not self._done:
+            if self._state == "header":
+                if not self._read_header():
+                    return
+            elif self._state == "data":
+                if not self._read_data():
+                    return
+            elif not self._read_descriptor():
+                return
+
+    def _read_header(self) -> bool:
+        if len(self._buf) < 4:
+            return False
+        signature = bytes(self._buf[:4])
+        if signature in _ZIP_TRAILERS:
+            # The central directory repeats what has been read already
+            self._done = True
+            self._buf.clear()
+            return False
+        if signature != _ZIP_LOCAL:
+            raise ArchiveError("Not a zip archive, or a corrupt one")
+        if len(self._buf) < 30:
+            return False
+        (flags, method, crc, csize, usize, name_len, extra_len) = struct.unpack_from(
+            "<2xHH4xIIIHH", self._buf, 4
+        )
+        if len(self._buf) < 30 + name_len + extra_len:
+            return False
+        raw_name = bytes(self._buf[30:30 + name_len]).decode("utf-8" if flags & 0x800 else "cp437")
+        extra = bytes(self._buf[30 + name_len:30 + name_len + extra_len])
+        del self._buf[:30 + name_len + extra_len]
+
+        self._zip64 = False
+        offset = 0
+        while offset + 4 <= len(extra):
+            tag, size = struct.unpack_from("<HH", extra, offset)
+            if tag == 0x0001:
+                self._zip64 = True
+                values = list(struct.unpack_from(f"<{min(size, 16) // 8}Q", extra, offset + 4))
+                if usize == 0xFFFFFFFF and values:
+                    usize = values.pop(0)
+                if csize == 0xFFFFFFFF and values:
+                    csize = values.pop(0)
+            offset += 4 + size
+
+        if flags & 0x1:
+            raise ArchiveError(f"Encrypted zip members are not supported: {raw_name}")
+        if method not in (0, 8):
+            raise ArchiveError(f"Unsupported zip compression method {method}: {raw_name}")
+        self._descriptor = bool(flags & 0x8)
+        if self._descriptor and method == 0:
+            raise ArchiveError(f"Stored zip member without sizes cannot be streamed: {raw_name}")
+
+        self._begin_member(raw_name, regular=not raw_name.endswith("/"))
+        self._crc = 0
+        self._expect_crc, self._expect_size = crc, usize
+        self._remaining = csize
+        self._inflater = zlib.decompressobj(-15) if method == 8 else None
+        self._state = "data"
+        return True
+
+    def _emit(self, data: bytes) -> None:
+        if data:
+            self._crc = zlib.crc32(data, self._crc)
+            self._member_data(data)
+
+    def _read_data(self) -> bool:
+        if self._inflater is None:
+            take = min(self._remaining, len(self._buf))
+            self._emit(bytes(self._buf[:take]))
+            del self._buf[:take]
+            self._remaining -= take
+            if self._remaining:
+                return False
+            self._end_entry()
+            return True
+
+        if not self._buf:
+            return False
+        take = len(self._buf) if self._descriptor else min(self._remaining, len(self._buf))
+        chunk = bytes(self._buf[:take])
+        del self._buf[:take]
+        self._remaining -= take
+        self._emit(self._inflater.decompress(chunk, OUT_CHUNK))
+        while self._inflater.unconsumed_tail:
+            self._emit(self._inflater.decompress(self._inflater.unconsumed_tail, OUT_CHUNK))
+        if not self._inflater.eof:
+            if not self._descriptor and not self._remaining:
+                raise ArchiveError(f"Zip member {self._name!r} is corrupt")
+            return False
+        if self._descriptor:
+            # Whatever followed the deflate stream belongs to the descriptor
+            self._buf[:0] = self._inflater.unused_data
+            self._state = "descriptor"
+        elif self._remaining or self._inflater.unused_data:
+            raise ArchiveError(f"Zip member {self._name!r} is corrupt")
+        else:
+            self._end_entry()
+        return True
+
+    def _read_descriptor(self) -> bool:
+        size_format = "<QQ" if self._zip64 else "<II"
+        length = 4 + struct.calcsize(size_format)
+        has_signature = self._buf[:4] == _ZIP_DESCRIPTOR
+        if len(self._buf) < length + (4 if has_signature else 0):
+            return False
+        if has_signature:
+            del self._buf[:4]
+        (self._expect_crc,) = struct.unpack_from("<I", self._buf)
+        _, self._expect_size = struct.unpack_from(size_format, self._buf, 4)
+        del self._buf[:length]
+        self._end_entry()
+        return True
+
+    def _end_entry(self) -> None:
+        if self._crc != self._expect_crc or self._member_bytes != self._expect_size:
+            raise ArchiveError(f"Zip member {self._name!r} failed its checksum")
+        self._end_member()
+        self._inflater = None
+        self._state = "header"
+
+
+class TarExtractor(StreamExtractor):
+    """Reads ustar, GNU and pax tar streams, gunzipping first if needed.
+
+    Long names from GNU `L` records and pax `path` keys are honoured; the
+    archive ends at its first zero block.
+    """
+
+    def __init__(self, store: BlobStore, on_member: Callable[[str, str], None]) -> None:
+        super().__init__(store, on_member)
+        self._sniffed = False
+        self._gunzip = None
+        self._remaining = 0
+        self._padding = 0
+        self._meta: Optional[bytearray] = None
+        self._meta_kind = b""
+        self._long_name: Optional[str] = None
+        self._pax: dict = {}
+        self._in_member = False
+
+    def _feed(self, data: bytes) -> None:
+        if not self._sniffed:
+            self._buf += data
+            if len(self._buf) < 2:
+                return
+            self._sniffed = True
+            if self._buf[:2] == b"\x1f\x8b":
+                self._gunzip = zlib.decompressobj(31)
+            data = bytes(self._buf)
+            self._buf.clear()
+        if self._gunzip is None:
+            self._feed_tar(data)
+            return
+        while data and not self._done:
+            self._feed_tar(self._gunzip.decompress(data, OUT_CHUNK))
+            data = self._gunzip.unconsumed_tail
+            if self._gunzip.eof:
+                # Concatenated gzip members continue the same tar stream
+                data = self._gunzip.unused_data + data
+                self._gunzip = zlib.decompressobj(31)
+
+    def _feed_tar(self, data: bytes) -> None:
+        self._buf += data
+        while not self._done:
+            if self._remaining or self._padding:
+                if not self._buf:
+                    return
+                take = min(self._remaining, len(self._buf))
+                if take:
+                    chunk = bytes(self._buf[:take])
+                    del self._buf[:take]
+                    self._remaining -= take
+                    self._member_chunk(chunk)
+                if self._remaining:
+                    return
+                skip = min(self._padding, len(self._buf))
+                del self._buf[:skip]
+                self._padding -= skip
+                if self._padding:
+                    return
+                self._end_record()
+            elif len(self._buf) < _TAR_BLOCK:
+                return
+            else:
+                header = bytes(self._buf[:_TAR_BLOCK])
+                del self._buf[:_TAR_BLOCK]
+                self._read_header(header)
+
+    def _member_chunk(self, chunk: bytes) -> None:
+        if self._meta is not None:
+            self._meta += chunk
+            if len(self._meta) > MAX_META_BYTES:
+                raise ArchiveError("Tar header record is too large")
+        elif self._in_member:
+            self._member_data(chunk)
+        else:
+            # Data of a skipped entry still counts towards the expansion limits
+            self.bytes_out += len(chunk)
+
+    @staticmethod
+    def _number(field: bytes) -> int:
+        if field[:1] and field[0] & 0x80:
+            # GNU base-256 for values that do not fit in octal
+            return int.from_bytes(bytes([field[0] & 0x7F]) + field[1:], "big")
+        text = field.split(b"\x00", 1)[0].strip()
+        try:
+            return int(text, 8) if text else 0
+        except ValueError:
+            raise ArchiveError("Not a tar archive, or a corrupt one") from None
+
+    def _read_header(self, header: bytes) -> None:
+        if header == bytes(_TAR_BLOCK):
+            self._done = True
+            self._buf.clear()
+            return
+        stored = self._number(header[148:156])
+        if stored != sum(header[:148]) + 8 * 32 + sum(header[156:]):
+            raise ArchiveError("Not a tar archive, or a corrupt one")
+
+        kind = header[156:157]
+        size = self._pax.get("size", self._number(header[124:136]))
+        self._remaining = int(size)
+        self._padding = -self._remaining % _TAR_BLOCK
+
+        if kind in (b"L", b"x", b"g"):
+            self._meta = bytearray()
+            self._meta_kind = kind
+        elif kind in (b"0", b"\x00", b"7"):
+            name = header[:100].split(b"\x00", 1)[0]
+            if header[257:262] == b"ustar" and header[345:500].strip(b"\x00"):
+                name = header[345:500].split(b"\x00", 1)[0] + b"/" + name
+            raw_name = self._pax.get("path") or self._long_name or name.decode("utf-8", "replace")
+            self._begin_member(raw_name)
+            self._in_member = True
+        else:
+            # Directories, links, devices and fifos are never created
+            self._begin_member("", regular=False)
+
+        if kind not in (b"L", b"x", b"g"):
+            self._long_name = None
+            self._pax = {}
+        if not self._remaining and not self._padding:
+            self._end_record()
+
+    def _end_record(self) -> None:
+        if self._meta is not None:
+            meta, kind = bytes(self._meta), self._meta_kind
+            self._meta = None
+            if kind == b"L":
+                self._long_name = meta.split(b"\x00", 1)[0].decode("utf-8", "replace")
+            elif kind == b"x":
+                self._pax = self._parse_pax(meta)
+        elif self._in_member:
+            self._in_member = False
+            self._end_member()
+
+    @staticmethod
+    def _parse_pax(data: bytes) -> dict:
+        values: dict = {}
+        while data:
+            length_text, _, rest = data.partition(b" ")
+            try:
+                length = int(length_text)
+            except ValueError:
+                raise ArchiveError("Malformed pax header") from None
+            if length <= len(length_text):
+                raise ArchiveError("Malformed pax header")
+            record = data[len(length_text) + 1:length].rstrip(b"\n")
+            key, _, value = record.partition(b"=")
+            if key == b"path":
+                values["path"] = value.decode("utf-8", "replace")
+            elif key == b"size":
+                values["size"] = int(value)
+            data = data[length:]
+        return values
@@ -0,0 +1,99 @@
+"""Images per second of the CPU inference backend at each batch size.
+
+Usage:
+    python benchmark_inference.py --model model.onnx [--images DIR] [--count 64]
+        [--batch-sizes 1,2,4,8,16] [--threads 0] [--preprocess-workers 4] [--json]
+
+Without --images, --count synthetic thermal-sized JPEGs are written to a
+temporary folder. Each batch size gets one untimed warm-up pass, then
+--repeat timed passes over every image; the best pass is reported.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+from PIL import Image
+
+import inference
+
+# DJI M30T/H20T thermal frame size
+SYNTHETIC_SIZE = (640, 512)
+
+
+def synthetic_images(folder: Path, count: int) -> List[Path]:
+    rng = np.random.default_rng(0)
+    paths = []
+    for index in range(count):
+        frame = rng.normal(90, 20, (SYNTHETIC_SIZE[1], SYNTHETIC_SIZE[0])).clip(0, 255).astype(np.uint8)
+        x, y = rng.integers(0, SYNTHETIC_SIZE[0] - 40), rng.integers(0, SYNTHETIC_SIZE[1] - 40)
+        frame[y:y + 20, x:x + 30] = 250
+        path = folder / f"frame_{index:04d}.jpg"
+        Image.fromarray(frame).convert("RGB").save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def run(detector: inference.Detector, paths: List[Path], batch_sizes: List[int], repeat: int) -> List[Dict]:
+    rows = []
+    for batch_size in batch_sizes:
+        detector.detect(paths[:batch_size], batch_size)
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            detector.detect(paths, batch_size)
+            best = min(best, time.perf_counter() - started)
+        rows.append({
+            "batch_size": detector.fixed_batch or batch_size,
+            "images": len(paths),
+            "seconds": round(best, 3),
+            "images_per_second": round(len(paths) / best, 1),
+            "ms_per_image": round(best / len(paths) * 1000, 2),
+        })
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", type=Path, required=True)
+    parser.add_argument("--images", type=Path, help="folder of images; synthetic frames when omitted")
+    parser.add_argument("--count", type=int, default=64)
+    parser.add_argument("--batch-sizes", default="1,2,4,8,16")
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads; 0 uses every core")
+    parser.add_argument("--preprocess-workers", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    detector = inference.Detector(
+        args.model, intra_op_threads=args.threads, preprocess_workers=args.preprocess_workers
+    )
+    batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.images:
+            paths = sorted(
+                p for p in args.images.iterdir() if p.suffix.lower() in {".jpg", ".jpeg", ".png", ".tif", ".tiff"}
+            )[: args.count]
+        else:
+            paths = synthetic_images(Path(tmp), args.count)
+        rows = run(detector, paths, batch_sizes, args.repeat)
+    detector.close()
+
+    if args.json:
+        print(json.dumps({"model": str(args.model), "threads": args.threads, "cpus": os.cpu_count(), "runs": rows}))
+        return
+    print(f"{args.model.name}: {len(paths)} images, {args.threads or 'all'} intra-op threads, {os.cpu_count()} CPUs")
+    print(f"{'batch':>5} {'images/s':>10} {'ms/image':>9} {'seconds':>8}")
+    for row in rows:
+        print(f"{row['batch_size']:>5} {row['images_per_second']:>10} {row['ms_per_image']:>9} {row['seconds']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""Content-addressed store for uploaded files and the per-image results derived from them."""
+
+from __future__ import annotations
+
+import errno
+import hashlib
+import json
+import logging
+import os
+import stat
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import fileops
+
+logger = logging.getLogger(__name__)
+
+
+class BlobWriter:
+    """Streams one upload into a temporary file, hashing it on the way."""
+
+    def __init__(self, store: "BlobStore") -> None:
+        self._store = store
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+        fd, name = tempfile.mkstemp(dir=store.tmp_dir)
+        self._fd: Optional[int] = fd
+        self._tmp_path = Path(name)
+
+    def write(self, data: bytes) -> None:
+        view = memoryview(data)
+        self._sha256.update(view)
+        self.size += len(view)
+        while view:
+            view = view[os.write(self._fd, view):]
+
+    def commit(self) -> str:
+        """Move the data into the store and return its sha256 hex digest."""
+        os.close(self._fd)
+        self._fd = None
+        digest = self._sha256.hexdigest()
+        self._store._install(self._tmp_path, digest)
+        return digest
+
+    def abort(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            self._tmp_path.unlink(missing_ok=True)
+
+
+class BlobStore:
+    """Files stored once under their sha256 and hard-linked into job folders.
+
+    Objects are made read-only because every job folder that references one
+    shares its inode; anything that needs to modify an input must write a new
+    file. Per-image results are cached as JSON under the same digest so a
+    duplicate frame is never analysed twice.
+
+    Layout under `root`::
+
+        objects/ab/abcdef...        file contents
+        results/<kind>/ab/abcdef... cached JSON results
+        tmp/                        uploads in progress
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self.objects_dir = root / "objects"
+        self.results_dir = root / "results"
+        self.tmp_dir = root / "tmp"
+        for directory in (self.objects_dir, self.results_dir, self.tmp_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+
+    def object_path(self, digest: str) -> Path:
+        return self.objects_dir / digest[:2] / digest
+
+    def writer(self) -> BlobWriter:
+        return BlobWriter(self)
+
+    def _install(self, tmp_path: Path, digest: str) -> None:
+        target = self.object_path(digest)
+        if target.exists():
+            tmp_path.unlink()
+            return
+        target.parent.mkdir(exist_ok=True)
+        os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        # Two uploads of the same content may race here; both hold identical bytes
+        os.replace(tmp_path, target)
+
+    def adopt(self, path: Path, digest: str) -> None:
+        """Bring a file that was written in place (e.g. by ranged uploads) into the store.
+
+        If the content is already stored, `path` is swapped for a link to the
+        existing object and its own copy is freed.
+        """
+        target = self.object_path(digest)
+        target.parent.mkdir(exist_ok=True)
+        try:
+            os.link(path, target)
+        except FileExistsError:
+            self.link_into(digest, path)
+            return
+        except OSError as exc:
+            if exc.errno != errno.EXDEV:
+                raise
+            # Reflinks where the filesystem allows, and the object appears atomically either way
+            fileops.clone_file(path, target, allow_link=False)
+        os.chmod(target, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+    def link_into(self, digest: str, destination: Path) -> None:
+        """Place the object at `destination`, replacing whatever is there."""
+        source = self.object_path(digest)
+        tmp = destination.with_name(f".{destination.name}.{uuid.uuid4().hex[:8]}")
+        try:
+            os.link(source, tmp)
+        except OSError as exc:
+            if exc.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            fileops.copy_file(source, tmp)
+        os.replace(tmp, destination)
+
+    def _result_path(self, digest: str, kind: str) -> Path:
+        return self.results_dir / kind / digest[:2] / f"{digest}.json"
+
+    def get_result(self, digest: str, kind: str) -> Optional[dict]:
+        try:
+            return json.loads(self._result_path(digest, kind).read_text())
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            return None
+
+    def put_result(self, digest: str, kind: str, value: dict) -> None:
+        path = self._result_path(digest, kind)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}")
+        tmp.write_text(json.dumps(value))
+        os.replace(tmp, path)
+
+    def collect_garbage(self, min_age_seconds: float = 24 * 3600) -> int:
+        """Delete objects no job folder links to any more, with their cached results.
+
+        Only objects older than `min_age_seconds` are considered so an upload
+        that is being linked right now is never collected. Returns the number
+        of objects removed.
+        """
+        cutoff = time.time() - min_age_seconds
+        removed = 0
+        for path in self.objects_dir.glob("*/*"):
+            try:
+                info = path.stat()
+            except FileNotFoundError:
+                continue
+            if info.st_nlink > 1 or info.st_mtime > cutoff:
+                continue
+            path.unlink(missing_ok=True)
+            for result in self.results_dir.glob(f"*/{path.name[:2]}/{path.name}.json"):
+                result.unlink(missing_ok=True)
+            removed += 1
+        for path in self.tmp_dir.iterdir():
+            if path.stat().st_mtime < cutoff:
+                path.unlink(missing_ok=True)
+        if removed:
+            logger.info("Removed %d unreferenced blobs", removed)
+        return removed
@@ -0,0 +1,182 @@
+"""Bounded, health-checked psycopg2 connection pool shared by the Python service."""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, Tuple
+
+import psycopg2
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(RuntimeError):
+    """No connection became free within the acquire timeout."""
+
+
+class ConnectionPool:
+    """Thread-safe pool of at most `maxconn` connections.
+
+    Callers wait (up to `acquire_timeout` seconds) for a free slot rather than
+    failing outright. Idle connections are pinged before reuse once they have
+    been idle longer than `idle_check` seconds, and connections older than
+    `max_lifetime` seconds are closed and replaced.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        minconn: int = 1,
+        maxconn: int = 10,
+        max_lifetime: float = 1800.0,
+        idle_check: float = 30.0,
+        acquire_timeout: float = 30.0,
+        **connect_kwargs,
+    ) -> None:
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.max_lifetime = max_lifetime
+        self.idle_check = idle_check
+        self.acquire_timeout = acquire_timeout
+        self._connect_kwargs = connect_kwargs
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        # (connection, created_at, last_used); reused LIFO so spares go stale and get recycled
+        self._idle: Deque[Tuple[extensions.connection, float, float]] = deque()
+        self._created_at: Dict[int, float] = {}
+        self._stats = {
+            "acquired": 0,
+            "waits": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "timeouts": 0,
+            "connections_opened": 0,
+            "connections_recycled": 0,
+            "health_check_failures": 0,
+        }
+
+    def open(self) -> None:
+        """Pre-open `minconn` connections so the first requests skip the handshake."""
+        opened = []
+        for _ in range(self.minconn - len(self._idle)):
+            opened.append(self._connect())
+        now = time.monotonic()
+        with self._lock:
+            self._idle.extend((conn, self._created_at[id(conn)], now) for conn in opened)
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _, _ in idle:
+            self._discard(conn, recycled=False)
+
+    @contextmanager
+    def connection(self) -> Iterator[extensions.connection]:
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise PoolTimeout(f"No database connection available after {self.acquire_timeout:g}s")
+        waited = time.monotonic() - started
+        with self._lock:
+            self._stats["acquired"] += 1
+            self._stats["wait_seconds_total"] += waited
+            self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], waited)
+            if waited > 0.001:
+                self._stats["waits"] += 1
+
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn
+        except Exception:
+            if conn is not None and not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    self._discard(conn)
+                    conn = None
+            raise
+        finally:
+            if conn is not None:
+                self._checkin(conn)
+            self._slots.release()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["idle"] = len(self._idle)
+            stats["open"] = len(self._created_at)
+        stats["in_use"] = stats["open"] - stats["idle"]
+        stats["max"] = self.maxconn
+        return stats
+
+    def _connect(self) -> extensions.connection:
+        conn = psycopg2.connect(self.dsn, **self._connect_kwargs)
+        with self._lock:
+            self._created_at[id(conn)] = time.monotonic()
+            self._stats["connections_opened"] += 1
+        return conn
+
+    def _discard(self, conn: extensions.connection, recycled: bool = True) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._lock:
+            self._created_at.pop(id(conn), None)
+            if recycled:
+                self._stats["connections_recycled"] += 1
+
+    def _checkout(self) -> extensions.connection:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, created_at, last_used = self._idle.pop()
+            now = time.monotonic()
+            if conn.closed or now - created_at > self.max_lifetime:
+                self._discard(conn)
+                continue
+            if now - last_used > self.idle_check and not self._ping(conn):
+                with self._lock:
+                    self._stats["health_check_failures"] += 1
+                self._discard(conn)
+                continue
+            return conn
+        return self._connect()
+
+    def _checkin(self, conn: extensions.connection) -> None:
+        if conn.closed:
+            self._discard(conn)
+            return
+        created_at = self._created_at.get(id(conn), 0.0)
+        if time.monotonic() - created_at > self.max_lifetime:
+            self._discard(conn)
+            return
+        if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            # Leave no half-finished transaction behind for the next borrower
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                self._discard(conn)
+                return
+        with self._lock:
+            self._idle.append((conn, created_at, time.monotonic()))
+
+    @staticmethod
+    def _ping(conn: extensions.connection) -> bool:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            logger.warning("Dropping unhealthy pooled database connection")
+            return False
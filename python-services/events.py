@@ -0,0 +1,120 @@
+"""In-process publish/subscribe of job progress, served as Server-Sent Events."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+TERMINAL_STATUSES = {"completed", "failed", "cancelled", "timed_out"}
+
+
+@dataclass
+class Event:
+    id: str
+    type: str
+    data: Dict[str, object]
+
+    def encode(self) -> str:
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data)}\n\n"
+
+    @property
+    def is_terminal(self) -> bool:
+        return self.type == "status" and self.data.get("status") in TERMINAL_STATUSES
+
+
+@dataclass
+class _Channel:
+    history: List[Event] = field(default_factory=list)
+    subscribers: Set["Subscription"] = field(default_factory=set)
+    next_seq: int = 1
+    finished_at: Optional[float] = None
+
+
+class Subscription:
+    def __init__(self, job_id: str, loop: asyncio.AbstractEventLoop) -> None:
+        self.job_id = job_id
+        self.loop = loop
+        self.queue: "asyncio.Queue[Event]" = asyncio.Queue()
+        # Buffered events the client has not seen; None when the broker has no
+        # history for the job and the caller must send a snapshot instead
+        self.replay: Optional[List[Event]] = None
+
+
+class EventBroker:
+    """Per-job event channels fed from worker threads and read by async SSE handlers.
+
+    Event ids are `<epoch>-<seq>`, where the epoch changes on every restart,
+    so a Last-Event-ID from an earlier process is recognised as stale.
+    Progress counts are cumulative, so only the latest progress event is kept
+    in a job's history; that keeps replay complete without a size cap.
+    """
+
+    def __init__(self, retention_seconds: float = 600.0) -> None:
+        self.epoch = uuid.uuid4().hex[:8]
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._channels: Dict[str, _Channel] = {}
+
+    def publish(self, job_id: str, event_type: str, data: Dict[str, object]) -> Event:
+        with self._lock:
+            channel = self._channels.setdefault(job_id, _Channel())
+            event = Event(f"{self.epoch}-{channel.next_seq}", event_type, data)
+            channel.next_seq += 1
+            if event_type == "progress":
+                channel.history = [e for e in channel.history if e.type != "progress"]
+            channel.history.append(event)
+            if event.is_terminal:
+                channel.finished_at = time.monotonic()
+            subscribers = list(channel.subscribers)
+            self._prune()
+        for subscription in subscribers:
+            subscription.loop.call_soon_threadsafe(subscription.queue.put_nowait, event)
+        return event
+
+    def subscribe(self, job_id: str, last_event_id: Optional[str] = None) -> Subscription:
+        """Register for new events; must be called from the event loop."""
+        subscription = Subscription(job_id, asyncio.get_running_loop())
+        with self._lock:
+            channel = self._channels.get(job_id)
+            if channel is not None and channel.history:
+                subscription.replay = [
+                    event for event in channel.history if self._is_newer(event.id, last_event_id)
+                ]
+            self._channels.setdefault(job_id, _Channel()).subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            channel = self._channels.get(subscription.job_id)
+            if channel is not None:
+                channel.subscribers.discard(subscription)
+            self._prune()
+
+    def last_event_id(self, job_id: str) -> str:
+        with self._lock:
+            channel = self._channels.get(job_id)
+            return f"{self.epoch}-{channel.next_seq - 1 if channel else 0}"
+
+    def _is_newer(self, event_id: str, last_event_id: Optional[str]) -> bool:
+        if not last_event_id:
+            return True
+        epoch, _, seq = last_event_id.partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return True
+        return int(event_id.partition("-")[2]) > int(seq)
+
+    def _prune(self) -> None:
+        cutoff = time.monotonic() - self.retention_seconds
+        stale = [
+            job_id for job_id, channel in self._channels.items()
+            if not channel.subscribers and (
+                not channel.history or (channel.finished_at is not None and channel.finished_at < cutoff)
+            )
+        ]
+        for job_id in stale:
+            del self._channels[job_id]
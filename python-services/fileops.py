@@ -0,0 +1,116 @@
+"""Copies of files on the same host that avoid moving bytes through Python where the kernel allows."""
+
+from __future__ import annotations
+
+import errno
+import os
+import uuid
+from pathlib import Path
+
+try:  # Reflinks are a Linux ioctl
+    import fcntl
+except ImportError:  # pragma: no cover - depends on the platform
+    fcntl = None
+
+# _IOW(0x94, 9, int): share the source's extents copy-on-write (Btrfs, XFS, overlayfs on them)
+FICLONE = 0x40049409
+# Errors meaning "not supported here", after which the next method is tried
+_UNSUPPORTED = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY}
+STREAM_CHUNK = 1024 * 1024
+
+
+def _reflink(source_fd: int, target_fd: int) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(target_fd, FICLONE, source_fd)
+    except OSError as exc:
+        if exc.errno in _UNSUPPORTED:
+            return False
+        raise
+    return True
+
+
+def _copy_range(source_fd: int, target_fd: int, size: int) -> str:
+    """Copy inside the kernel with copy_file_range, else sendfile, else read/write."""
+    offset = 0
+    if hasattr(os, "copy_file_range"):
+        try:
+            while offset < size:
+                copied = os.copy_file_range(source_fd, target_fd, size - offset, offset, offset)
+                if not copied:
+                    break
+                offset += copied
+            return "copy_file_range"
+        except OSError as exc:
+            if offset or exc.errno not in _UNSUPPORTED:
+                raise
+    if hasattr(os, "sendfile"):
+        try:
+            while offset < size:
+                sent = os.sendfile(target_fd, source_fd, offset, size - offset)
+                if not sent:
+                    break
+                offset += sent
+            return "sendfile"
+        except OSError as exc:
+            if offset or exc.errno not in _UNSUPPORTED:
+                raise
+    os.lseek(source_fd, 0, os.SEEK_SET)
+    while True:
+        data = os.read(source_fd, STREAM_CHUNK)
+        if not data:
+            return "stream"
+        view = memoryview(data)
+        while view:
+            view = view[os.write(target_fd, view):]
+
+
+def _link_over(source: Path, placeholder: Path) -> bool:
+    """Swap `placeholder` for a hard link to `source`; False where links are not possible."""
+    linked = placeholder.with_name(placeholder.name + "~")
+    try:
+        os.link(source, linked)
+    except OSError as exc:
+        if exc.errno in _UNSUPPORTED:
+            return False
+        raise
+    os.replace(linked, placeholder)
+    return True
+
+
+def _clone_into(source: Path, target: Path, allow_link: bool) -> str:
+    with source.open("rb") as src:
+        size = os.fstat(src.fileno()).st_size
+        fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            if size and _reflink(src.fileno(), fd):
+                return "reflink"
+            if allow_link and _link_over(source, target):
+                return "link"
+            return _copy_range(src.fileno(), fd, size)
+        finally:
+            os.close(fd)
+
+
+def copy_file(source: Path, target: Path) -> str:
+    """Write an independent copy of `source` at `target`, in place; returns the method used."""
+    return _clone_into(source, target, allow_link=False)
+
+
+def clone_file(source: Path, target: Path, allow_link: bool = True) -> str:
+    """Atomically replace `target` with the contents of `source`; returns the method used.
+
+    Tries a reflink, then a hard link (unless `allow_link` is false), then
+    copy_file_range, sendfile and finally a streamed copy. A hard-linked
+    target shares its inode with `source`, so whoever changes it later must
+    write a new file and swap it in, never write in place.
+    """
+    tmp = target.with_name(f".{target.name}.{uuid.uuid4().hex[:8]}")
+    try:
+        method = _clone_into(source, tmp, allow_link)
+        os.replace(tmp, target)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return method
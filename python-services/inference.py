@@ -0,0 +1,243 @@
+"""Offline object detection on CPU with an exported model (ONNX), run in batches.
+
+The model is a YOLO detector as exported by Roboflow or Ultralytics: one
+float input of shape (batch, 3, height, width) holding RGB in 0..1, and one
+output of shape (batch, 4 + classes, candidates) with centre x/y, width,
+height and per-class scores (YOLOv5 exports, with an objectness column
+and candidates first, work too). Detections are returned in the shape of
+Roboflow's hosted predictions, so either source can fill a record.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+from PIL import Image
+
+try:  # Only needed when a model is configured
+    import onnxruntime as ort
+except ImportError:  # pragma: no cover - depends on the image
+    ort = None
+
+# Exported model to run; without one, files are flagged by the filename heuristic.
+INFERENCE_MODEL = os.getenv("INFERENCE_MODEL")
+# Class names in the model's output order, comma-separated.
+INFERENCE_CLASSES = [name.strip() for name in os.getenv("INFERENCE_CLASSES", "anomaly").split(",") if name.strip()]
+# Each of the pool's worker processes may run inference at once; same default as main.WORKER_PROCESSES.
+_WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES") or int(os.getenv("JOB_CONCURRENCY", "2")) + 1)
+# Threads ONNX Runtime uses inside each operator; by default the workers split the cores, 0 gives each every core.
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS") or max(1, (os.cpu_count() or 1) // _WORKER_PROCESSES))
+INFERENCE_BATCH_SIZE = int(os.getenv("INFERENCE_BATCH_SIZE", "8"))
+# Threads decoding and resizing the next batch while the current one runs.
+PREPROCESS_WORKERS = int(os.getenv("INFERENCE_PREPROCESS_WORKERS") or min(4, INFERENCE_THREADS or 4))
+SCORE_THRESHOLD = float(os.getenv("INFERENCE_SCORE_THRESHOLD", "0.25"))
+IOU_THRESHOLD = float(os.getenv("INFERENCE_IOU_THRESHOLD", "0.45"))
+# Most detections kept per image, highest scores first.
+MAX_DETECTIONS = 100
+
+# Letterbox padding, the grey YOLO models are trained with
+_PAD_COLOUR = (114, 114, 114)
+
+
+@dataclass
+class Prepared:
+    pixels: np.ndarray
+    scale: float
+    pad_x: int
+    pad_y: int
+    width: int
+    height: int
+
+
+def _nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> List[int]:
+    """Indices of `boxes` (x1, y1, x2, y2) kept by greedy non-maximum suppression."""
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = scores.argsort()[::-1]
+    keep: List[int] = []
+    while order.size and len(keep) < MAX_DETECTIONS:
+        best, rest = order[0], order[1:]
+        keep.append(int(best))
+        width = np.clip(np.minimum(boxes[best, 2], boxes[rest, 2]) - np.maximum(boxes[best, 0], boxes[rest, 0]), 0, None)
+        height = np.clip(np.minimum(boxes[best, 3], boxes[rest, 3]) - np.maximum(boxes[best, 1], boxes[rest, 1]), 0, None)
+        overlap = width * height
+        iou = overlap / np.maximum(areas[best] + areas[rest] - overlap, 1e-9)
+        order = rest[iou <= iou_threshold]
+    return keep
+
+
+class Detector:
+    """One ONNX Runtime session on the CPU, with a thread pool preparing images for it.
+
+    `detect` runs images through in batches of `batch_size` (or the batch the
+    model was exported with), decoding the next batch while the current one
+    is inferred, so memory holds two batches at most.
+    """
+
+    def __init__(
+        self,
+        model_path: Path,
+        class_names: Sequence[str] = ("anomaly",),
+        intra_op_threads: int = 0,
+        preprocess_workers: int = 4,
+        score_threshold: float = 0.25,
+        iou_threshold: float = 0.45,
+    ) -> None:
+        if ort is None:
+            raise RuntimeError("Inference needs onnxruntime; install it or unset INFERENCE_MODEL")
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        batch, _, height, width = model_input.shape
+        # Dynamic dimensions come back as names; YOLO exports default to 640
+        self.fixed_batch = batch if isinstance(batch, int) else None
+        self.input_height = height if isinstance(height, int) else 640
+        self.input_width = width if isinstance(width, int) else 640
+        self.class_names = list(class_names)
+        self.score_threshold = score_threshold
+        self.iou_threshold = iou_threshold
+        self._pool = ThreadPoolExecutor(max_workers=preprocess_workers, thread_name_prefix="preprocess")
+
+        digest = hashlib.sha1()
+        with open(model_path, "rb") as handle:
+            for block in iter(lambda: handle.read(1024 * 1024), b""):
+                digest.update(block)
+        digest.update(repr((self.class_names, score_threshold, iou_threshold)).encode())
+        self.fingerprint = digest.hexdigest()[:12]
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False)
+
+    def prepare(self, path: Path) -> Optional[Prepared]:
+        """Letterboxed CHW float pixels for one image, or None if it cannot be decoded."""
+        try:
+            with Image.open(path) as image:
+                original_width, original_height = image.size
+                scale = min(self.input_width / original_width, self.input_height / original_height)
+                resized_size = (max(1, round(original_width * scale)), max(1, round(original_height * scale)))
+                # JPEG frames are decoded straight at a reduced size when that is enough
+                image.draft("RGB", resized_size)
+                resized = image.convert("RGB").resize(resized_size, Image.BILINEAR)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            return None
+        pad_x = (self.input_width - resized_size[0]) // 2
+        pad_y = (self.input_height - resized_size[1]) // 2
+        canvas = Image.new("RGB", (self.input_width, self.input_height), _PAD_COLOUR)
+        canvas.paste(resized, (pad_x, pad_y))
+        pixels = np.asarray(canvas, dtype=np.float32).transpose(2, 0, 1) / 255.0
+        return Prepared(np.ascontiguousarray(pixels), scale, pad_x, pad_y, original_width, original_height)
+
+    def detect(self, paths: Iterable[Path], batch_size: int = 8) -> Dict[Path, List[Dict[str, object]]]:
+        """Detections for each image, highest confidence first; undecodable files are left out."""
+        paths = [Path(p) for p in paths]
+        size = self.fixed_batch or max(1, batch_size)
+        batches = [paths[start:start + size] for start in range(0, len(paths), size)]
+        results: Dict[Path, List[Dict[str, object]]] = {}
+        upcoming: List[Future] = [self._pool.submit(self.prepare, p) for p in batches[0]] if batches else []
+        for index, batch in enumerate(batches):
+            current = upcoming
+            if index + 1 < len(batches):
+                upcoming = [self._pool.submit(self.prepare, p) for p in batches[index + 1]]
+            ready = [(path, future.result()) for path, future in zip(batch, current)]
+            ready = [(path, item) for path, item in ready if item is not None]
+            if not ready:
+                continue
+            pixels = np.stack([item.pixels for _, item in ready])
+            if self.fixed_batch and len(ready) < self.fixed_batch:
+                filler = np.zeros((self.fixed_batch - len(ready), *pixels.shape[1:]), dtype=pixels.dtype)
+                pixels = np.concatenate([pixels, filler])
+            outputs = self.session.run(None, {self.input_name: pixels})[0]
+            for (path, item), prediction in zip(ready, outputs):
+                results[path] = self._postprocess(prediction, item)
+        return results
+
+    def _postprocess(self, prediction: np.ndarray, item: Prepared) -> List[Dict[str, object]]:
+        if prediction.shape[0] < prediction.shape[1]:
+            # YOLOv8: (4 + classes, candidates)
+            candidates = prediction.T
+            class_scores = candidates[:, 4:]
+        else:
+            # YOLOv5: (candidates, 5 + classes) with objectness
+            candidates = prediction
+            class_scores = candidates[:, 5:] * candidates[:, 4:5]
+        class_ids = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(class_ids)), class_ids]
+        mask = scores >= self.score_threshold
+        if not mask.any():
+            return []
+        centres, class_ids, scores = candidates[mask, :4], class_ids[mask], scores[mask]
+        boxes = np.concatenate([centres[:, :2] - centres[:, 2:] / 2, centres[:, :2] + centres[:, 2:] / 2], axis=1)
+        # Offset each class far apart so one NMS pass never merges different classes
+        offsets = class_ids[:, None] * (max(self.input_width, self.input_height) + 1.0)
+        keep = _nms(boxes + offsets, scores, self.iou_threshold)
+
+        # Back to original image pixels, clipped to the frame
+        boxes = (boxes - [item.pad_x, item.pad_y, item.pad_x, item.pad_y]) / item.scale
+        boxes = boxes.clip(0, [item.width, item.height, item.width, item.height])
+        detections = []
+        for index in keep:
+            x1, y1, x2, y2 = (float(value) for value in boxes[index])
+            class_id = int(class_ids[index])
+            detections.append({
+                "x": round((x1 + x2) / 2, 1),
+                "y": round((y1 + y2) / 2, 1),
+                "width": round(x2 - x1, 1),
+                "height": round(y2 - y1, 1),
+                "confidence": round(float(scores[index]), 4),
+                "class": self.class_names[class_id] if class_id < len(self.class_names) else str(class_id),
+                "class_id": class_id,
+            })
+        return detections
+
+
+_default: Optional[Detector] = None
+_default_lock = threading.Lock()
+
+
+def default_detector() -> Optional[Detector]:
+    """The detector for INFERENCE_MODEL, loaded once per process; None when no model is set."""
+    global _default
+    if not INFERENCE_MODEL:
+        return None
+    with _default_lock:
+        if _default is None:
+            _default = Detector(
+                Path(INFERENCE_MODEL),
+                class_names=INFERENCE_CLASSES,
+                intra_op_threads=INFERENCE_THREADS,
+                preprocess_workers=PREPROCESS_WORKERS,
+                score_threshold=SCORE_THRESHOLD,
+                iou_threshold=IOU_THRESHOLD,
+            )
+        return _default
+
+
+def detect_images(paths: Iterable[Path]) -> Dict[Path, List[Dict[str, object]]]:
+    """Detections from the configured model, batched; empty when there is none."""
+    detector = default_detector()
+    return detector.detect(paths, INFERENCE_BATCH_SIZE) if detector is not None else {}
+
+
+def settings_fingerprint() -> str:
+    """Short hash of the model and thresholds, for cache keys; "none" without a model."""
+    detector = default_detector()
+    return detector.fingerprint if detector is not None else "none"
+
+
+def warm_up() -> None:
+    """Load the model and run one batch so a worker's first job does not pay for it."""
+    detector = default_detector()
+    if detector is not None:
+        shape = (detector.fixed_batch or 1, 3, detector.input_height, detector.input_width)
+        detector.session.run(None, {detector.input_name: np.zeros(shape, dtype=np.float32)})
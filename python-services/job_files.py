@@ -0,0 +1,80 @@
+"""Bulk loading and paging of per-file detection records in the `job_files` table."""
+
+from __future__ import annotations
+
+import io
+import json
+import math
+from typing import Dict, Iterable, List, Optional
+
+# Record keys with their own column; anything else (boxes, coordinates, ...) goes into `details`
+COLUMNS = (
+    "file_name",
+    "file_type",
+    "size_bytes",
+    "anomaly_detected",
+    "notes",
+    "max_temp_c",
+    "mean_temp_c",
+    "delta_t_c",
+)
+
+_COPY_SQL = f"COPY job_files (job_id, {', '.join(COLUMNS)}, details) FROM STDIN"
+
+
+def _is_missing(value: object) -> bool:
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _copy_value(value: object) -> str:
+    """Encode one value in COPY's text format."""
+    if _is_missing(value):
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _copy_rows(job_id: str, records: Iterable[Dict[str, object]]) -> io.StringIO:
+    buffer = io.StringIO()
+    for record in records:
+        # Keys a record lacks come back as NaN from a DataFrame; leave them out rather than store them
+        extra = {key: value for key, value in record.items() if key not in COLUMNS and not _is_missing(value)}
+        values = [job_id, *(record.get(column) for column in COLUMNS), extra or None]
+        buffer.write("\t".join(_copy_value(value) for value in values))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+
+def copy_records(cur, job_id: str, records: List[Dict[str, object]]) -> int:
+    """Replace the job's rows with `records` using a single COPY.
+
+    Runs on the caller's cursor so the load commits or rolls back together
+    with the rest of the job's completion. Returns the number of rows.
+    """
+    cur.execute("DELETE FROM job_files WHERE job_id = %s", (job_id,))
+    if records:
+        cur.copy_expert(_COPY_SQL, _copy_rows(job_id, records))
+    return len(records)
+
+
+def fetch_page(
+    cur, job_id: str, limit: int, after: Optional[int] = None, anomalies_only: bool = False
+) -> List[Dict[str, object]]:
+    """Rows for one job in insertion order, starting after row id `after`."""
+    cur.execute(
+        f"SELECT id, {', '.join(COLUMNS)}, details FROM job_files"
+        " WHERE job_id = %s AND id > %s AND (NOT %s OR anomaly_detected)"
+        " ORDER BY id LIMIT %s",
+        (job_id, after or 0, anomalies_only, limit),
+    )
+    return cur.fetchall()
@@ -0,0 +1,347 @@
+"""A small S3-compatible server that keeps objects in a local folder, for development and tests.
+
+Usage: python local_s3.py [--root ./mock_s3] [--host 0.0.0.0] [--port 9000]
+
+Objects are stored as `<root>/<bucket>/<key>`, the layout of the old mock
+S3 wrapper script. Enough of the REST API is spoken, path-style, for boto3
+transfers and presigned URLs: PUT/GET (with Range)/HEAD/DELETE of objects,
+multipart uploads, ListObjectsV2 and DeleteObjects. Every bucket exists;
+its folder is created on first write. Request signatures are not checked, so never expose it.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import uuid
+import xml.etree.ElementTree as ET
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+NAMESPACE = "http://s3.amazonaws.com/doc/2006-03-01/"
+CHUNK = 1024 * 1024
+
+
+def _xml(root: str, body: str) -> bytes:
+    return f'<?xml version="1.0" encoding="UTF-8"?>\n<{root} xmlns="{NAMESPACE}">{body}</{root}>'.encode()
+
+
+class LocalS3:
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self.tmp_dir = root / ".tmp"
+        self.multipart_dir = root / ".multipart"
+        for directory in (self.tmp_dir, self.multipart_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, bucket: str, key: str = "") -> Path:
+        parts = [bucket, *key.split("/")] if key else [bucket]
+        if not bucket or bucket.startswith(".") or any(part in ("", ".", "..") for part in parts):
+            raise KeyError(key)
+        return self.root.joinpath(*parts)
+
+    def write(self, body: Iterator[bytes], target: Path) -> str:
+        """Stream `body` into `target` atomically and return its MD5 hex digest."""
+        md5 = hashlib.md5()
+        fd, tmp_name = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                for data in body:
+                    md5.update(data)
+                    handle.write(data)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_name, target)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        return md5.hexdigest()
+
+    @staticmethod
+    def _meta_path(path: Path) -> Path:
+        return path.with_name(path.name + ".meta~")
+
+    def meta(self, path: Path) -> Dict[str, str]:
+        try:
+            return json.loads(self._meta_path(path).read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def save_meta(self, path: Path, **meta: Optional[str]) -> None:
+        self._meta_path(path).write_text(json.dumps({name: value for name, value in meta.items() if value}))
+
+    def remove(self, path: Path) -> None:
+        path.unlink(missing_ok=True)
+        self._meta_path(path).unlink(missing_ok=True)
+
+    def etag(self, path: Path) -> str:
+        stored = self.meta(path).get("etag")
+        if stored:
+            return stored
+        md5 = hashlib.md5()
+        with path.open("rb") as handle:
+            for data in iter(lambda: handle.read(CHUNK), b""):
+                md5.update(data)
+        return md5.hexdigest()
+
+    def keys(self, bucket: str, prefix: str) -> List[Tuple[str, Path]]:
+        base = self.path(bucket)
+        found: List[Tuple[str, Path]] = []
+        for directory, _, files in os.walk(base):
+            for name in files:
+                if name.endswith(".meta~"):
+                    continue
+                path = Path(directory) / name
+                key = path.relative_to(base).as_posix()
+                if key.startswith(prefix):
+                    found.append((key, path))
+        return sorted(found)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    store: LocalS3
+
+    def log_message(self, format: str, *args) -> None:  # noqa: A002 - signature from the base class
+        pass
+
+    def _target(self) -> Tuple[str, str, Dict[str, List[str]]]:
+        url = urlsplit(self.path)
+        bucket, _, key = unquote(url.path).lstrip("/").partition("/")
+        return bucket, key, parse_qs(url.query, keep_blank_values=True)
+
+    def _send(self, status: int, body: bytes = b"", headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if "Content-Length" not in (headers or {}):
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _error(self, status: int, code: str, message: str = "") -> None:
+        body = b"" if self.command == "HEAD" else _xml("Error", f"<Code>{code}</Code><Message>{escape(message)}</Message>")
+        self._send(status, body, {"Content-Type": "application/xml", "Content-Length": str(len(body))})
+
+    def _body(self) -> Iterator[bytes]:
+        """Request body, decoding aws-chunked framing (used by signed and checksummed uploads)."""
+        encoding = self.headers.get("Content-Encoding", "")
+        streaming = self.headers.get("x-amz-content-sha256", "").startswith("STREAMING-")
+        if "aws-chunked" in encoding or streaming or self.headers.get("Transfer-Encoding") == "chunked":
+            while True:
+                size = int(self.rfile.readline().split(b";", 1)[0].strip(), 16)
+                if size == 0:
+                    # Trailing checksums, then a blank line
+                    while self.rfile.readline().strip():
+                        pass
+                    return
+                remaining = size
+                while remaining:
+                    data = self.rfile.read(min(remaining, CHUNK))
+                    if not data:
+                        raise ConnectionError("Body ended early")
+                    remaining -= len(data)
+                    yield data
+                self.rfile.readline()
+        remaining = int(self.headers.get("Content-Length") or 0)
+        while remaining:
+            data = self.rfile.read(min(remaining, CHUNK))
+            if not data:
+                raise ConnectionError("Body ended early")
+            remaining -= len(data)
+            yield data
+
+    def _read_all(self) -> bytes:
+        return b"".join(self._body())
+
+    def do_PUT(self) -> None:
+        bucket, key, query = self._target()
+        try:
+            if not key:
+                self._read_all()
+                self.store.path(bucket).mkdir(parents=True, exist_ok=True)
+                return self._send(200)
+            if "uploadId" in query:
+                upload_dir = self.store.multipart_dir / query["uploadId"][0]
+                if not upload_dir.is_dir():
+                    return self._error(404, "NoSuchUpload")
+                number = int(query["partNumber"][0])
+                digest = self.store.write(self._body(), upload_dir / f"{number:05d}")
+                return self._send(200, headers={"ETag": f'"{digest}"'})
+            target = self.store.path(bucket, key)
+            digest = self.store.write(self._body(), target)
+            self.store.save_meta(target, etag=digest, content_type=self.headers.get("Content-Type"))
+            self._send(200, headers={"ETag": f'"{digest}"'})
+        except KeyError:
+            self._error(400, "InvalidArgument", "Invalid bucket or key")
+
+    def do_POST(self) -> None:
+        bucket, key, query = self._target()
+        if "delete" in query and not key:
+            return self._delete_objects(bucket)
+        if "uploads" in query:
+            self._read_all()
+            upload_id = uuid.uuid4().hex
+            upload_dir = self.store.multipart_dir / upload_id
+            upload_dir.mkdir()
+            (upload_dir / "meta.json").write_text(json.dumps({"content_type": self.headers.get("Content-Type")}))
+            body = _xml(
+                "InitiateMultipartUploadResult",
+                f"<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId>",
+            )
+            return self._send(200, body, {"Content-Type": "application/xml"})
+        if "uploadId" in query:
+            return self._complete_multipart(bucket, key, query["uploadId"][0])
+        self._error(400, "NotImplemented", "Unsupported POST")
+
+    def _complete_multipart(self, bucket: str, key: str, upload_id: str) -> None:
+        upload_dir = self.store.multipart_dir / upload_id
+        request = ET.fromstring(self._read_all())
+        if not upload_dir.is_dir():
+            return self._error(404, "NoSuchUpload")
+        numbers = sorted(int(element.text) for element in request.iter() if element.tag.endswith("PartNumber"))
+        parts = [upload_dir / f"{number:05d}" for number in numbers]
+        if not parts or not all(part.exists() for part in parts):
+            return self._error(400, "InvalidPart")
+
+        def chunks() -> Iterator[bytes]:
+            for part in parts:
+                with part.open("rb") as handle:
+                    yield from iter(lambda: handle.read(CHUNK), b"")
+
+        md5s = b"".join(bytes.fromhex(self.store.etag(part)) for part in parts)
+        target = self.store.path(bucket, key)
+        self.store.write(chunks(), target)
+        etag = f"{hashlib.md5(md5s).hexdigest()}-{len(parts)}"
+        content_type = json.loads((upload_dir / "meta.json").read_text()).get("content_type")
+        self.store.save_meta(target, etag=etag, content_type=content_type)
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        body = _xml(
+            "CompleteMultipartUploadResult",
+            f"<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key><ETag>\"{etag}\"</ETag>",
+        )
+        self._send(200, body, {"Content-Type": "application/xml"})
+
+    def _delete_objects(self, bucket: str) -> None:
+        request = ET.fromstring(self._read_all())
+        deleted = []
+        for element in request.iter():
+            if element.tag.endswith("Key") and element.text:
+                try:
+                    path = self.store.path(bucket, element.text)
+                except KeyError:
+                    continue
+                self.store.remove(path)
+                deleted.append(f"<Deleted><Key>{escape(element.text)}</Key></Deleted>")
+        self._send(200, _xml("DeleteResult", "".join(deleted)), {"Content-Type": "application/xml"})
+
+    def do_DELETE(self) -> None:
+        bucket, key, query = self._target()
+        if "uploadId" in query:
+            shutil.rmtree(self.store.multipart_dir / query["uploadId"][0], ignore_errors=True)
+            return self._send(204)
+        try:
+            path = self.store.path(bucket, key)
+        except KeyError:
+            return self._error(400, "InvalidArgument")
+        self.store.remove(path)
+        self._send(204)
+
+    def do_HEAD(self) -> None:
+        self.do_GET()
+
+    def do_GET(self) -> None:
+        bucket, key, query = self._target()
+        try:
+            if not key:
+                return self._list(bucket, query)
+            path = self.store.path(bucket, key)
+        except KeyError:
+            return self._error(404, "NoSuchBucket")
+        if not path.is_file():
+            return self._error(404, "NoSuchKey", key)
+
+        size = path.stat().st_size
+        start, end, status = 0, size - 1, 200
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start = max(0, size - int(match.group(2)))
+            if start > end:
+                return self._send(416, headers={"Content-Range": f"bytes */{size}"})
+            status = 206
+        meta = self.store.meta(path)
+        headers = {
+            "Content-Length": str(end - start + 1),
+            "ETag": f'"{self.store.etag(path)}"',
+            "Last-Modified": formatdate(path.stat().st_mtime, usegmt=True),
+            "Accept-Ranges": "bytes",
+            "Content-Type": meta.get("content_type", "application/octet-stream"),
+        }
+        if status == 206:
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        self._send(status, headers=headers)
+        if self.command == "GET":
+            with path.open("rb") as handle:
+                handle.seek(start)
+                self._copy(handle, end - start + 1)
+
+    def _copy(self, handle: BinaryIO, length: int) -> None:
+        while length:
+            data = handle.read(min(length, CHUNK))
+            if not data:
+                break
+            self.wfile.write(data)
+            length -= len(data)
+
+    def _list(self, bucket: str, query: Dict[str, List[str]]) -> None:
+        prefix = query.get("prefix", [""])[0]
+        after = query.get("continuation-token", query.get("start-after", [""]))[0]
+        max_keys = int(query.get("max-keys", ["1000"])[0])
+        keys = [(key, path) for key, path in self.store.keys(bucket, prefix) if key > after]
+        page, truncated = keys[:max_keys], len(keys) > max_keys
+        contents = "".join(
+            f"<Contents><Key>{escape(key)}</Key><Size>{path.stat().st_size}</Size>"
+            f"<ETag>\"{self.store.etag(path)}\"</ETag></Contents>"
+            for key, path in page
+        )
+        body = (
+            f"<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix><KeyCount>{len(page)}</KeyCount>"
+            f"<MaxKeys>{max_keys}</MaxKeys><IsTruncated>{'true' if truncated else 'false'}</IsTruncated>"
+            + (f"<NextContinuationToken>{escape(page[-1][0])}</NextContinuationToken>" if truncated else "")
+            + contents
+        )
+        self._send(200, _xml("ListBucketResult", body), {"Content-Type": "application/xml"})
+
+
+def serve(root: Path, host: str = "127.0.0.1", port: int = 9000) -> ThreadingHTTPServer:
+    """Create the server; call `serve_forever()` on it, possibly from a thread."""
+    handler = type("LocalS3Handler", (Handler,), {"store": LocalS3(root)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--root", type=Path, default=Path("mock_s3"))
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=9000)
+    args = parser.parse_args()
+    server = serve(args.root, args.host, args.port)
+    print(f"Local S3 serving {args.root.resolve()} on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
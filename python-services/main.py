@@ -1,20 +1,54 @@
 from __future__ import annotations
 
+import asyncio
 import json
+import logging
 import os
 import shutil
-import subprocess
+import threading
+import time
 import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Sequence
 
-import pandas as pd
 import psycopg2
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi import Body, FastAPI, File, Form, Header, HTTPException, Query, Request, UploadFile
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
 from psycopg2.extras import RealDictCursor
 
+import Drone_Data_Process
+import job_files
+import metrics
+import output_files
+from admission import AdmissionController, AdmissionRejected
+from blob_store import BlobStore
+from db_pool import ConnectionPool, PoolTimeout
+from events import Event, EventBroker, Subscription
+from pg_queue import (
+    CANCEL_CHANNEL,
+    EVENTS_CHANNEL,
+    JOBS_CHANNEL,
+    Claim,
+    LeaseLost,
+    PgJobQueue,
+    PgListener,
+    QueueRunner,
+    notify_event,
+)
+from pipeline import MultipartSaver, StreamingJob
+from scheduler import DEFAULT_PRIORITY, CostModel, FairShareScheduler, parse_priority
+from storage import LocalStorage, S3Storage, Storage
+from uploads import UploadError, UploadStore, parse_content_range
+from worker_pool import TaskCancelled, TaskFailed, TaskTimedOut, WorkerPool
+
+logger = logging.getLogger(__name__)
+
 OUTPUT_DIR = Path(os.getenv("OUTPUT_ROOT", "/app/outputs"))
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -22,8 +56,230 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL environment variable must be set for the Python service")
 
+# Reports and flight paths are published to this bucket when set; otherwise they stay on OUTPUT_DIR only.
+S3_BUCKET = os.getenv("S3_BUCKET")
+# An S3-compatible server (MinIO, local_s3.py) to use instead of AWS.
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_PREFIX = os.getenv("S3_PREFIX", "outputs/")
+# Part size and parts in flight for multipart uploads and downloads.
+S3_MULTIPART_CHUNK_BYTES = int(os.getenv("S3_MULTIPART_CHUNK_MB", "8")) * 1024 * 1024
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", "8"))
+# Where signed direct uploads land in the bucket until their upload is committed.
+S3_UPLOAD_PREFIX = os.getenv("S3_UPLOAD_PREFIX", "incoming/")
+# Without a bucket, signed uploads go to upload_receiver.py at this public URL, which shares the secret.
+DIRECT_UPLOAD_URL = os.getenv("DIRECT_UPLOAD_URL")
+UPLOAD_SIGNING_SECRET = os.getenv("UPLOAD_SIGNING_SECRET")
+DIRECT_UPLOADS_ENABLED = bool(S3_BUCKET or (DIRECT_UPLOAD_URL and UPLOAD_SIGNING_SECRET))
+# Seconds a signed upload URL stays valid.
+UPLOAD_URL_TTL = int(os.getenv("UPLOAD_URL_TTL", "900"))
+# In a committed direct upload's job folder until its job has fetched the files; holds the upload id.
+DIRECT_UPLOAD_MARKER = ".direct-upload"
+
+# Jobs this replica runs at the same time; 0 makes it upload-only. The queue itself is in Postgres.
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "2"))
+# A running job whose worker has not sent a heartbeat for this long is handed to another worker.
+JOB_VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", "60"))
+# Attempts per job, counting retries after errors and after lost workers.
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Seconds of past work that count against a customer's or pilot's fair share.
+FAIR_SHARE_WINDOW = float(os.getenv("FAIR_SHARE_WINDOW", "900"))
+
+# Threads running the per-file stages while uploads are still arriving, shared by all jobs.
+FILE_WORKERS = int(os.getenv("FILE_WORKERS", "4"))
+
+# Seconds a stage may run before its worker process tree is killed and the job is marked timed_out.
+STAGE_TIMEOUTS = {
+    "batch": float(os.getenv("BATCH_STAGE_TIMEOUT", "1800")),
+    # EXCEL_STAGE_TIMEOUT is the name from before the stage wrote Parquet
+    "table": float(os.getenv("TABLE_STAGE_TIMEOUT") or os.getenv("EXCEL_STAGE_TIMEOUT", "1800")),
+    "pdf": float(os.getenv("PDF_STAGE_TIMEOUT", "900")),
+    "flight_path": float(os.getenv("FLIGHT_PATH_STAGE_TIMEOUT", "300")),
+    "workbook": float(os.getenv("WORKBOOK_STAGE_TIMEOUT", "600")),
+}
+# Files one process work item takes on; a job with more goes back to the scheduler between batches. 0 disables.
+PROCESS_BATCH_FILES = int(os.getenv("PROCESS_BATCH_FILES", "500"))
+# Files written by the stages; removed when a job times out part way.
+STAGE_OUTPUTS = ("Report_Input.parquet", "Report_Input.json", "Final_Report.pdf")
+
+# Warm processes running the processing, PDF, flight path and workbook stages; one per running job plus one spare.
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", str(JOB_CONCURRENCY + 1)))
+# Workers are replaced after this many tasks to cap slow leaks in the native libraries.
+WORKER_MAX_TASKS = int(os.getenv("WORKER_MAX_TASKS", "50"))
+
+# Admission limits; requests over them get 429/503 with a Retry-After estimate.
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "20"))
+MAX_UPLOAD_BYTES_IN_FLIGHT = int(os.getenv("MAX_UPLOAD_MB_IN_FLIGHT", "2048")) * 1024 * 1024
+MIN_FREE_DISK_BYTES = int(os.getenv("MIN_FREE_DISK_MB", "2048")) * 1024 * 1024
+
+worker_pool = WorkerPool(
+    WORKER_PROCESSES,
+    max_tasks=WORKER_MAX_TASKS,
+    preload=["Drone_Data_Process", "ClaudeMain1_fixed", "FlightPlanTool", "inference"],
+    server_preload=["numpy", "pandas", "pyarrow.parquet", "openpyxl", "PIL.Image", "reportlab.pdfgen.canvas"],
+)
+# Upload contents are stored once here and hard-linked into job folders.
+blob_store = BlobStore(OUTPUT_DIR / ".blobs")
+file_executor = ThreadPoolExecutor(max_workers=FILE_WORKERS, thread_name_prefix="file-worker")
+# Builds requested Excel workbooks one at a time, so downloads never hold more than one pool worker.
+workbook_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="workbook")
+_workbook_builds: Dict[str, Future] = {}
+_workbook_lock = threading.Lock()
+# Seconds a client is told to wait before asking again for a workbook that is being built.
+WORKBOOK_RETRY_AFTER = 2
+
+# Job progress for /jobs/{job_id}/events subscribers.
+event_broker = EventBroker()
+# Comment lines sent on idle event streams so proxies do not time them out.
+EVENT_KEEPALIVE_SECONDS = 15
+
+
+def _bucket_storage(prefix: str) -> Storage:
+    return S3Storage(
+        S3_BUCKET,
+        prefix=prefix,
+        endpoint_url=S3_ENDPOINT_URL,
+        chunk_size=S3_MULTIPART_CHUNK_BYTES,
+        max_concurrency=S3_MAX_CONCURRENCY,
+    )
+
+
+# Finished artifacts, keyed `<job_id>/<path>`; the output volume caches remote ones for /outputs.
+artifact_store = _bucket_storage(S3_PREFIX) if S3_BUCKET else LocalStorage(OUTPUT_DIR)
+# Direct uploads, keyed `<upload_id>/<name>` until commit moves them into the job folder.
+incoming_store = (
+    _bucket_storage(S3_UPLOAD_PREFIX)
+    if S3_BUCKET
+    else LocalStorage(OUTPUT_DIR / ".incoming", upload_url=DIRECT_UPLOAD_URL, signing_secret=UPLOAD_SIGNING_SECRET)
+)
+
+# Content hashes behind the ETags of /outputs responses.
+output_etags = output_files.ETagCache()
+
+# Body bytes gathered before each positioned write of an upload chunk.
+UPLOAD_WRITE_BUFFER = 1024 * 1024
+
+# Shared connections: request handlers plus one per running job, with headroom.
+db_pool = ConnectionPool(
+    DATABASE_URL,
+    minconn=int(os.getenv("DB_POOL_MIN", "1")),
+    maxconn=int(os.getenv("DB_POOL_MAX", "10")),
+    max_lifetime=float(os.getenv("DB_POOL_MAX_LIFETIME", "1800")),
+    idle_check=float(os.getenv("DB_POOL_IDLE_CHECK", "30")),
+    acquire_timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+    cursor_factory=RealDictCursor,
+)
+
+job_queue = PgJobQueue(
+    db_pool,
+    visibility_timeout=JOB_VISIBILITY_TIMEOUT,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    scheduler=FairShareScheduler(window=FAIR_SHARE_WINDOW),
+)
+cost_model = CostModel()
+admission = AdmissionController(
+    OUTPUT_DIR,
+    max_queued=MAX_QUEUED_JOBS,
+    max_inflight_bytes=MAX_UPLOAD_BYTES_IN_FLIGHT,
+    min_free_bytes=MIN_FREE_DISK_BYTES,
+    backlog=job_queue.backlog,
+    backlog_errors=(psycopg2.Error, PoolTimeout),
+)
+
+def _by_state(stats: Dict[str, float], *states: str) -> Dict[tuple, float]:
+    return {(state,): stats[state] for state in states}
+
+
+# Point-in-time values read on each /metrics scrape.
+metrics.REGISTRY.gauge("jobs_queued", "Jobs waiting in the shared queue.", callback=lambda: job_queue.backlog()[0])
+metrics.REGISTRY.gauge("jobs_running", "Jobs being processed by this replica.", callback=lambda: job_runner.running)
+metrics.REGISTRY.gauge(
+    "db_pool_connections",
+    "Database pool connections by state.",
+    ("state",),
+    callback=lambda: _by_state(db_pool.stats(), "idle", "in_use", "open", "max"),
+)
+
+
+def _pool_counter(name: str, stat: str, documentation: str) -> None:
+    metrics.REGISTRY.counter(name, documentation, callback=lambda: db_pool.stats()[stat])
 
-app = FastAPI(title="ComplianceDrone Python Services")
+
+# Running totals kept by the pool; waits and timeouts are where connection contention shows
+_pool_counter("db_pool_acquires_total", "acquired", "Database connections handed out by the pool.")
+_pool_counter("db_pool_waits_total", "waits", "Connection requests that had to wait for a free slot.")
+_pool_counter("db_pool_wait_seconds_total", "wait_seconds_total", "Time spent waiting for a free connection.")
+_pool_counter("db_pool_timeouts_total", "timeouts", "Connection requests that gave up waiting.")
+_pool_counter("db_pool_connections_opened_total", "connections_opened", "Database connections opened.")
+_pool_counter(
+    "db_pool_connections_recycled_total", "connections_recycled", "Connections closed for age, errors or failed pings."
+)
+_pool_counter("db_pool_health_check_failures_total", "health_check_failures", "Idle connections that failed their ping.")
+metrics.REGISTRY.gauge(
+    "db_pool_wait_seconds_max",
+    "Longest wait for a database connection since start.",
+    callback=lambda: db_pool.stats()["wait_seconds_max"],
+)
+metrics.REGISTRY.gauge(
+    "jobs_receiving",
+    "Admitted jobs whose upload this replica is still receiving.",
+    callback=lambda: admission.stats()["receiving_jobs"],
+)
+metrics.REGISTRY.gauge(
+    "upload_bytes_in_flight",
+    "Upload bytes reserved by requests still receiving.",
+    callback=lambda: admission.stats()["inflight_bytes"],
+)
+ADMISSION_REJECTIONS = metrics.REGISTRY.counter(
+    "admission_rejections_total", "Requests turned away by admission control.", ("reason",)
+)
+metrics.REGISTRY.gauge(
+    "worker_processes",
+    "Stage worker processes by state.",
+    ("state",),
+    callback=lambda: _by_state(worker_pool.stats(), "workers", "idle"),
+)
+
+
+def start_processing(relay_events: bool = True) -> None:
+    """Start the stage workers, the database pool, the queue runner and its NOTIFY listener.
+
+    `relay_events` also feeds job events from every replica into this
+    process's broker, for its /jobs/{job_id}/events subscribers.
+    """
+    global pg_listener
+    worker_pool.start()
+    try:
+        db_pool.open()
+    except psycopg2.Error:
+        logger.warning("Database not reachable at startup; connections will be opened on demand")
+    callbacks = {JOBS_CHANNEL: lambda payload: job_runner.wake(), CANCEL_CHANNEL: job_runner.cancel}
+    if relay_events:
+        callbacks[EVENTS_CHANNEL] = _relay_event
+    pg_listener = PgListener(DATABASE_URL, callbacks)
+    pg_listener.start()
+    job_runner.start()
+
+
+def stop_processing() -> None:
+    job_runner.stop()
+    if pg_listener is not None:
+        pg_listener.stop()
+    worker_pool.close()
+    db_pool.close()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(start_processing)
+    await run_in_threadpool(blob_store.collect_garbage)
+    yield
+    file_executor.shutdown(wait=True)
+    workbook_executor.shutdown(wait=True, cancel_futures=True)
+    await run_in_threadpool(stop_processing)
+
+
+app = FastAPI(title="ComplianceDrone Python Services", lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -34,7 +290,27 @@ app.add_middleware(
 
 
 def get_db_conn():
-    return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    return db_pool.connection()
+
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request, exc: PoolTimeout):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request, exc: AdmissionRejected):
+    ADMISSION_REJECTIONS.inc(reason=exc.reason)
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(UploadError)
+async def upload_error_handler(request, exc: UploadError):
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
 
 
 def _save_upload(file: UploadFile, destination: Path) -> None:
@@ -43,14 +319,16 @@ def _save_upload(file: UploadFile, destination: Path) -> None:
         shutil.copyfileobj(file.file, buffer)
 
 
-def _run_subprocess(command: List[str], cwd: Optional[Path] = None) -> None:
+def _run_stage(stage: str, target: str, *args, cancel: Optional[threading.Event] = None):
     try:
-        subprocess.run(command, cwd=cwd, check=True)
-    except subprocess.CalledProcessError as exc:
-        raise RuntimeError(f"Command failed: {' '.join(command)}") from exc
+        with metrics.STAGE_SECONDS.time(stage=stage):
+            return worker_pool.run(target, *args, timeout=STAGE_TIMEOUTS.get(stage), cancel=cancel)
+    except TaskFailed as exc:
+        logger.error("%s\n%s", exc, exc.remote_traceback)
+        raise
 
 
-def _load_summary(metadata_path: Path, excel_path: Path) -> Dict[str, int]:
+def _load_summary(metadata_path: Path, table_path: Path) -> Dict[str, int]:
     if metadata_path.exists():
         try:
             return json.loads(metadata_path.read_text())
@@ -58,100 +336,656 @@ def _load_summary(metadata_path: Path, excel_path: Path) -> Dict[str, int]:
             pass
 
     try:
-        df = pd.read_excel(excel_path, sheet_name="Summary")
-        summary = df.iloc[0].to_dict()
-        return {k: int(v) for k, v in summary.items() if isinstance(v, (int, float))}
+        return Drone_Data_Process.read_summary(table_path)
     except Exception:
         return {"total_files": 0, "anomalies_found": 0}
 
 
-@app.post("/process-job")
-async def process_job(
-    pilot_id: str = Form(...),
-    location: str = Form(...),
-    files: List[UploadFile] = File(...),
-):
-    if not files:
-        raise HTTPException(status_code=400, detail="At least one file must be provided")
+def _job_status(job_id: str) -> Optional[str]:
+    with get_db_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT status FROM jobs WHERE job_id = %s", (job_id,))
+        row = cur.fetchone()
+    return row["status"] if row else None
 
-    job_id = f"job_{uuid.uuid4().hex[:10]}"
+
+def _remove_outputs(job_dir: Path, names: Sequence[str] = ()) -> None:
+    """Delete the named files from a job folder, or the whole folder and its published artifacts."""
+    if not names:
+        marker = job_dir / DIRECT_UPLOAD_MARKER
+        if marker.exists():
+            incoming_store.delete_prefix(f"{marker.read_text().strip()}/")
+        shutil.rmtree(job_dir, ignore_errors=True)
+        if artifact_store.remote:
+            artifact_store.delete_prefix(f"{job_dir.name}/")
+        return
+    for name in names:
+        (job_dir / name).unlink(missing_ok=True)
+
+
+def _publish_artifacts(job_id: str, paths: Sequence[Path]) -> None:
+    """Copy finished files from the job folder to the artifact store; a no-op when that is the folder."""
+    if not artifact_store.remote:
+        return
     job_dir = OUTPUT_DIR / job_id
-    job_dir.mkdir(parents=True, exist_ok=True)
+    with metrics.STAGE_SECONDS.time(stage="publish"):
+        for path in paths:
+            if path.exists():
+                artifact_store.put_file(path, f"{job_id}/{path.relative_to(job_dir).as_posix()}")
 
-    for uploaded in files:
-        destination = job_dir / uploaded.filename
-        _save_upload(uploaded, destination)
-        uploaded.file.close()
 
-    excel_path = job_dir / "Report_Input.xlsx"
-    metadata_path = job_dir / "Report_Input.json"
-    pdf_path = job_dir / "Final_Report.pdf"
+def _fetch_output(job_id: str, file_path: str) -> Optional[Path]:
+    """Download a published artifact missing from this replica's output volume, with its compressed siblings."""
+    path = output_files.resolve(OUTPUT_DIR, job_id, file_path, must_exist=False)
+    if path is None or not artifact_store.get_file(f"{job_id}/{file_path}", path):
+        return None
+    if path.suffix.lower() in output_files.PRECOMPRESSED_SUFFIXES:
+        for _, suffix in output_files.ENCODINGS:
+            artifact_store.get_file(f"{job_id}/{file_path}{suffix}", path.with_name(path.name + suffix))
+    return path
+
+
+def _build_workbook(job_id: str) -> Optional[Path]:
+    """Write a job's Excel workbook from its Parquet table and publish it; runs on workbook_executor."""
+    table_path = output_files.resolve(OUTPUT_DIR, job_id, "Report_Input.parquet")
+    if table_path is None and artifact_store.remote:
+        table_path = _fetch_output(job_id, "Report_Input.parquet")
+    if table_path is None:
+        return None
+    excel_path = table_path.with_name("Report_Input.xlsx")
+    _run_stage("workbook", "Drone_Data_Process:write_workbook", table_path, excel_path)
+    _publish_artifacts(job_id, [excel_path])
+    return excel_path
+
+
+def _has_table(job_id: str) -> bool:
+    """Whether the job's Parquet table is in its folder or in the artifact store."""
+    table_path = output_files.resolve(OUTPUT_DIR, job_id, "Report_Input.parquet", must_exist=False)
+    if table_path is None:
+        return False
+    if table_path.is_file():
+        return True
+    return artifact_store.remote and artifact_store.size(f"{job_id}/Report_Input.parquet") is not None
+
+
+def _workbook_done(job_id: str, build: Future) -> None:
+    # Failures stay behind to be reported to the next request
+    if build.exception() is None:
+        with _workbook_lock:
+            if _workbook_builds.get(job_id) is build:
+                del _workbook_builds[job_id]
+
+
+def _start_workbook(job_id: str) -> bool:
+    """Queue a build of the job's workbook unless one is under way; false when there is no table to build from.
+
+    A build that failed is reported once (500) and tried again on the next request.
+    """
+    with _workbook_lock:
+        build = _workbook_builds.get(job_id)
+        if build is not None and not build.done():
+            return True
+        _workbook_builds.pop(job_id, None)
+    if build is not None and build.exception() is not None:
+        raise HTTPException(status_code=500, detail="The workbook could not be built")
+    if not _has_table(job_id):
+        return False
+    with _workbook_lock:
+        if job_id not in _workbook_builds:
+            build = _workbook_builds[job_id] = workbook_executor.submit(_build_workbook, job_id)
+            build.add_done_callback(lambda done: _workbook_done(job_id, done))
+    return True
+
 
+def _set_job_status(claim: Claim, status: str) -> None:
     with get_db_conn() as conn, conn.cursor() as cur:
-        cur.execute(
-            "INSERT INTO jobs (job_id, pilot_id, location, status) VALUES (%s, %s, %s, %s)",
-            (job_id, pilot_id, location, "processing"),
-        )
+        job_queue.set_status(cur, claim, status)
         conn.commit()
 
+
+def _publish_event(job_id: str, event_type: str, data: Dict[str, object]) -> None:
+    """Send an event to subscribers on every replica, through NOTIFY."""
+    try:
+        with get_db_conn() as conn, conn.cursor() as cur:
+            notify_event(cur, job_id, event_type, data)
+            conn.commit()
+    except (psycopg2.Error, PoolTimeout):
+        logger.warning("Could not relay %s event for %s; delivering locally only", event_type, job_id)
+        event_broker.publish(job_id, event_type, data)
+
+
+def _relay_event(payload: str) -> None:
+    message = json.loads(payload)
+    event_broker.publish(message["job_id"], message["type"], message["data"])
+
+
+def _publish_progress(job_id: str, files_processed: int, files_received: int) -> None:
+    _publish_event(job_id, "progress", {"files_processed": files_processed, "files_received": files_received})
+
+
+def _run_job(claim: Claim) -> None:
+    """Run the claimed stage of a job, recording progress in `jobs.status`.
+
+    The process stage first brings in the files of a direct upload from
+    where clients stored them, then handles up to PROCESS_BATCH_FILES files
+    that have no record yet. While files remain it queues the job again for
+    another batch, so a large job competes with the others for every batch
+    instead of holding a worker throughout. The last pass writes the Parquet
+    table and per-file records and queues the job for its report stage.
+    Files already handled by the streaming stage during the upload, on
+    whichever replica received it, are picked up from their records; only
+    the rest are processed here. An error requeues the stage until its
+    attempts run out; a lost lease leaves it to the worker that took over.
+    A stage that runs past its timeout, or whose job is cancelled, has its
+    worker process tree killed and its partial outputs removed.
+    """
+    job_id = claim.job_id
+    job_dir = OUTPUT_DIR / job_id
+    table_path = job_dir / "Report_Input.parquet"
+    metadata_path = job_dir / "Report_Input.json"
+    pdf_path = job_dir / "Final_Report.pdf"
+    records_path = job_dir / Drone_Data_Process.RECORDS_FILE
+    started = time.monotonic()
+
     try:
-        _run_subprocess([
-            "python",
-            "Drone_Data_Process.py",
-            str(job_dir),
-            str(excel_path),
-            str(metadata_path),
-        ], cwd=Path(__file__).parent)
+        if claim.stage == "process":
+            _fetch_direct_upload(job_dir)
+            claim.check()
+            if PROCESS_BATCH_FILES > 0:
+                done, total = _run_stage(
+                    "batch",
+                    "Drone_Data_Process:process_batch",
+                    job_dir,
+                    records_path,
+                    PROCESS_BATCH_FILES,
+                    blob_store.root,
+                    cancel=claim.lost,
+                )
+                claim.check()
+                _publish_progress(job_id, done, total)
+                if done < total:
+                    with get_db_conn() as conn, conn.cursor() as cur:
+                        job_queue.advance(cur, claim, "process", time.monotonic() - started)
+                        conn.commit()
+                    return
+            records = _run_stage(
+                "table",
+                "Drone_Data_Process:write_outputs",
+                job_dir,
+                table_path,
+                metadata_path,
+                records_path,
+                blob_store.root,
+                cancel=claim.lost,
+            )
+            claim.check()
+            with get_db_conn() as conn, conn.cursor() as cur:
+                job_files.copy_records(cur, job_id, records)
+                job_queue.advance(cur, claim, "report", time.monotonic() - started)
+                conn.commit()
+            metrics.FILES_PROCESSED.inc(len(records))
+            metrics.IMAGES_PROCESSED.inc(
+                sum(1 for record in records if record["file_type"] in Drone_Data_Process.IMAGE_EXTENSIONS)
+            )
+            return
 
-        _run_subprocess([
-            "python",
-            "ClaudeMain1_fixed.py",
-            str(excel_path),
-            str(pdf_path),
-            str(metadata_path),
-        ], cwd=Path(__file__).parent)
+        _set_job_status(claim, "generating_report")
+        if not table_path.exists() and (job_dir / "Report_Input.xlsx").exists():
+            # Processed before the switch to Parquet
+            table_path = job_dir / "Report_Input.xlsx"
+        _run_stage("pdf", "ClaudeMain1_fixed:build_report", table_path, pdf_path, metadata_path, cancel=claim.lost)
+        claim.check()
+        _publish_artifacts(job_id, [job_dir / name for name in STAGE_OUTPUTS])
+        claim.check()
 
-        summary = _load_summary(metadata_path, excel_path)
+        summary = _load_summary(metadata_path, table_path)
         anomalies_found = int(summary.get("anomalies_found", 0))
 
+        # Built from the table on first download; most jobs are only ever read as Parquet and PDF
         excel_url = f"/outputs/{job_id}/Report_Input.xlsx"
         pdf_url = f"/outputs/{job_id}/Final_Report.pdf"
 
         with get_db_conn() as conn, conn.cursor() as cur:
-            cur.execute(
-                "UPDATE jobs SET status = %s WHERE job_id = %s",
-                ("completed", job_id),
-            )
             cur.execute(
                 "INSERT INTO results (job_id, anomalies_found, excel_url, pdf_url) VALUES (%s, %s, %s, %s)",
                 (job_id, anomalies_found, excel_url, pdf_url),
             )
+            notify_event(
+                cur, job_id, "result", {"anomalies_found": anomalies_found, "excel_url": excel_url, "pdf_url": pdf_url}
+            )
+            # Last, so the result is only kept if this worker still holds the job
+            run_seconds = job_queue.complete(cur, claim, time.monotonic() - started)
             conn.commit()
+        admission.observe_job_duration(run_seconds)
+        metrics.JOBS_FINISHED.inc(status="completed")
 
-        return JSONResponse(
-            content={
-                "job_id": job_id,
-                "anomalies_found": anomalies_found,
-                "excel_url": excel_url,
-                "pdf_url": pdf_url,
-            }
+    except (LeaseLost, TaskCancelled):
+        if _job_status(job_id) == "cancelled":
+            logger.info("Job %s cancelled during its %s stage; removing its files", job_id, claim.stage)
+            _remove_outputs(job_dir)
+        else:
+            logger.warning(
+                "Job %s was taken over by another worker; dropping %s attempt %d", job_id, claim.stage, claim.attempts
+            )
+    except TaskTimedOut as exc:
+        logger.error("Job %s timed out: %s", job_id, exc)
+        try:
+            job_queue.abandon(claim, "timed_out", str(exc))
+        except LeaseLost:
+            return
+        _remove_outputs(job_dir, STAGE_OUTPUTS)
+        metrics.JOBS_FINISHED.inc(status="timed_out")
+    except Exception as exc:
+        logger.exception(
+            "%s stage failed for %s (attempt %d of %d)", claim.stage, job_id, claim.attempts, claim.max_attempts
         )
+        try:
+            retried = job_queue.fail(claim, f"{type(exc).__name__}: {exc}")
+        except LeaseLost:
+            return
+        metrics.JOBS_FINISHED.inc(status="retried" if retried else "failed")
 
-    except Exception as exc:
+
+job_runner = QueueRunner(
+    job_queue, _run_job, JOB_CONCURRENCY, heartbeat_interval=max(1.0, JOB_VISIBILITY_TIMEOUT / 4)
+)
+pg_listener: Optional[PgListener] = None
+
+
+@app.post("/process-job", status_code=202)
+async def process_job(request: Request):
+    """Multipart form with `pilot_id`, `location` and one or more `files`.
+
+    Optional `priority` (rush, standard or backfill) and `customer_id` fields
+    set the job's place in the shared queue.
+
+    Each file starts processing as soon as its part has been received, so
+    detection overlaps with the rest of the upload. A `.zip`, `.tar`,
+    `.tar.gz` or `.tgz` file is unpacked as it streams in, each member
+    starting as soon as it is extracted.
+    """
+    content_length = int(request.headers.get("content-length") or 0)
+    # Reads the shared backlog from the database, so it must not run on the event loop
+    await run_in_threadpool(admission.admit_job, content_length)
+    try:
+        reservation = admission.reserve_upload(content_length)
+    except AdmissionRejected:
+        admission.release_job()
+        raise
+
+    job_id = f"job_{uuid.uuid4().hex[:10]}"
+    job_dir = OUTPUT_DIR / job_id
+    job_dir.mkdir(parents=True, exist_ok=True)
+    # Not in the database until the body is complete; event subscribers can follow along already
+    await run_in_threadpool(_publish_event, job_id, "status", {"status": "uploading"})
+    stream = StreamingJob(
+        job_id, job_dir, file_executor, blob_store, on_progress=lambda *counts: _publish_progress(job_id, *counts)
+    )
+    fields: Dict[str, str] = {}
+
+    try:
+        saver = MultipartSaver(
+            request.headers.get("content-type", ""), job_dir, blob_store, fields.__setitem__, stream.add
+        )
+        try:
+            with metrics.STAGE_SECONDS.time(stage="save"):
+                # Parse each chunk as it arrives; buffering would hold back finished parts
+                async for data in request.stream():
+                    metrics.UPLOAD_BYTES.inc(len(data))
+                    reservation.received_bytes(len(data))
+                    await run_in_threadpool(saver.write, data)
+                saver.finalize()
+        finally:
+            saver.close()
+        if not saver.files:
+            raise HTTPException(status_code=400, detail="At least one file must be provided")
+        missing = [name for name in ("pilot_id", "location") if name not in fields]
+        if missing:
+            raise HTTPException(status_code=422, detail=f"Missing form fields: {', '.join(missing)}")
+        priority = parse_priority(fields.get("priority"))
+    except BaseException as exc:
+        admission.release_job()
+        await run_in_threadpool(_discard_job_dir, stream, job_dir)
+        if isinstance(exc, ClientDisconnect):
+            logger.info("Upload for %s dropped after %d file(s)", job_id, len(saver.files))
+            return JSONResponse(status_code=400, content={"detail": "Upload interrupted"})
+        if isinstance(exc, ValueError):
+            raise HTTPException(status_code=400, detail=str(exc)) from exc
+        raise
+    finally:
+        reservation.release()
+
+    return await run_in_threadpool(
+        _queue_job,
+        job_id,
+        fields["pilot_id"],
+        fields["location"],
+        stream,
+        customer_id=fields.get("customer_id") or None,
+        priority=priority,
+        files=saver.files,
+    )
+
+
+def _discard_job_dir(stream: StreamingJob, job_dir: Path) -> None:
+    stream.cancel()
+    shutil.rmtree(job_dir, ignore_errors=True)
+
+
+def _queue_job(
+    job_id: str,
+    pilot_id: str,
+    location: str,
+    stream: Optional[StreamingJob] = None,
+    customer_id: Optional[str] = None,
+    priority: str = DEFAULT_PRIORITY,
+    files: Sequence[Path] = (),
+    upload_id: Optional[str] = None,
+    held: bool = False,
+    estimated_cost: Optional[float] = None,
+) -> JSONResponse:
+    """Put a fully received job in the shared queue and free its admission slot.
+
+    While files are still in this replica's streaming stage the job is held
+    back, so no worker redoes them. The hold is renewed for as long as the
+    stream runs; should this replica die first, it lapses after the
+    visibility timeout and the files are processed anew. `held` holds the
+    job for streams of an upload's files on other replicas, which release it.
+    """
+    try:
         with get_db_conn() as conn, conn.cursor() as cur:
-            cur.execute(
-                "UPDATE jobs SET status = %s WHERE job_id = %s",
-                ("failed", job_id),
+            job_queue.enqueue(
+                cur,
+                job_id,
+                pilot_id,
+                location,
+                delay=JOB_VISIBILITY_TIMEOUT if stream or held else 0,
+                customer_id=customer_id,
+                priority=priority,
+                estimated_cost=cost_model.estimate_files(files) if estimated_cost is None else estimated_cost,
             )
+            notify_event(cur, job_id, "status", {"status": "queued"})
             conn.commit()
-        raise HTTPException(status_code=500, detail=str(exc))
+    finally:
+        admission.release_job()
+
+    if stream is not None:
+        threading.Thread(target=_release_after_stream, args=(job_id, stream, upload_id), daemon=True).start()
+    return _queued_response(job_id)
+
+
+def _release_after_stream(job_id: str, stream: StreamingJob, upload_id: Optional[str] = None) -> None:
+    try:
+        while not stream.wait(JOB_VISIBILITY_TIMEOUT / 4):
+            try:
+                job_queue.extend_hold(job_id, JOB_VISIBILITY_TIMEOUT)
+            except Exception:
+                logger.exception("Could not extend the hold on %s", job_id)
+    finally:
+        try:
+            # The last replica streaming an upload's files releases its job
+            if upload_id is None or not upload_store.drop_stream(upload_id, job_queue.worker_id):
+                job_queue.make_available(job_id)
+        except Exception:
+            logger.exception("Could not release %s to the queue; it starts when its hold lapses", job_id)
+
+
+def _queued_response(job_id: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=202,
+        content={
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": f"/jobs/{job_id}",
+        },
+    )
+
+
+def _stream_upload_file(session: Dict[str, object], path: Path, digest: str) -> None:
+    upload_id = session["upload_id"]
+    job_id = session["job_id"]
+    with upload_streams_lock:
+        stream = upload_streams.get(upload_id)
+        started = stream is None
+        if started:
+            stream = StreamingJob(
+                job_id,
+                upload_store.job_dir(session),
+                file_executor,
+                blob_store,
+                on_progress=lambda *counts: _publish_progress(job_id, *counts),
+            )
+            upload_streams[upload_id] = stream
+    if started:
+        upload_store.add_stream(upload_id, job_queue.worker_id)
+        threading.Thread(target=_watch_upload_stream, args=(upload_id, job_id, stream), daemon=True).start()
+    stream.add(path, digest)
+
+
+def _watch_upload_stream(upload_id: str, job_id: str, stream: StreamingJob) -> None:
+    """Release this replica's share of an upload committed through another replica once it is processed."""
+    while True:
+        time.sleep(JOB_VISIBILITY_TIMEOUT / 4)
+        with upload_streams_lock:
+            if upload_streams.get(upload_id) is not stream:
+                # Committed through this replica, which released it
+                return
+        try:
+            state = upload_store.status(upload_id)["state"]
+        except UploadError:
+            state = None
+        if state == "open":
+            continue
+        with upload_streams_lock:
+            if upload_streams.get(upload_id) is not stream:
+                return
+            del upload_streams[upload_id]
+        if state is None:
+            # Expired without a commit
+            stream.cancel()
+            return
+        _release_after_stream(job_id, stream, upload_id)
+        return
+
+
+# Chunked uploads feed finished files to the per-file stages before commit, on
+# whichever replica receives each file; every replica streaming an upload is
+# named in its session, so a commit received anywhere holds the job until they
+# are done. A session resumed after a restart has no stream; its files are
+# processed at commit.
+upload_streams: Dict[str, StreamingJob] = {}
+upload_streams_lock = threading.Lock()
+upload_store = UploadStore(OUTPUT_DIR, blobs=blob_store, on_file_complete=_stream_upload_file)
+
+
+def _create_session(payload: Dict, direct: bool = False) -> Dict[str, object]:
+    files = payload.get("files") or []
+    try:
+        priority = parse_priority(payload.get("priority"))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    admission.check_disk(sum(int(entry.get("size") or 0) for entry in files if isinstance(entry, dict)))
+    job_id = f"job_{uuid.uuid4().hex[:10]}"
+    session = upload_store.create(
+        job_id,
+        str(payload.get("pilot_id", "")),
+        str(payload.get("location", "")),
+        files,
+        customer_id=str(payload.get("customer_id") or "") or None,
+        priority=priority,
+        direct=direct,
+    )
+    _publish_event(job_id, "status", {"status": "uploading"})
+    return upload_store.status(session["upload_id"])
+
+
+def _with_upload_urls(status: Dict[str, object]) -> Dict[str, object]:
+    """Add a signed PUT URL to each file of a direct upload that has not been registered yet."""
+    status["urls_expire_at"] = int(time.time()) + UPLOAD_URL_TTL
+    for entry in status["files"]:
+        if not entry["complete"]:
+            key = f"{status['upload_id']}/{entry['name']}"
+            entry["upload_url"] = incoming_store.presign_put(key, entry["size"], UPLOAD_URL_TTL)
+    return status
+
+
+def _check_direct_files(status: Dict[str, object]) -> None:
+    """Confirm that every file of a direct upload is in storage at its declared size, several at a time."""
+    upload_id = status["upload_id"]
+    pending = [entry["name"] for entry in status["files"] if not entry["complete"]]
+    with ThreadPoolExecutor(max_workers=S3_MAX_CONCURRENCY, thread_name_prefix="direct-upload") as pool:
+        sizes = list(pool.map(lambda name: incoming_store.size(f"{upload_id}/{name}"), pending))
+    missing = [name for name, size in zip(pending, sizes) if size is None]
+    if missing:
+        raise UploadError(409, f"{len(missing)} file(s) have not been uploaded, e.g. {missing[0]}")
+    for name, size in zip(pending, sizes):
+        upload_store.record_file(upload_id, name, size)
+
+
+def _fetch_direct_upload(job_dir: Path) -> None:
+    """Bring a committed direct upload's files into its job folder and hash them, several at a time.
+
+    Runs in the job rather than the commit request, so file bytes never
+    pass through the API. Files fetched by an earlier attempt are kept.
+    """
+    marker = job_dir / DIRECT_UPLOAD_MARKER
+    if not marker.exists():
+        return
+    upload_id = marker.read_text().strip()
+
+    def fetch(name: str) -> None:
+        path = job_dir / name
+        if not path.exists() and not incoming_store.get_file(f"{upload_id}/{name}", path):
+            raise UploadError(409, f"{name} is no longer in storage")
+        upload_store.adopt_file(upload_id, name)
+
+    names = [entry["name"] for entry in upload_store.status(upload_id)["files"]]
+    with metrics.STAGE_SECONDS.time(stage="fetch"):
+        with ThreadPoolExecutor(max_workers=S3_MAX_CONCURRENCY, thread_name_prefix="direct-upload") as pool:
+            list(pool.map(fetch, names))
+    incoming_store.delete_prefix(f"{upload_id}/")
+    marker.unlink()
+
+
+@app.post("/uploads", status_code=201)
+def create_upload(payload: Dict = Body(...)):
+    """Start a resumable upload.
+
+    Body: {pilot_id, location, files: [{name, size, sha256?}], priority?, customer_id?}.
+    """
+    return JSONResponse(status_code=201, content=_create_session(payload))
+
+
+@app.post("/uploads/direct", status_code=201)
+def create_direct_upload(payload: Dict = Body(...)):
+    """Start an upload whose files clients PUT straight to storage, bypassing this process.
+
+    Body as for POST /uploads. Each file comes back with an `upload_url`
+    valid for UPLOAD_URL_TTL seconds; POST /uploads/{upload_id}/commit then
+    checks that every file is in storage and queues the job, which fetches
+    them.
+    """
+    if not DIRECT_UPLOADS_ENABLED:
+        raise HTTPException(status_code=501, detail="Direct uploads need S3_BUCKET or DIRECT_UPLOAD_URL")
+    return JSONResponse(status_code=201, content=_with_upload_urls(_create_session(payload, direct=True)))
+
+
+@app.post("/uploads/{upload_id}/urls")
+def renew_upload_urls(upload_id: str):
+    """Fresh signed URLs for the files of a direct upload that have not been registered yet."""
+    status = upload_store.status(upload_id)
+    if not status["direct"] or status["state"] != "open":
+        raise HTTPException(status_code=409, detail="Not an open direct upload")
+    return _with_upload_urls(status)
+
+
+@app.get("/uploads/{upload_id}")
+def get_upload(upload_id: str):
+    return upload_store.status(upload_id)
+
+
+@app.put("/uploads/{upload_id}/files/{filename}")
+async def upload_chunk(
+    upload_id: str,
+    filename: str,
+    request: Request,
+    content_range: str = Header(...),
+    x_chunk_sha256: Optional[str] = Header(None),
+):
+    start, end, total = parse_content_range(content_range)
+    reservation = admission.reserve_upload(end - start)
+    try:
+        writer = await run_in_threadpool(upload_store.open_range, upload_id, filename, start, end, total)
+        try:
+            buffer = bytearray()
+            async for data in request.stream():
+                metrics.UPLOAD_BYTES.inc(len(data))
+                reservation.received_bytes(len(data))
+                buffer += data
+                if len(buffer) >= UPLOAD_WRITE_BUFFER:
+                    await run_in_threadpool(writer.write, buffer)
+                    buffer = bytearray()
+            if buffer:
+                await run_in_threadpool(writer.write, buffer)
+        finally:
+            writer.close()
+    finally:
+        reservation.release()
+    return await run_in_threadpool(upload_store.record_range, upload_id, filename, writer, x_chunk_sha256)
+
+
+@app.post("/uploads/{upload_id}/commit", status_code=202)
+def commit_upload(upload_id: str):
+    status = upload_store.status(upload_id)
+    direct = status["direct"]
+    if direct and status["state"] == "open":
+        _check_direct_files(status)
+    admission.admit_job()
+    try:
+        session, committed_now = upload_store.commit(upload_id)
+    except BaseException:
+        admission.release_job()
+        raise
+    if not committed_now:
+        admission.release_job()
+        return _queued_response(session["job_id"])
+    with upload_streams_lock:
+        stream = upload_streams.pop(upload_id, None)
+    job_dir = upload_store.job_dir(session)
+    estimated_cost = None
+    if direct:
+        # The files are still in storage; the job fetches them
+        (job_dir / DIRECT_UPLOAD_MARKER).write_text(upload_id)
+        estimated_cost = cost_model.estimate(
+            sum(1 for name in session["files"] if Path(name).suffix.lower() in Drone_Data_Process.IMAGE_EXTENSIONS),
+            sum(entry["size"] for entry in session["files"].values()),
+        )
+    try:
+        return _queue_job(
+            session["job_id"],
+            session["pilot_id"],
+            session["location"],
+            stream,
+            customer_id=session.get("customer_id"),
+            priority=session.get("priority") or DEFAULT_PRIORITY,
+            files=[job_dir / name for name in session["files"]],
+            upload_id=upload_id,
+            held=bool(session.get("streamed_by")),
+            estimated_cost=estimated_cost,
+        )
+    except Exception:
+        if stream is not None:
+            with upload_streams_lock:
+                upload_streams[upload_id] = stream
+        (job_dir / DIRECT_UPLOAD_MARKER).unlink(missing_ok=True)
+        upload_store.reopen(upload_id)
+        raise
 
 
 @app.get("/jobs/{job_id}")
-async def get_job_status(job_id: str):
+def get_job_status(job_id: str):
     with get_db_conn() as conn, conn.cursor() as cur:
         cur.execute(
-            "SELECT job_id, pilot_id, location, status, created_at FROM jobs WHERE job_id = %s",
+            "SELECT job_id, pilot_id, location, status, priority, created_at FROM jobs WHERE job_id = %s",
             (job_id,),
         )
         job = cur.fetchone()
@@ -165,15 +999,130 @@ async def get_job_status(job_id: str):
         result = cur.fetchone()
 
     return JSONResponse(
-        content={
+        content=jsonable_encoder({
             "job": job,
             "result": result,
-        }
+        })
+    )
+
+
+@app.delete("/jobs/{job_id}", status_code=202)
+def cancel_job(job_id: str):
+    """Cancel a queued or running job and delete its files and per-file records.
+
+    A running stage is stopped by the worker holding the job, wherever it
+    runs, which kills the stage's process tree and removes the folder.
+    """
+    cancelled = job_queue.cancel(job_id)
+    if cancelled is None:
+        status = _job_status(job_id)
+        if status is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        raise HTTPException(status_code=409, detail=f"Job is already {status}")
+    metrics.JOBS_FINISHED.inc(status="cancelled")
+    with get_db_conn() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM job_files WHERE job_id = %s", (job_id,))
+        conn.commit()
+    if not cancelled["running"]:
+        _remove_outputs(OUTPUT_DIR / job_id)
+    return {"job_id": job_id, "status": "cancelled", "previous_status": cancelled["previous_status"]}
+
+
+@app.get("/jobs/{job_id}/files")
+def get_job_files(
+    job_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    after: Optional[int] = Query(None, ge=0),
+    anomalies_only: bool = False,
+):
+    """Per-file records of a completed job, paged by row id.
+
+    Pass the returned `next_after` as `after` to get the following page; it
+    is null on the last page.
+    """
+    with get_db_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM jobs WHERE job_id = %s", (job_id,))
+        if cur.fetchone() is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        rows = job_files.fetch_page(cur, job_id, limit + 1, after, anomalies_only)
+
+    next_after = rows[limit - 1]["id"] if len(rows) > limit else None
+    return JSONResponse(
+        content=jsonable_encoder({
+            "job_id": job_id,
+            "files": rows[:limit],
+            "next_after": next_after,
+        })
+    )
+
+
+def _job_snapshot(job_id: str) -> Optional[Dict[str, object]]:
+    with get_db_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            "SELECT j.status, r.anomalies_found, r.excel_url, r.pdf_url"
+            " FROM jobs j LEFT JOIN results r ON r.job_id = j.job_id WHERE j.job_id = %s",
+            (job_id,),
+        )
+        return cur.fetchone()
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, last_event_id: Optional[str] = Header(None)):
+    """Server-Sent Events stream of `status`, `progress` and `result` events.
+
+    Reconnecting clients send Last-Event-ID and get only what they missed;
+    when the history is gone (e.g. after a restart) they get the current
+    state from the database instead. The stream ends after the final status.
+    """
+    subscription = event_broker.subscribe(job_id, last_event_id)
+    try:
+        initial = subscription.replay
+        if initial is None:
+            snapshot = await run_in_threadpool(_job_snapshot, job_id)
+            if snapshot is None:
+                raise HTTPException(status_code=404, detail="Job not found")
+            event_id = event_broker.last_event_id(job_id)
+            initial = []
+            if snapshot["excel_url"]:
+                initial.append(Event(event_id, "result", {
+                    "anomalies_found": snapshot["anomalies_found"],
+                    "excel_url": snapshot["excel_url"],
+                    "pdf_url": snapshot["pdf_url"],
+                }))
+            initial.append(Event(event_id, "status", {"status": snapshot["status"]}))
+    except BaseException:
+        event_broker.unsubscribe(subscription)
+        raise
+
+    return StreamingResponse(
+        _event_stream(subscription, initial),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 
+async def _event_stream(subscription: Subscription, initial: List[Event]):
+    try:
+        yield "retry: 3000\n\n"
+        for event in initial:
+            yield event.encode()
+            if event.is_terminal:
+                return
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), EVENT_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield event.encode()
+            if event.is_terminal:
+                return
+    finally:
+        event_broker.unsubscribe(subscription)
+
+
 @app.post("/generate-flight-path")
-async def generate_flight_path(
+def generate_flight_path(
     job_id: str = Form(...),
     kmz: UploadFile = File(...),
 ):
@@ -191,18 +1140,16 @@ async def generate_flight_path(
     _save_upload(kmz, kmz_path)
     kmz.file.close()
 
-    _run_subprocess(
-        [
-            "python",
-            "FlightPlanTool.py",
-            str(kmz_path),
-            str(flight_dir),
-        ],
-        cwd=Path(__file__).parent,
-    )
-
-    kml_path = flight_dir / "flight_path.kml"
-    geojson_path = flight_dir / "flight_path.geojson"
+    try:
+        artifacts = _run_stage("flight_path", "FlightPlanTool:generate_paths", flight_dir)
+        kml_path = artifacts["kml"]
+        geojson_path = artifacts["geojson"]
+        published = [kmz_path]
+        for path in (kml_path, geojson_path):
+            published += [path, *_run_stage("flight_path", "output_files:precompress", path)]
+    except TaskTimedOut as exc:
+        raise HTTPException(status_code=504, detail=str(exc)) from exc
+    _publish_artifacts(job_id, published)
 
     kml_url = f"/outputs/{job_id}/flight_paths/{kml_path.name}"
     geojson_url = f"/outputs/{job_id}/flight_paths/{geojson_path.name}"
@@ -225,6 +1172,62 @@ async def generate_flight_path(
     )
 
 
+@app.api_route("/outputs/{job_id}/{file_path:path}", methods=["GET", "HEAD"])
+def get_output(job_id: str, file_path: str, request: Request):
+    """Serve a job's report, workbook or flight path file.
+
+    ETags are content hashes, so revalidation returns 304 only when the bytes
+    are identical. Byte ranges (206) let PDF viewers fetch pages on demand,
+    and GeoJSON/KML are sent from their `.br`/`.gz` siblings when accepted.
+    Artifacts published by another replica are read through from the
+    artifact store on first request. The Excel workbook is built in the
+    background from the job's Parquet table the first time anyone asks
+    for it; until it is ready the answer is 202 with a Retry-After.
+    """
+    path = output_files.resolve(OUTPUT_DIR, job_id, file_path)
+    if path is None and artifact_store.remote:
+        path = _fetch_output(job_id, file_path)
+    if path is None and file_path == "Report_Input.xlsx" and _start_workbook(job_id):
+        return JSONResponse(
+            status_code=202,
+            content={"detail": "The workbook is being built"},
+            headers={"Retry-After": str(WORKBOOK_RETRY_AFTER)},
+        )
+    if path is None:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    variant, coding = output_files.select_variant(path, request.headers.get("accept-encoding", ""))
+    stat_result = variant.stat()
+    etag = output_etags.etag(variant, stat_result)
+    headers = output_files.cache_headers(
+        etag, coding, path.suffix.lower() in output_files.PRECOMPRESSED_SUFFIXES
+    )
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and output_files.etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(
+        variant,
+        media_type=output_files.media_type(path),
+        headers=headers,
+        stat_result=stat_result,
+        content_disposition_type="inline",
+        filename=path.name,
+    )
+
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/")
 async def root():
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "db_pool": db_pool.stats(),
+        "workers": worker_pool.stats(),
+        "admission": admission.stats(),
+        "jobs_running_here": job_runner.running,
+    }
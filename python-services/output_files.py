@@ -0,0 +1,159 @@
+"""Lookup, content-hash ETags and precompressed variants for files under the job output folders."""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+try:  # Optional: .br variants are only written when brotli is installed
+    import brotli
+except ImportError:  # pragma: no cover - depends on the image
+    brotli = None
+
+# Text outputs worth compressing ahead of time; PDFs, images, xlsx and Parquet are already compressed
+PRECOMPRESSED_SUFFIXES = {".geojson", ".kml"}
+# Preferred first when the client accepts several
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+MEDIA_TYPES = {
+    ".geojson": "application/geo+json",
+    ".kml": "application/vnd.google-earth.kml+xml",
+    ".kmz": "application/vnd.google-earth.kmz",
+    ".pdf": "application/pdf",
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".parquet": "application/vnd.apache.parquet",
+    ".json": "application/json",
+}
+
+
+def resolve(output_dir: Path, job_id: str, relative_path: str, must_exist: bool = True) -> Optional[Path]:
+    """The file for `/outputs/{job_id}/{relative_path}`, or None.
+
+    Hidden entries (the blob store, upload state, streaming records) are
+    never served, nor is anything outside the job's folder. With
+    `must_exist` false the path is returned even if nothing is there yet.
+    """
+    parts = [job_id, *relative_path.split("/")]
+    if any(not part or part.startswith(".") for part in parts):
+        return None
+    job_dir = (output_dir / job_id).resolve()
+    path = (job_dir / relative_path).resolve()
+    if not path.is_relative_to(job_dir) or (must_exist and not path.is_file()):
+        return None
+    return path
+
+
+def media_type(path: Path) -> Optional[str]:
+    return MEDIA_TYPES.get(path.suffix.lower())
+
+
+def accepted_encodings(accept_encoding: str) -> List[str]:
+    """Codings from an Accept-Encoding header, dropping any with q=0."""
+    accepted = []
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.append(coding.strip().lower())
+    return accepted
+
+
+def select_variant(path: Path, accept_encoding: str) -> Tuple[Path, Optional[str]]:
+    """The precompressed sibling the client accepts, if one is current; else the file itself."""
+    if path.suffix.lower() not in PRECOMPRESSED_SUFFIXES:
+        return path, None
+    accepted = accepted_encodings(accept_encoding)
+    source_mtime = path.stat().st_mtime_ns
+    for coding, suffix in ENCODINGS:
+        if coding not in accepted and "*" not in accepted:
+            continue
+        variant = path.with_name(path.name + suffix)
+        try:
+            if variant.stat().st_mtime_ns >= source_mtime:
+                return variant, coding
+        except FileNotFoundError:
+            continue
+    return path, None
+
+
+def precompress(path: Path) -> List[Path]:
+    """Write `.gz` (and `.br` when available) next to `path`; returns the files written."""
+    data = path.read_bytes()
+    variants = [(path.with_name(path.name + ".gz"), gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((path.with_name(path.name + ".br"), brotli.compress(data, quality=11)))
+    written = []
+    for target, payload in variants:
+        tmp = target.with_name(f".{target.name}.tmp")
+        tmp.write_bytes(payload)
+        os.replace(tmp, target)
+        written.append(target)
+    return written
+
+
+class ETagCache:
+    """Strong ETags from the SHA-256 of a file's bytes.
+
+    Digests are keyed on inode, size and mtime, so a rewritten file gets a
+    new tag while repeat requests for an unchanged one cost a single stat.
+    """
+
+    def __init__(self, max_entries: int = 4096) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[int, int, int, int], str]" = OrderedDict()
+
+    def etag(self, path: Path, stat_result: Optional[os.stat_result] = None) -> str:
+        st = stat_result or path.stat()
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                return cached
+
+        digest = hashlib.sha256()
+        with path.open("rb") as handle:
+            for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+                digest.update(chunk)
+        tag = f'"{digest.hexdigest()}"'
+
+        with self._lock:
+            self._entries[key] = tag
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return tag
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match uses weak comparison, so a W/ prefix on either side is ignored."""
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == bare:
+            return True
+    return False
+
+
+def cache_headers(etag: str, coding: Optional[str], precompressible: bool) -> Dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if coding:
+        headers["Content-Encoding"] = coding
+    if precompressible:
+        headers["Vary"] = "Accept-Encoding"
+    return headers
@@ -0,0 +1,431 @@
+"""Job queue kept in the `jobs` table, shared by any number of replicas through row locks."""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import select
+import socket
+import threading
+import uuid
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import psycopg2
+
+from db_pool import ConnectionPool
+from scheduler import DEFAULT_PRIORITY, STAGES, FairShareScheduler
+
+logger = logging.getLogger(__name__)
+
+RUNNING_STATUSES = ("processing", "generating_report")
+# NOTIFY channels: a job became claimable / a job event for SSE subscribers on any replica /
+# a job was cancelled and whichever worker runs it should stop
+JOBS_CHANNEL = "jobs_available"
+EVENTS_CHANNEL = "job_events"
+CANCEL_CHANNEL = "jobs_cancelled"
+
+
+class LeaseLost(RuntimeError):
+    """Heartbeats lapsed and another worker may own the job now, or it was cancelled; stop touching it."""
+
+
+def notify_event(cur, job_id: str, event_type: str, data: Dict[str, object]) -> None:
+    """Queue a job event for delivery when the cursor's transaction commits."""
+    payload = json.dumps({"job_id": job_id, "type": event_type, "data": data})
+    cur.execute("SELECT pg_notify(%s, %s)", (EVENTS_CHANNEL, payload))
+
+
+@dataclass
+class Claim:
+    job_id: str
+    # Written to jobs.locked_by; every later write is fenced on it
+    token: str
+    attempts: int
+    max_attempts: int
+    # The work item claimed; see `scheduler.STAGES`
+    stage: str = STAGES[0]
+    lost: threading.Event = field(default_factory=threading.Event)
+
+    def check(self) -> None:
+        if self.lost.is_set():
+            raise LeaseLost(f"Lease on {self.job_id} lost")
+
+
+class PgJobQueue:
+    """Claims, heartbeats and retries for rows of the `jobs` table.
+
+    A worker claims the available `queued` row that `scheduler` puts first,
+    with `FOR UPDATE SKIP LOCKED`, so concurrent workers never take the same
+    job and never wait on each other. Each stage of a job is a separate work
+    item: `advance` queues the job again for its next stage with fresh
+    attempts. While it runs the job it refreshes
+    `heartbeat_at`; a running job whose heartbeat is older than
+    `visibility_timeout` is assumed orphaned (worker killed, host lost) and is
+    claimed again, until `max_attempts` is used up and it is marked failed.
+    Every write made under a claim is conditional on `locked_by` still
+    holding the claim's token, so a worker that was presumed dead cannot
+    overwrite the state written by the one that took over.
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        visibility_timeout: float = 60.0,
+        retry_delay: float = 15.0,
+        max_attempts: int = 3,
+        scheduler: Optional[FairShareScheduler] = None,
+    ) -> None:
+        self.pool = pool
+        self.scheduler = scheduler or FairShareScheduler()
+        self.visibility_timeout = visibility_timeout
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    def enqueue(
+        self,
+        cur,
+        job_id: str,
+        pilot_id: str,
+        location: str,
+        delay: float = 0.0,
+        customer_id: Optional[str] = None,
+        priority: str = DEFAULT_PRIORITY,
+        estimated_cost: float = 0.0,
+    ) -> None:
+        """Insert the job as queued, claimable after `delay` seconds, on the caller's transaction."""
+        cur.execute(
+            "INSERT INTO jobs (job_id, pilot_id, location, customer_id, priority, estimated_cost, status,"
+            " stage, max_attempts, available_at)"
+            " VALUES (%s, %s, %s, %s, %s, %s, 'queued', %s, %s, now() + make_interval(secs => %s))",
+            (job_id, pilot_id, location, customer_id, priority, estimated_cost, STAGES[0], self.max_attempts, delay),
+        )
+        cur.execute("SELECT pg_notify(%s, %s)", (JOBS_CHANNEL, job_id))
+
+    def make_available(self, job_id: str) -> None:
+        """Let workers claim a queued job now rather than when its delay runs out."""
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "UPDATE jobs SET available_at = now() WHERE job_id = %s AND status = 'queued'",
+                (job_id,),
+            )
+            cur.execute("SELECT pg_notify(%s, %s)", (JOBS_CHANNEL, job_id))
+            conn.commit()
+
+    def extend_hold(self, job_id: str, seconds: float) -> None:
+        """Keep a queued job from being claimed for at least another `seconds`."""
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "UPDATE jobs SET available_at = GREATEST(available_at, now() + make_interval(secs => %s))"
+                " WHERE job_id = %s AND status = 'queued'",
+                (seconds, job_id),
+            )
+            conn.commit()
+
+    def claim(self) -> Optional[Claim]:
+        """Take the next available job, or None; orphans out of attempts are failed on the way."""
+        token = f"{self.worker_id}:{uuid.uuid4().hex[:8]}"
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = now(), locked_by = NULL,"
+                " last_error = 'Worker stopped responding; no attempts left'"
+                " WHERE status = ANY(%s) AND heartbeat_at < now() - make_interval(secs => %s)"
+                " AND attempts >= max_attempts RETURNING job_id",
+                (list(RUNNING_STATUSES), self.visibility_timeout),
+            )
+            for row in cur.fetchall():
+                logger.warning("Job %s abandoned by its worker and out of attempts", row["job_id"])
+                notify_event(cur, row["job_id"], "status", {"status": "failed"})
+
+            candidates, params = self.scheduler.candidates(RUNNING_STATUSES, self.visibility_timeout)
+            cur.execute(
+                "UPDATE jobs SET status = 'processing', attempts = attempts + 1, locked_by = %s,"
+                f" heartbeat_at = now(), started_at = now(), last_error = NULL WHERE id = ({candidates})"
+                " RETURNING job_id, attempts, max_attempts, stage",
+                (token, *params),
+            )
+            row = cur.fetchone()
+            if row is not None:
+                notify_event(cur, row["job_id"], "status", {"status": "processing"})
+            conn.commit()
+        if row is None:
+            return None
+        if row["attempts"] > 1:
+            logger.info("Job %s claimed for attempt %d", row["job_id"], row["attempts"])
+        return Claim(row["job_id"], token, row["attempts"], row["max_attempts"], row["stage"])
+
+    def _fenced(self, cur, claim: Claim, sql: str, params: Tuple = (), returning: str = "") -> None:
+        if returning:
+            returning = " RETURNING " + returning
+        cur.execute(sql + " WHERE job_id = %s AND locked_by = %s" + returning, (*params, claim.job_id, claim.token))
+        if cur.rowcount == 0:
+            claim.lost.set()
+            raise LeaseLost(f"Lease on {claim.job_id} lost")
+
+    def heartbeats(self, claims: Sequence[Claim]) -> None:
+        """Extend the leases of running claims; any that was taken over is flagged lost."""
+        if not claims:
+            return
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "UPDATE jobs SET heartbeat_at = now() WHERE locked_by = ANY(%s) RETURNING locked_by",
+                ([claim.token for claim in claims],),
+            )
+            alive = {row["locked_by"] for row in cur.fetchall()}
+            conn.commit()
+        for claim in claims:
+            if claim.token not in alive:
+                logger.warning("Lease on %s lost; another worker has taken it over", claim.job_id)
+                claim.lost.set()
+
+    def set_status(self, cur, claim: Claim, status: str) -> None:
+        self._fenced(cur, claim, "UPDATE jobs SET status = %s", (status,))
+        notify_event(cur, claim.job_id, "status", {"status": status})
+
+    def advance(self, cur, claim: Claim, stage: str, run_seconds: float) -> None:
+        """Queue the job for its next stage on the caller's transaction, which holds this stage's output."""
+        self._fenced(
+            cur,
+            claim,
+            "UPDATE jobs SET status = 'queued', stage = %s, attempts = 0, locked_by = NULL,"
+            " available_at = now(), run_seconds = run_seconds + %s",
+            (stage, run_seconds),
+        )
+        cur.execute("SELECT pg_notify(%s, %s)", (JOBS_CHANNEL, claim.job_id))
+        notify_event(cur, claim.job_id, "status", {"status": "queued"})
+
+    def complete(self, cur, claim: Claim, run_seconds: float) -> float:
+        """Mark the job completed on the caller's transaction, which must also hold its results.
+
+        Returns the seconds spent running all of the job's stages.
+        """
+        self._fenced(
+            cur,
+            claim,
+            "UPDATE jobs SET status = 'completed', finished_at = now(), locked_by = NULL,"
+            " run_seconds = run_seconds + %s",
+            (run_seconds,),
+            returning="run_seconds",
+        )
+        run_seconds = cur.fetchone()["run_seconds"]
+        notify_event(cur, claim.job_id, "status", {"status": "completed"})
+        return run_seconds
+
+    def fail(self, claim: Claim, error: str) -> bool:
+        """Requeue the job with a growing delay, or fail it for good; True when it will be retried."""
+        if claim.attempts >= claim.max_attempts:
+            self.abandon(claim, "failed", error)
+            return False
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            self._fenced(
+                cur,
+                claim,
+                "UPDATE jobs SET status = 'queued', locked_by = NULL, last_error = %s,"
+                " available_at = now() + make_interval(secs => %s)",
+                (error, self.retry_delay * claim.attempts),
+            )
+            notify_event(cur, claim.job_id, "status", {"status": "queued"})
+            conn.commit()
+        return True
+
+    def abandon(self, claim: Claim, status: str, error: str) -> None:
+        """End the job with a final `status` such as failed or timed_out, without retrying."""
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            self._fenced(
+                cur,
+                claim,
+                "UPDATE jobs SET status = %s, finished_at = now(), locked_by = NULL, last_error = %s",
+                (status, error),
+            )
+            notify_event(cur, claim.job_id, "status", {"status": status})
+            conn.commit()
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, object]]:
+        """Cancel a queued or running job; None if it has already finished or does not exist.
+
+        Taking the lock away fences off the worker running it, which is also
+        told through `CANCEL_CHANNEL`. The returned `running` is True while
+        a live worker still holds the job and is left to clean up after it.
+        """
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "UPDATE jobs j SET status = 'cancelled', finished_at = now(), locked_by = NULL,"
+                " last_error = 'Cancelled'"
+                " FROM (SELECT id, status, locked_by, heartbeat_at FROM jobs WHERE job_id = %s FOR UPDATE) old"
+                " WHERE j.id = old.id AND old.status = ANY(%s)"
+                " RETURNING old.status AS previous_status,"
+                " old.locked_by IS NOT NULL AND old.heartbeat_at >= now() - make_interval(secs => %s) AS running",
+                (job_id, ["queued", *RUNNING_STATUSES], self.visibility_timeout),
+            )
+            row = cur.fetchone()
+            if row is not None:
+                cur.execute("SELECT pg_notify(%s, %s)", (CANCEL_CHANNEL, job_id))
+                notify_event(cur, job_id, "status", {"status": "cancelled"})
+            conn.commit()
+        return row
+
+    def backlog(self) -> Tuple[int, int]:
+        """Jobs waiting and jobs running, across every replica."""
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "SELECT count(*) FILTER (WHERE status = 'queued') AS queued,"
+                " count(*) FILTER (WHERE status <> 'queued') AS running"
+                " FROM jobs WHERE status = ANY(%s)",
+                (["queued", *RUNNING_STATUSES],),
+            )
+            row = cur.fetchone()
+        return row["queued"], row["running"]
+
+
+class QueueRunner:
+    """`concurrency` threads that claim jobs from the queue and run `handler(claim)`.
+
+    Idle threads sleep until `wake()` (driven by NOTIFY) or `poll_interval`,
+    whichever comes first; the poll also picks up delayed retries and
+    orphaned jobs. One more thread sends the heartbeats for every running
+    claim.
+    """
+
+    def __init__(
+        self,
+        queue: PgJobQueue,
+        handler: Callable[[Claim], None],
+        concurrency: int,
+        poll_interval: float = 5.0,
+        heartbeat_interval: float = 10.0,
+    ) -> None:
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = max(0, concurrency)
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self._wake = threading.Condition()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._running: Dict[str, Claim] = {}
+        self._threads: List[threading.Thread] = []
+
+    @property
+    def running(self) -> int:
+        with self._lock:
+            return len(self._running)
+
+    def cancel(self, job_id: str) -> bool:
+        """Flag a job running here as lost, so its stage is killed; False if it is not running here."""
+        with self._lock:
+            claim = self._running.get(job_id)
+        if claim is None:
+            return False
+        claim.lost.set()
+        return True
+
+    def start(self) -> None:
+        if self.concurrency == 0:
+            return
+        for index in range(self.concurrency):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def wake(self) -> None:
+        with self._wake:
+            self._wake.notify()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop claiming; running jobs are allowed to finish within `timeout`."""
+        self._stop.set()
+        with self._wake:
+            self._wake.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            try:
+                claim = self.queue.claim()
+            except Exception:
+                logger.exception("Could not claim a job")
+                claim = None
+            if claim is None:
+                with self._wake:
+                    if not self._stop.is_set():
+                        self._wake.wait(self.poll_interval)
+                continue
+            with self._lock:
+                self._running[claim.job_id] = claim
+            try:
+                self.handler(claim)
+            except Exception:
+                logger.exception("Job %s failed", claim.job_id)
+            finally:
+                with self._lock:
+                    self._running.pop(claim.job_id, None)
+
+    def _heartbeat(self) -> None:
+        # Keeps beating during shutdown for as long as jobs are still finishing
+        while not self._stop.wait(self.heartbeat_interval) or self.running:
+            with self._lock:
+                claims = list(self._running.values())
+            try:
+                self.queue.heartbeats(claims)
+            except Exception:
+                logger.exception("Heartbeat failed")
+
+
+class PgListener:
+    """LISTEN on a dedicated connection and hand each notification to its channel's callback.
+
+    Reconnects with backoff if the connection drops; notifications sent
+    while disconnected are lost, which callers must tolerate.
+    """
+
+    def __init__(self, dsn: str, callbacks: Dict[str, Callable[[str], None]]) -> None:
+        self.dsn = dsn
+        self.callbacks = callbacks
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="pg-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5)
+
+    def _run(self) -> None:
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                conn = psycopg2.connect(self.dsn)
+            except psycopg2.Error as exc:
+                logger.warning("LISTEN connection failed (%s); retrying in %.0fs", exc, backoff)
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+            backoff = 1.0
+            try:
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    for channel in self.callbacks:
+                        cur.execute(f'LISTEN "{channel}"')
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            self.callbacks[notify.channel](notify.payload)
+                        except Exception:
+                            logger.exception("Handler for %s notification failed", notify.channel)
+            except (psycopg2.Error, OSError) as exc:
+                logger.warning("LISTEN connection lost: %s", exc)
+            finally:
+                conn.close()
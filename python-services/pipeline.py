@@ -0,0 +1,253 @@
+"""Per-file processing that runs while a job's upload is still arriving."""
+
+from __future__ import annotations
+
+import json
+import logging
+import threading
+from concurrent.futures import Executor, Future, wait
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:  # older python-multipart releases
+    from multipart.multipart import MultipartParser, parse_options_header
+
+import Drone_Data_Process
+import archives
+import inference
+import radiometric
+from metrics import STAGE_SECONDS
+from blob_store import BlobStore, BlobWriter
+
+logger = logging.getLogger(__name__)
+
+# Form fields are small; anything larger is a client error.
+MAX_FIELD_BYTES = 64 * 1024
+
+
+class StreamingJob:
+    """Runs the per-file stages on each upload as soon as it is on disk.
+
+    Records are appended to `RECORDS_FILE` in the job folder; the finalize
+    stage picks them up and only processes files that are not there yet.
+    Radiometric results are cached in the blob store by content digest, so a
+    frame seen in an earlier job is not analysed again.
+    """
+
+    def __init__(
+        self,
+        job_id: str,
+        job_dir: Path,
+        executor: Executor,
+        store: BlobStore,
+        on_progress: Optional[Callable[[int, int], None]] = None,
+    ) -> None:
+        self.job_id = job_id
+        self.store = store
+        self.on_progress = on_progress
+        self.job_dir = job_dir
+        self.records_path = job_dir / Drone_Data_Process.RECORDS_FILE
+        self.annotated_dir = job_dir / "annotated"
+        self.annotated_dir.mkdir(parents=True, exist_ok=True)
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._futures: List[Future] = []
+        self.files_added = 0
+        self.files_done = 0
+        self.cache_hits = 0
+
+    def add(self, file_path: Path, digest: str) -> None:
+        with self._lock:
+            self._futures.append(self._executor.submit(self._process, file_path, digest))
+            self.files_added += 1
+
+    def _analyze(self, file_path: Path, digest: str) -> Optional[Dict[str, object]]:
+        kind = f"thermal-{radiometric.settings_fingerprint()}"
+        cached = self.store.get_result(digest, kind)
+        if cached is not None:
+            with self._lock:
+                self.cache_hits += 1
+            return cached["thermal"]
+        thermal = radiometric.analyze_images([file_path], workers=1).get(file_path)
+        self.store.put_result(digest, kind, {"thermal": thermal})
+        return thermal
+
+    def _detect(self, file_path: Path, digest: str) -> Optional[List[Dict[str, object]]]:
+        """Model detections for a frame without temperatures, cached per model; None without a model."""
+        if inference.default_detector() is None or file_path.suffix.lower() not in Drone_Data_Process.IMAGE_EXTENSIONS:
+            return None
+        kind = f"detect-{inference.settings_fingerprint()}"
+        cached = self.store.get_result(digest, kind)
+        if cached is not None:
+            return cached["detections"]
+        detections = Drone_Data_Process.detect_images([file_path]).get(file_path)
+        self.store.put_result(digest, kind, {"detections": detections})
+        return detections
+
+    def _process(self, file_path: Path, digest: str) -> None:
+        try:
+            with STAGE_SECONDS.time(stage="process"):
+                thermal = self._analyze(file_path, digest)
+                detections = self._detect(file_path, digest) if thermal is None else None
+                relative_path = file_path.relative_to(self.job_dir).as_posix()
+                record = Drone_Data_Process.build_record(
+                    file_path, thermal, sha256=digest, detections=detections, relative_path=relative_path
+                )
+                records = [record]
+                if file_path.suffix.lower() in Drone_Data_Process.IMAGE_EXTENSIONS:
+                    if record["anomaly_detected"]:
+                        # The annotated copy starts as the original frame, so share its blob
+                        target = self.annotated_dir / relative_path
+                        target.parent.mkdir(parents=True, exist_ok=True)
+                        self.store.link_into(digest, target)
+                        record["annotated_path"] = f"annotated/{relative_path}"
+                    else:
+                        record["annotated_path"] = relative_path
+        except Exception:
+            # The finalize stage retries anything that has no record
+            logger.exception("Streaming stage failed for %s in %s", file_path.name, self.job_id)
+            records = []
+        lines = "".join(json.dumps(record) + "\n" for record in records)
+        with self._lock:
+            if lines:
+                with self.records_path.open("a") as handle:
+                    handle.write(lines)
+            self.files_done += 1
+            done, added = self.files_done, self.files_added
+        if self.on_progress is not None:
+            self.on_progress(done, added)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the files added so far; False if some are still running after `timeout` seconds."""
+        with self._lock:
+            pending = list(self._futures)
+        return not wait(pending, timeout).not_done
+
+    def cancel(self) -> None:
+        with self._lock:
+            pending = list(self._futures)
+        for future in pending:
+            future.cancel()
+        wait(pending)
+
+
+class MultipartSaver:
+    """Incremental multipart/form-data parser that streams file parts into the blob store.
+
+    Each file part is hashed as it is written and then hard-linked into
+    `target_dir`. `on_field(name, value)` fires for every form field and
+    `on_file(path, digest)` as soon as a file part is complete, while the
+    rest of the body is still being received. A zip or tar(.gz) part is
+    extracted as it arrives, and `on_file` fires for each member instead.
+    """
+
+    def __init__(
+        self,
+        content_type: str,
+        target_dir: Path,
+        store: BlobStore,
+        on_field: Callable[[str, str], None],
+        on_file: Callable[[Path, str], None],
+    ) -> None:
+        mime, params = parse_options_header(content_type)
+        if mime != b"multipart/form-data" or b"boundary" not in params:
+            raise ValueError("Expected a multipart/form-data body")
+        self.target_dir = target_dir
+        self.store = store
+        self.on_field = on_field
+        self.on_file = on_file
+        self.files: List[Path] = []
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._field_name = ""
+        self._field_value: Optional[bytearray] = None
+        self._file_path: Optional[Path] = None
+        self._blob: Optional[BlobWriter] = None
+        self._archive: Optional[archives.StreamExtractor] = None
+        self._parser = MultipartParser(params[b"boundary"], {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": lambda data, start, end: self._header_field.extend(data[start:end]),
+            "on_header_value": lambda data, start, end: self._header_value.extend(data[start:end]),
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def write(self, data: bytes) -> None:
+        self._parser.write(data)
+
+    def finalize(self) -> None:
+        self._parser.finalize()
+
+    def close(self) -> None:
+        """Release a half-written file if the body was cut short."""
+        if self._blob is not None:
+            self._blob.abort()
+            self._blob = None
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+        self._field_value = None
+        self._file_path = None
+
+    def _on_header_end(self) -> None:
+        self._headers[bytes(self._header_field).lower()] = bytes(self._header_value)
+        self._header_field.clear()
+        self._header_value.clear()
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._field_name = options.get(b"name", b"").decode("utf-8", "replace")
+        filename = options.get(b"filename")
+        if filename is None:
+            self._field_value = bytearray()
+            return
+        name = Path(filename.decode("utf-8", "replace").replace("\\", "/")).name
+        if not name or name.startswith("."):
+            raise ValueError(f"Invalid file name: {filename!r}")
+        if archives.is_archive(name):
+            self._archive = archives.open_extractor(name, self.store, self._on_archive_member)
+            return
+        self._file_path = self.target_dir / name
+        self._blob = self.store.writer()
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._archive is not None:
+            self._archive.write(data[start:end])
+        elif self._blob is not None:
+            self._blob.write(memoryview(data)[start:end])
+        elif self._field_value is not None:
+            self._field_value.extend(data[start:end])
+            if len(self._field_value) > MAX_FIELD_BYTES:
+                raise ValueError(f"Form field {self._field_name!r} is too large")
+
+    def _on_part_end(self) -> None:
+        if self._archive is not None:
+            self._archive.finish()
+            self._archive = None
+        elif self._blob is not None:
+            digest = self._blob.commit()
+            self._blob = None
+            self.store.link_into(digest, self._file_path)
+            self.files.append(self._file_path)
+            self.on_file(self._file_path, digest)
+        elif self._field_value is not None:
+            self.on_field(self._field_name, self._field_value.decode("utf-8", "replace"))
+
+    def _on_archive_member(self, name: str, digest: str) -> None:
+        path = self.target_dir / name
+        # Camera folders restart their numbering, so flattened names can repeat
+        counter = 1
+        while path.exists():
+            counter += 1
+            path = self.target_dir / f"{Path(name).stem}_{counter}{Path(name).suffix}"
+        self.store.link_into(digest, path)
+        self.files.append(path)
+        self.on_file(path, digest)
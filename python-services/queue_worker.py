@@ -0,0 +1,35 @@
+"""Run queued jobs without the HTTP API, so processing can scale out separately from uploads.
+
+Usage: python queue_worker.py
+
+Any number of these can run alongside the API replicas; they share the job
+queue in Postgres and the output volume. JOB_CONCURRENCY sets how many jobs
+each one runs at a time.
+"""
+
+from __future__ import annotations
+
+import logging
+import signal
+import threading
+
+import main
+
+
+def run() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+
+    main.start_processing(relay_events=False)
+    logging.getLogger(__name__).info(
+        "Queue worker %s running %d job(s) at a time", main.job_queue.worker_id, main.JOB_CONCURRENCY
+    )
+    stop.wait()
+    # Running jobs finish first; their heartbeats continue until they do
+    main.stop_processing()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,364 @@
+"""Radiometric temperature extraction for DJI and FLIR R-JPEG thermal images.
+
+DJI M30T/H20T frames carry the raw thermal raster in APP3 segments and the
+measurement parameters (emissivity, distance, humidity, reflected temperature)
+in APP4. FLIR-core payloads (Zenmuse XT/XT2) carry an FFF record file spread
+over APP1 segments with Planck constants. Both are decoded here without the
+vendor SDKs into NumPy arrays of degrees Celsius.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import math
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Fallback measurement parameters, matching the DJI pilot app defaults.
+DEFAULT_EMISSIVITY = 1.0
+DEFAULT_DISTANCE_M = 5.0
+DEFAULT_HUMIDITY = 70.0
+DEFAULT_REFLECTED_C = 23.0
+DEFAULT_ATMOSPHERIC_C = 20.0
+
+# DJI raw counts are treated as linear in apparent (blackbody) temperature.
+# These defaults are approximate; calibrate them per airframe against the DJI
+# Thermal Analysis Tool and override through the environment.
+DJI_RAW_SCALE = float(os.getenv("THERMAL_RAW_SCALE", 1 / 64))
+DJI_RAW_OFFSET_K = float(os.getenv("THERMAL_RAW_OFFSET_K", 0.0))
+
+# Hotspot thresholding defaults: a pixel is hot when it is DELTA_T_C above the
+# image median, and an image is anomalous with at least MIN_HOTSPOT_PIXELS.
+HOTSPOT_DELTA_T_C = float(os.getenv("HOTSPOT_DELTA_T_C", 10.0))
+MIN_HOTSPOT_PIXELS = int(os.getenv("MIN_HOTSPOT_PIXELS", 4))
+
+# Atmospheric transmission constants (FLIR defaults) used when the file has none.
+_ATMOSPHERE = {"alpha1": 0.006569, "alpha2": 0.01262, "beta1": -0.002276, "beta2": -0.00667, "x": 1.9}
+
+_DJI_RAW_SHAPES = [(512, 640), (1024, 1280), (256, 320), (480, 640)]
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+@dataclass(frozen=True)
+class MeasurementParams:
+    emissivity: float = DEFAULT_EMISSIVITY
+    distance_m: float = DEFAULT_DISTANCE_M
+    humidity: float = DEFAULT_HUMIDITY
+    reflected_c: float = DEFAULT_REFLECTED_C
+    atmospheric_c: float = DEFAULT_ATMOSPHERIC_C
+
+
+@dataclass
+class ThermalImage:
+    path: Path
+    source: str  # "dji" or "flir"
+    raw: np.ndarray
+    params: MeasurementParams
+    planck: Optional[Dict[str, float]] = None
+
+    def to_celsius(self) -> np.ndarray:
+        if self.planck is not None:
+            return flir_raw_to_celsius(self.raw, self.planck, self.params)
+        apparent_k = self.raw.astype(np.float32) * DJI_RAW_SCALE + DJI_RAW_OFFSET_K
+        return correct_apparent_temperature(apparent_k, self.params) - 273.15
+
+
+def read_jpeg_segments(path: Path) -> Tuple[Dict[int, List[bytes]], Optional[Tuple[int, int]]]:
+    """Collect APPn payloads and the frame size, stopping before the scan data."""
+    segments: Dict[int, List[bytes]] = {}
+    frame_size: Optional[Tuple[int, int]] = None
+    with open(path, "rb") as handle:
+        if handle.read(2) != b"\xff\xd8":
+            return segments, None
+        while True:
+            byte = handle.read(1)
+            if not byte:
+                break
+            if byte != b"\xff":
+                continue
+            marker = handle.read(1)
+            while marker == b"\xff":  # fill bytes
+                marker = handle.read(1)
+            if not marker:
+                break
+            code = marker[0]
+            if code == 0xDA or code == 0xD9:
+                break
+            if 0xD0 <= code <= 0xD7 or code == 0x01:
+                continue
+            length_bytes = handle.read(2)
+            if len(length_bytes) < 2:
+                break
+            length = struct.unpack(">H", length_bytes)[0] - 2
+            payload = handle.read(length)
+            if 0xE0 <= code <= 0xEF:
+                segments.setdefault(code - 0xE0, []).append(payload)
+            elif code in _SOF_MARKERS and len(payload) >= 5:
+                height, width = struct.unpack(">HH", payload[1:5])
+                frame_size = (height, width)
+    return segments, frame_size
+
+
+def _plausible(params: MeasurementParams) -> bool:
+    return (
+        0.1 <= params.emissivity <= 1.0
+        and 0.0 <= params.distance_m <= 500.0
+        and 0.0 <= params.humidity <= 100.0
+        and -60.0 <= params.reflected_c <= 600.0
+    )
+
+
+def parse_dji_params(app4: bytes) -> Optional[MeasurementParams]:
+    """Decode the DJI thermal parameter block (layouts as documented by ExifTool)."""
+    candidates = []
+    if len(app4) >= 0x4C:
+        # H20T: int16 fields at fixed offsets
+        humidity, distance, emissivity, reflected = struct.unpack_from("<HHHH", app4, 0x44)
+        candidates.append(MeasurementParams(
+            emissivity=emissivity / 100, distance_m=distance / 10,
+            humidity=float(humidity), reflected_c=reflected / 10,
+        ))
+    if len(app4) >= 0x14:
+        # M30T/M3T: float32 fields from the start of the block
+        ambient, distance, emissivity, humidity, reflected = struct.unpack_from("<5f", app4, 0)
+        candidates.append(MeasurementParams(
+            emissivity=emissivity, distance_m=distance, humidity=humidity,
+            reflected_c=reflected, atmospheric_c=ambient,
+        ))
+    for params in candidates:
+        if all(math.isfinite(v) for v in vars(params).values()) and _plausible(params):
+            return params
+    return None
+
+
+def _read_dji(path: Path, segments: Dict[int, List[bytes]], frame_size) -> Optional[ThermalImage]:
+    payload = b"".join(segments.get(3, []))
+    if not payload:
+        return None
+    pixels = len(payload) // 2
+    shapes = ([frame_size] if frame_size else []) + _DJI_RAW_SHAPES
+    shape = next((s for s in shapes if s[0] * s[1] == pixels), None)
+    if shape is None:
+        return None
+    raw = np.frombuffer(payload, dtype="<u2", count=pixels).reshape(shape)
+    params = None
+    for block in segments.get(4, []):
+        params = parse_dji_params(block)
+        if params:
+            break
+    return ThermalImage(path=path, source="dji", raw=raw, params=params or MeasurementParams())
+
+
+def _read_flir(path: Path, segments: Dict[int, List[bytes]]) -> Optional[ThermalImage]:
+    chunks = [seg for seg in segments.get(1, []) if seg.startswith(b"FLIR\x00")]
+    if not chunks:
+        return None
+    # Each APP1 chunk has an 8 byte header; the rest concatenates into an FFF file.
+    fff = b"".join(chunk[8:] for chunk in sorted(chunks, key=lambda c: c[6]))
+    if not fff.startswith(b"FFF\x00") or len(fff) < 64:
+        return None
+
+    index_offset, entries = struct.unpack_from(">II", fff, 24)
+    raw = camera = None
+    for i in range(entries):
+        entry = index_offset + i * 32
+        if entry + 32 > len(fff):
+            break
+        record_type, _, _, _, offset, length = struct.unpack_from(">HHIIII", fff, entry)
+        record = fff[offset:offset + length]
+        if record_type == 1:
+            raw = record
+        elif record_type == 32:
+            camera = record
+    if raw is None or camera is None or len(camera) < 784:
+        return None
+
+    # Records are little endian unless the first word says otherwise.
+    order = "<" if struct.unpack_from("<H", raw, 0)[0] == 2 else ">"
+    width, height = struct.unpack_from(order + "HH", raw, 2)
+    body = raw[32:]
+    if body[:4] == b"\x89PNG":
+        import cv2
+
+        decoded = cv2.imdecode(np.frombuffer(body, np.uint8), cv2.IMREAD_UNCHANGED)
+        if decoded is None:
+            return None
+        # FLIR stores PNG raw data byte-swapped
+        raster = decoded.byteswap()
+    else:
+        raster = np.frombuffer(body, dtype=order + "u2", count=width * height).reshape(height, width)
+
+    c_order = "<" if struct.unpack_from("<H", camera, 0)[0] == 2 else ">"
+
+    def f32(offset: int) -> float:
+        return struct.unpack_from(c_order + "f", camera, offset)[0]
+
+    params = MeasurementParams(
+        emissivity=f32(32),
+        distance_m=f32(36),
+        reflected_c=f32(40) - 273.15,
+        atmospheric_c=f32(44) - 273.15,
+        humidity=f32(60) * (100 if f32(60) <= 1 else 1),
+    )
+    planck = {
+        "R1": f32(88), "B": f32(92), "F": f32(96),
+        "O": struct.unpack_from(c_order + "i", camera, 776)[0],
+        "R2": f32(780),
+        "alpha1": f32(112), "alpha2": f32(116), "beta1": f32(120), "beta2": f32(124), "x": f32(128),
+        "window_c": f32(48) - 273.15, "window_transmission": f32(52),
+    }
+    if not _plausible(params):
+        params = MeasurementParams()
+    return ThermalImage(path=path, source="flir", raw=raster, params=params, planck=planck)
+
+
+def read_thermal_image(path: Path, overrides: Optional[Dict[str, float]] = None) -> Optional[ThermalImage]:
+    """Return the raw thermal raster of an R-JPEG, or None for ordinary images."""
+    path = Path(path)
+    if path.suffix.lower() not in {".jpg", ".jpeg"}:
+        return None
+    segments, frame_size = read_jpeg_segments(path)
+    image = _read_dji(path, segments, frame_size) or _read_flir(path, segments)
+    if image is not None and overrides:
+        image.params = replace(image.params, **overrides)
+    return image
+
+
+def atmospheric_transmission(params: MeasurementParams, constants: Optional[Dict[str, float]] = None) -> float:
+    c = constants or _ATMOSPHERE
+    t = params.atmospheric_c
+    h2o = (params.humidity / 100) * math.exp(1.5587 + 0.06939 * t - 0.00027816 * t ** 2 + 0.00000068455 * t ** 3)
+    root = -math.sqrt(params.distance_m / 2)
+    return (
+        c["x"] * math.exp(root * (c["alpha1"] + c["beta1"] * math.sqrt(h2o)))
+        + (1 - c["x"]) * math.exp(root * (c["alpha2"] + c["beta2"] * math.sqrt(h2o)))
+    )
+
+
+def correct_apparent_temperature(apparent_k: np.ndarray, params: MeasurementParams) -> np.ndarray:
+    """Remove reflected and atmospheric radiation from a blackbody temperature (Kelvin).
+
+    Uses the broadband Stefan-Boltzmann approximation W ~ T^4.
+    """
+    tau = atmospheric_transmission(params)
+    emissivity = params.emissivity
+    reflected = (params.reflected_c + 273.15) ** 4
+    atmosphere = (params.atmospheric_c + 273.15) ** 4
+    signal = apparent_k.astype(np.float64) ** 4
+    obj = (signal - (1 - emissivity) * tau * reflected - (1 - tau) * atmosphere) / (emissivity * tau)
+    return np.power(np.clip(obj, 0, None), 0.25).astype(np.float32)
+
+
+def flir_raw_to_celsius(raw: np.ndarray, planck: Dict[str, float], params: MeasurementParams) -> np.ndarray:
+    """Standard FLIR raw-to-temperature conversion with Planck constants."""
+    r1, r2, b, f, o = planck["R1"], planck["R2"], planck["B"], planck["F"], planck["O"]
+    emissivity = params.emissivity
+    window_t = planck.get("window_transmission") or 1.0
+    tau = atmospheric_transmission(params, planck)
+
+    def planck_raw(temp_c: float) -> float:
+        return r1 / (r2 * (math.exp(b / (temp_c + 273.15)) - f)) - o
+
+    raw_refl = (1 - emissivity) / emissivity * planck_raw(params.reflected_c)
+    raw_atm1 = (1 - tau) / emissivity / tau * planck_raw(params.atmospheric_c)
+    raw_window = (1 - window_t) / emissivity / tau / window_t * planck_raw(planck.get("window_c", params.atmospheric_c))
+    raw_atm2 = (1 - tau) / emissivity / tau / window_t / tau * planck_raw(params.atmospheric_c)
+
+    raw_obj = raw.astype(np.float64) / emissivity / tau / window_t / tau - raw_atm1 - raw_atm2 - raw_window - raw_refl
+    with np.errstate(invalid="ignore", divide="ignore"):
+        temps = b / np.log(r1 / (r2 * (raw_obj + o)) + f) - 273.15
+    return temps.astype(np.float32)
+
+
+def hotspot_stats(
+    temperatures: np.ndarray,
+    delta_t: float = HOTSPOT_DELTA_T_C,
+    threshold_c: Optional[float] = None,
+    min_pixels: int = MIN_HOTSPOT_PIXELS,
+) -> List[Dict[str, object]]:
+    """Vectorised hotspot thresholding over a (N, H, W) stack of temperatures.
+
+    A pixel is hot if it is `delta_t` above its image median, or above
+    `threshold_c` when given.
+    """
+    stack = np.asarray(temperatures, dtype=np.float32)
+    if stack.ndim == 2:
+        stack = stack[np.newaxis]
+    max_t = np.nanmax(stack, axis=(1, 2))
+    mean_t = np.nanmean(stack, axis=(1, 2))
+    median_t = np.nanmedian(stack.reshape(len(stack), -1), axis=1)
+    cutoff = median_t + delta_t
+    if threshold_c is not None:
+        cutoff = np.minimum(cutoff, threshold_c)
+    mask = stack > cutoff[:, None, None]
+    counts = mask.sum(axis=(1, 2))
+    rows = mask.any(axis=2)
+    cols = mask.any(axis=1)
+
+    results = []
+    for i in range(len(stack)):
+        bbox = None
+        if counts[i]:
+            y0 = int(rows[i].argmax())
+            y1 = int(len(rows[i]) - rows[i][::-1].argmax())
+            x0 = int(cols[i].argmax())
+            x1 = int(len(cols[i]) - cols[i][::-1].argmax())
+            bbox = [x0, y0, x1 - x0, y1 - y0]
+        results.append({
+            "max_temp_c": round(float(max_t[i]), 2),
+            "mean_temp_c": round(float(mean_t[i]), 2),
+            "delta_t_c": round(float(max_t[i] - median_t[i]), 2),
+            "hotspot_pixels": int(counts[i]),
+            "hotspot_bbox": bbox,
+            "anomaly_detected": bool(counts[i] >= min_pixels),
+        })
+    return results
+
+
+def analyze_images(
+    paths: Iterable[Path],
+    batch_size: int = 32,
+    workers: int = 4,
+    overrides: Optional[Dict[str, float]] = None,
+    **thresholds,
+) -> Dict[Path, Dict[str, object]]:
+    """Hotspot statistics for every radiometric image in `paths`.
+
+    Files are parsed in a thread pool and thresholded in stacks of equal-sized
+    rasters. Non-radiometric files are left out of the result.
+    """
+    paths = [Path(p) for p in paths if Path(p).suffix.lower() in {".jpg", ".jpeg"}]
+    results: Dict[Path, Dict[str, object]] = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(paths), batch_size):
+            batch = paths[start:start + batch_size]
+            images = list(pool.map(lambda p: _safe_read(p, overrides), batch))
+            by_shape: Dict[Tuple[int, int], List[Tuple[Path, np.ndarray]]] = {}
+            for path, image in zip(batch, images):
+                if image is not None:
+                    temps = image.to_celsius()
+                    by_shape.setdefault(temps.shape, []).append((path, temps))
+            for group in by_shape.values():
+                stats = hotspot_stats(np.stack([t for _, t in group]), **thresholds)
+                for (path, _), item in zip(group, stats):
+                    results[path] = item
+    return results
+
+
+def settings_fingerprint() -> str:
+    """Short hash of the settings that change analysis results, for cache keys."""
+    settings = [DJI_RAW_SCALE, DJI_RAW_OFFSET_K, HOTSPOT_DELTA_T_C, MIN_HOTSPOT_PIXELS]
+    return hashlib.sha1(repr(settings).encode()).hexdigest()[:12]
+
+
+def _safe_read(path: Path, overrides: Optional[Dict[str, float]]) -> Optional[ThermalImage]:
+    try:
+        return read_thermal_image(path, overrides)
+    except (OSError, ValueError, struct.error):
+        return None
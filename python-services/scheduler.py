@@ -0,0 +1,92 @@
+"""Which queued work item runs next: priority classes, then fair shares per customer and pilot."""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+import Drone_Data_Process
+
+# Highest first. Rush always runs before standard; backfill only when nothing else is waiting.
+PRIORITIES = ("rush", "standard", "backfill")
+DEFAULT_PRIORITY = "standard"
+
+# Work items of a job, in order; each is claimed separately so other jobs can run in between.
+# A large job's process stage is claimed again for every batch of files (main.PROCESS_BATCH_FILES).
+STAGES = ("process", "report")
+
+
+def parse_priority(value: Optional[str]) -> str:
+    if not value:
+        return DEFAULT_PRIORITY
+    priority = value.strip().lower()
+    if priority not in PRIORITIES:
+        raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+    return priority
+
+
+class CostModel:
+    """Estimated processing seconds for a job, from its image count and bytes.
+
+    The defaults reflect a worker analysing frames on a few cores; only the
+    relative sizes matter to the scheduler, which compares them.
+    """
+
+    def __init__(
+        self, base_seconds: float = 5.0, seconds_per_image: float = 0.15, seconds_per_mb: float = 0.02
+    ) -> None:
+        self.base_seconds = base_seconds
+        self.seconds_per_image = seconds_per_image
+        self.seconds_per_mb = seconds_per_mb
+
+    def estimate(self, images: int, total_bytes: int) -> float:
+        return self.base_seconds + images * self.seconds_per_image + total_bytes / (1024 * 1024) * self.seconds_per_mb
+
+    def estimate_files(self, paths: Iterable[Path]) -> float:
+        images = total_bytes = 0
+        for path in paths:
+            try:
+                total_bytes += path.stat().st_size
+            except OSError:
+                continue
+            if path.suffix.lower() in Drone_Data_Process.IMAGE_EXTENSIONS:
+                images += 1
+        return self.estimate(images, total_bytes)
+
+
+class FairShareScheduler:
+    """Orders claimable jobs for `PgJobQueue.claim`.
+
+    Within a priority class the next item goes to the customer, then the
+    pilot within it, with the least estimated cost running or started in the
+    last `window` seconds; ties go to the longest waiting. A job without a
+    customer is its pilot's own customer. Because usage is read from the
+    `jobs` table, the shares hold across every replica and worker.
+    """
+
+    def __init__(self, window: float = 900.0) -> None:
+        self.window = window
+
+    def candidates(self, running_statuses: Iterable[str], visibility_timeout: float) -> Tuple[str, Tuple]:
+        """SQL selecting and locking the next job's `id`, and its parameters."""
+        running = list(running_statuses)
+        rank = " ".join(f"WHEN '{name}' THEN {index}" for index, name in enumerate(PRIORITIES))
+        sql = (
+            "WITH recent AS ("
+            "   SELECT coalesce(nullif(customer_id, ''), 'pilot:' || coalesce(pilot_id, '')) AS customer,"
+            "          coalesce(pilot_id, '') AS pilot, estimated_cost"
+            "   FROM jobs"
+            "   WHERE status = ANY(%s) OR started_at > now() - make_interval(secs => %s)"
+            " ), by_customer AS (SELECT customer, sum(estimated_cost) AS used FROM recent GROUP BY customer),"
+            " by_pilot AS (SELECT customer, pilot, sum(estimated_cost) AS used FROM recent GROUP BY customer, pilot)"
+            " SELECT j.id FROM jobs j"
+            " LEFT JOIN by_customer c"
+            "   ON c.customer = coalesce(nullif(j.customer_id, ''), 'pilot:' || coalesce(j.pilot_id, ''))"
+            " LEFT JOIN by_pilot p ON p.customer = c.customer AND p.pilot = coalesce(j.pilot_id, '')"
+            " WHERE (j.status = 'queued' AND j.available_at <= now())"
+            "    OR (j.status = ANY(%s) AND j.heartbeat_at < now() - make_interval(secs => %s))"
+            f" ORDER BY CASE j.priority {rank} ELSE {len(PRIORITIES)} END,"
+            "   coalesce(c.used, 0), coalesce(p.used, 0), j.available_at, j.id"
+            " FOR UPDATE OF j SKIP LOCKED LIMIT 1"
+        )
+        return sql, (running, self.window, running, visibility_timeout)
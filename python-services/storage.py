@@ -0,0 +1,227 @@
+"""Where finished job artifacts live: the local output volume or an S3-compatible bucket."""
+
+from __future__ import annotations
+
+import mimetypes
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import upload_receiver
+
+try:  # Only the S3 backend needs boto3
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
+except ImportError:  # pragma: no cover - depends on the image
+    boto3 = None
+
+# Error codes S3 and compatible servers use for a missing object
+_MISSING = ("404", "NoSuchKey", "NotFound")
+
+
+class Storage:
+    """Artifacts addressed by `/`-separated keys such as `job_123/Final_Report.pdf`."""
+
+    # False when artifacts are already on the local output volume, where /outputs serves them
+    remote = False
+
+    def put_file(self, path: Path, key: str) -> None:
+        raise NotImplementedError
+
+    def get_file(self, key: str, path: Path) -> bool:
+        """Download `key` to `path`, replacing it atomically; False when there is no such object."""
+        raise NotImplementedError
+
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        raise NotImplementedError
+
+    def size(self, key: str) -> Optional[int]:
+        """Object size in bytes, or None when it does not exist."""
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix: str) -> int:
+        """Delete every object under `prefix` and return how many there were."""
+        raise NotImplementedError
+
+    def presign_put(self, key: str, size: int, expires_in: int) -> str:
+        """A URL through which a client can PUT `key` itself for the next `expires_in` seconds."""
+        raise NotImplementedError
+
+
+class LocalStorage(Storage):
+    """Keys are paths under `root`; with `root` set to the output volume, storing is a no-op.
+
+    Signed uploads go to an `upload_receiver` writing to `root`, reachable
+    at `upload_url` and sharing `signing_secret`.
+    """
+
+    def __init__(self, root: Path, upload_url: Optional[str] = None, signing_secret: Optional[str] = None) -> None:
+        self.root = root
+        self.upload_url = upload_url
+        self.signing_secret = signing_secret
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if not path.is_relative_to(self.root.resolve()):
+            raise ValueError(f"Key escapes the storage root: {key!r}")
+        return path
+
+    def put_file(self, path: Path, key: str) -> None:
+        target = self._path(key)
+        if target == path.resolve():
+            return
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=target.parent, prefix=".tmp-")
+        os.close(fd)
+        shutil.copyfile(path, tmp_name)
+        os.replace(tmp_name, target)
+
+    def get_file(self, key: str, path: Path) -> bool:
+        source = self._path(key)
+        if not source.is_file():
+            return False
+        if source != path.resolve():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f".tmp-{uuid.uuid4().hex}")
+            try:
+                # Same volume: share the inode instead of copying the bytes
+                os.link(source, tmp)
+            except OSError:
+                shutil.copyfile(source, tmp)
+            os.replace(tmp, path)
+        return True
+
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        with self._path(key).open("rb") as handle:
+            handle.seek(start)
+            return handle.read(length)
+
+    def size(self, key: str) -> Optional[int]:
+        try:
+            return self._path(key).stat().st_size
+        except FileNotFoundError:
+            return None
+
+    def delete_prefix(self, prefix: str) -> int:
+        base = self._path(prefix)
+        if base.is_file():
+            base.unlink()
+            return 1
+        if not base.is_dir():
+            return 0
+        count = sum(len(files) for _, _, files in os.walk(base))
+        shutil.rmtree(base, ignore_errors=True)
+        return count
+
+    def presign_put(self, key: str, size: int, expires_in: int) -> str:
+        if not (self.upload_url and self.signing_secret):
+            raise NotImplementedError("Signed uploads need DIRECT_UPLOAD_URL and UPLOAD_SIGNING_SECRET")
+        self._path(key)
+        return upload_receiver.sign_url(self.upload_url, self.signing_secret, key, size, int(time.time()) + expires_in)
+
+
+class S3Storage(Storage):
+    """Objects in an S3-compatible bucket under `prefix`.
+
+    Files larger than `chunk_size` are uploaded and downloaded in parts of
+    that size, `max_concurrency` at a time. `endpoint_url` points the client
+    at MinIO or the `local_s3` stand-in instead of AWS; those are addressed
+    path-style.
+    """
+
+    remote = True
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: Optional[str] = None,
+        chunk_size: int = 8 * 1024 * 1024,
+        max_concurrency: int = 8,
+        client=None,
+    ) -> None:
+        if boto3 is None:
+            raise RuntimeError("S3 storage needs boto3; install it or unset S3_BUCKET")
+        self.bucket = bucket
+        self.prefix = prefix
+        if client is None:
+            config = Config(
+                max_pool_connections=max(10, max_concurrency * 2),
+                retries={"max_attempts": 5, "mode": "adaptive"},
+                s3={"addressing_style": "path"} if endpoint_url else None,
+            )
+            client = boto3.client("s3", endpoint_url=endpoint_url, config=config)
+        self.client = client
+        self.transfer_config = TransferConfig(
+            multipart_threshold=chunk_size,
+            multipart_chunksize=chunk_size,
+            max_concurrency=max_concurrency,
+            use_threads=True,
+        )
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    def put_file(self, path: Path, key: str) -> None:
+        extra = {}
+        content_type, _ = mimetypes.guess_type(path.name)
+        if content_type:
+            extra["ContentType"] = content_type
+        self.client.upload_file(
+            str(path), self.bucket, self._key(key), ExtraArgs=extra or None, Config=self.transfer_config
+        )
+
+    def get_file(self, key: str, path: Path) -> bool:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, self._key(key), tmp_name, Config=self.transfer_config)
+        except ClientError as exc:
+            os.unlink(tmp_name)
+            if exc.response.get("Error", {}).get("Code") in _MISSING:
+                return False
+            raise
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+        os.replace(tmp_name, path)
+        return True
+
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        if length <= 0:
+            return b""
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=self._key(key), Range=f"bytes={start}-{start + length - 1}"
+        )
+        return response["Body"].read()
+
+    def size(self, key: str) -> Optional[int]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key))["ContentLength"]
+        except ClientError as exc:
+            if exc.response.get("Error", {}).get("Code") in _MISSING:
+                return None
+            raise
+
+    def delete_prefix(self, prefix: str) -> int:
+        deleted = 0
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+            objects = [{"Key": item["Key"]} for item in page.get("Contents", [])]
+            if objects:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True})
+                deleted += len(objects)
+        return deleted
+
+    def presign_put(self, key: str, size: int, expires_in: int) -> str:
+        return self.client.generate_presigned_url(
+            "put_object", Params={"Bucket": self.bucket, "Key": self._key(key)}, ExpiresIn=expires_in
+        )
+
@@ -0,0 +1,125 @@
+"""S3Storage against the local_s3 stand-in, run with `python -m pytest test_storage.py`."""
+
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+
+import pytest
+
+import local_s3
+from storage import LocalStorage, S3Storage
+
+requests = pytest.importorskip("requests")
+pytest.importorskip("boto3")
+
+# boto3 refuses parts under 5 MiB, so the smallest multipart transfer uses these
+PART_SIZE = 5 * 1024 * 1024
+
+
+@pytest.fixture(scope="module")
+def endpoint(tmp_path_factory):
+    server = local_s3.serve(tmp_path_factory.mktemp("s3"), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def store(endpoint, request, monkeypatch):
+    # The stand-in does not check signatures, but botocore still signs
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    return S3Storage(
+        "artifacts", prefix=f"{request.node.name}/", endpoint_url=endpoint, chunk_size=PART_SIZE, max_concurrency=4
+    )
+
+
+def _write(path: Path, data: bytes) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return path
+
+
+def test_put_and_get_round_trip(store, tmp_path):
+    source = _write(tmp_path / "job_1" / "Final_Report.pdf", b"%PDF-1.4 report")
+    store.put_file(source, "job_1/Final_Report.pdf")
+
+    assert store.size("job_1/Final_Report.pdf") == len(b"%PDF-1.4 report")
+    head = store.client.head_object(Bucket="artifacts", Key=store._key("job_1/Final_Report.pdf"))
+    assert head["ContentType"] == "application/pdf"
+
+    target = tmp_path / "copy" / "Final_Report.pdf"
+    assert store.get_file("job_1/Final_Report.pdf", target)
+    assert target.read_bytes() == b"%PDF-1.4 report"
+    assert store.read_range("job_1/Final_Report.pdf", 5, 3) == b"1.4"
+
+
+def test_multipart_upload_and_download(store, tmp_path):
+    data = os.urandom(2 * PART_SIZE + 12345)
+    source = _write(tmp_path / "Report_Input.parquet", data)
+    store.put_file(source, "job_2/Report_Input.parquet")
+
+    head = store.client.head_object(Bucket="artifacts", Key=store._key("job_2/Report_Input.parquet"))
+    assert head["ETag"].strip('"').endswith("-3")
+    assert head["ContentLength"] == len(data)
+
+    target = tmp_path / "download" / "Report_Input.parquet"
+    assert store.get_file("job_2/Report_Input.parquet", target)
+    assert target.read_bytes() == data
+    # A range spanning the boundary between the first two parts
+    assert store.read_range("job_2/Report_Input.parquet", PART_SIZE - 10, 20) == data[PART_SIZE - 10:PART_SIZE + 10]
+
+
+def test_missing_keys(store, tmp_path):
+    target = tmp_path / "missing.pdf"
+    assert store.get_file("job_3/missing.pdf", target) is False
+    assert not target.exists()
+    assert list(tmp_path.iterdir()) == []
+    assert store.size("job_3/missing.pdf") is None
+    assert store.delete_prefix("job_3/") == 0
+    # A bucket nothing has been written to yet behaves the same
+    empty = S3Storage("never-written", endpoint_url=store.client.meta.endpoint_url)
+    assert empty.get_file("anything", target) is False
+    assert empty.delete_prefix("") == 0
+
+
+def test_delete_prefix(store, tmp_path):
+    source = _write(tmp_path / "file.json", b"{}")
+    for key in ("job_4/a.json", "job_4/nested/b.json", "job_40/c.json"):
+        store.put_file(source, key)
+
+    assert store.delete_prefix("job_4/") == 2
+    assert store.size("job_4/a.json") is None
+    assert store.size("job_40/c.json") == 2
+
+
+def test_remote_read_through(store, tmp_path):
+    assert store.remote and not LocalStorage(tmp_path).remote
+
+    # Published from one replica's output volume...
+    published = tmp_path / "replica_a" / "job_5"
+    _write(published / "flight_path.geojson", b'{"type": "FeatureCollection"}')
+    _write(published / "flight_path.geojson.gz", b"gzipped")
+    for path in published.iterdir():
+        store.put_file(path, f"job_5/{path.name}")
+
+    # ...and read through into another's, replacing a stale copy atomically
+    local = tmp_path / "replica_b" / "job_5"
+    _write(local / "flight_path.geojson", b"stale")
+    for name in ("flight_path.geojson", "flight_path.geojson.gz"):
+        assert store.get_file(f"job_5/{name}", local / name)
+    assert (local / "flight_path.geojson").read_bytes() == b'{"type": "FeatureCollection"}'
+    assert (local / "flight_path.geojson.gz").read_bytes() == b"gzipped"
+    assert sorted(p.name for p in local.iterdir()) == ["flight_path.geojson", "flight_path.geojson.gz"]
+
+
+def test_presigned_put(store):
+    url = store.presign_put("incoming/DJI_0001.JPG", 4, 60)
+    response = requests.put(url, data=b"jpeg")
+    assert response.status_code == 200
+    assert store.size("incoming/DJI_0001.JPG") == 4
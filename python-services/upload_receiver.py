@@ -0,0 +1,130 @@
+"""Takes signed direct uploads onto the output volume, so upload bytes bypass the API process.
+
+Usage: UPLOAD_SIGNING_SECRET=... python upload_receiver.py [--root /app/outputs/.incoming] [--port 8010]
+
+The API hands out URLs of the form `PUT /<key>?size=&expires=&signature=`
+when there is no S3 bucket; this server checks the HMAC and the declared
+size and writes the body to `<root>/<key>`. It shares nothing with the API
+but the secret and the volume, so as many can run as ingest needs.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import hmac
+import os
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, quote, unquote, urlencode, urlsplit
+
+CHUNK = 1024 * 1024
+
+
+def _signature(secret: str, key: str, size: int, expires: int) -> str:
+    message = f"PUT\n{key}\n{size}\n{expires}".encode()
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def sign_url(base_url: str, secret: str, key: str, size: int, expires: int) -> str:
+    """URL through which `size` bytes may be PUT at `key` until the `expires` Unix time."""
+    query = urlencode({"size": size, "expires": expires, "signature": _signature(secret, key, size, expires)})
+    return f"{base_url.rstrip('/')}/{quote(key)}?{query}"
+
+
+def verify(secret: str, key: str, size: int, expires: int, signature: str) -> bool:
+    return expires >= time.time() and hmac.compare_digest(_signature(secret, key, size, expires), signature)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    root: Path
+    secret: str
+
+    def log_message(self, format: str, *args) -> None:  # noqa: A002 - signature from the base class
+        pass
+
+    def _send(self, status: int, message: str = "") -> None:
+        body = message.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_OPTIONS(self) -> None:
+        # Browsers preflight cross-origin PUTs
+        self.send_response(204)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "PUT")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        self.send_header("Access-Control-Max-Age", "600")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_PUT(self) -> None:
+        url = urlsplit(self.path)
+        key = unquote(url.path).lstrip("/")
+        query = parse_qs(url.query)
+        try:
+            size = int(query["size"][0])
+            expires = int(query["expires"][0])
+            signature = query["signature"][0]
+        except (KeyError, ValueError):
+            self.close_connection = True
+            return self._send(400, "Missing size, expires or signature")
+        if not verify(self.secret, key, size, expires, signature):
+            self.close_connection = True
+            return self._send(403, "Invalid or expired signature")
+        if self.headers.get("Content-Length") != str(size):
+            self.close_connection = True
+            return self._send(400, f"Body must be exactly {size} bytes")
+        target = (self.root / key).resolve()
+        if not target.is_relative_to(self.root.resolve()):
+            self.close_connection = True
+            return self._send(400, "Invalid key")
+
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=target.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                remaining = size
+                while remaining:
+                    data = self.rfile.read(min(remaining, CHUNK))
+                    if not data:
+                        raise ConnectionError("Body ended early")
+                    handle.write(data)
+                    remaining -= len(data)
+            os.replace(tmp_name, target)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+        self._send(200)
+
+
+def serve(root: Path, secret: str, host: str = "127.0.0.1", port: int = 8010) -> ThreadingHTTPServer:
+    """Create the server; call `serve_forever()` on it, possibly from a thread."""
+    root.mkdir(parents=True, exist_ok=True)
+    handler = type("UploadReceiverHandler", (Handler,), {"root": root, "secret": secret})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--root", type=Path, default=Path(os.getenv("OUTPUT_ROOT", "/app/outputs")) / ".incoming")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8010)
+    args = parser.parse_args()
+    secret = os.getenv("UPLOAD_SIGNING_SECRET")
+    if not secret:
+        raise SystemExit("UPLOAD_SIGNING_SECRET must be set")
+    server = serve(args.root, secret, args.host, args.port)
+    print(f"Upload receiver writing to {args.root.resolve()} on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+"""Resumable chunked uploads that write byte ranges straight into the job folder."""
+
+from __future__ import annotations
+
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from blob_store import BlobStore
+
+# Suggested chunk size for clients; any size is accepted.
+CHUNK_SIZE = 8 * 1024 * 1024
+
+_CONTENT_RANGE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+class UploadError(Exception):
+    def __init__(self, status_code: int, detail: str) -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def parse_content_range(value: str) -> Tuple[int, int, int]:
+    """Parse `bytes start-end/total` into (start, end exclusive, total)."""
+    match = _CONTENT_RANGE.match(value.strip())
+    if not match:
+        raise UploadError(400, "Content-Range must look like 'bytes start-end/total'")
+    start, last, total = (int(group) for group in match.groups())
+    if last < start or last >= total:
+        raise UploadError(416, f"Invalid range {start}-{last} for a {total} byte file")
+    return start, last + 1, total
+
+
+def _merge_range(ranges: List[List[int]], start: int, end: int) -> List[List[int]]:
+    merged: List[List[int]] = []
+    for lo, hi in sorted(ranges + [[start, end]]):
+        if merged and lo <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], hi)
+        else:
+            merged.append([lo, hi])
+    return merged
+
+
+def _missing_ranges(ranges: List[List[int]], size: int) -> List[List[int]]:
+    missing: List[List[int]] = []
+    position = 0
+    for lo, hi in ranges:
+        if lo > position:
+            missing.append([position, lo])
+        position = max(position, hi)
+    if position < size:
+        missing.append([position, size])
+    return missing
+
+
+def _safe_filename(name: str) -> str:
+    if not name or name != Path(name).name or name.startswith("."):
+        raise UploadError(400, f"Invalid file name: {name!r}")
+    return name
+
+
+class RangeWriter:
+    """Writes one Content-Range body at its offset, hashing it on the way."""
+
+    def __init__(self, path: Path, start: int, end: int) -> None:
+        self.start = start
+        self.end = end
+        self.offset = start
+        self.sha256 = hashlib.sha256()
+        self._fd = os.open(path, os.O_WRONLY)
+
+    def write(self, data: bytes) -> None:
+        if self.offset + len(data) > self.end:
+            raise UploadError(400, "Request body is longer than its Content-Range")
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self._fd, view, self.offset)
+            self.offset += written
+            view = view[written:]
+        self.sha256.update(data)
+
+    @property
+    def complete(self) -> bool:
+        return self.offset == self.end
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class UploadStore:
+    """Upload sessions, persisted as JSON beside the job folders so they survive restarts.
+
+    Files are preallocated at their final path in the job folder when the
+    session is created; each PUT fills in a byte range and the session records
+    which ranges have arrived intact. Each file is hashed as it completes,
+    checked against its declared checksum, moved into the blob store (when
+    one is given) and reported to `on_file_complete`.
+
+    Direct sessions skip the ranges: clients write each file to storage
+    through a signed URL, the caller confirms its size with `record_file`
+    before committing, and the job later places it in the job folder and
+    hashes it with `adopt_file`.
+
+    Every read-modify-write of a session holds an flock on a lock file next
+    to it, so replicas sharing the output volume can take chunks of the same
+    upload without losing each other's updates. Which replicas are running
+    the per-file stages on an upload's files is kept in the session too
+    (`add_stream`/`drop_stream`), for whichever replica receives the commit.
+    """
+
+    def __init__(
+        self,
+        output_dir: Path,
+        ttl_seconds: float = 7 * 24 * 3600,
+        blobs: Optional[BlobStore] = None,
+        on_file_complete: Optional[Callable[[Dict[str, object], Path, str], None]] = None,
+    ) -> None:
+        self.output_dir = output_dir
+        self.blobs = blobs
+        self.on_file_complete = on_file_complete
+        self.state_dir = output_dir / ".uploads"
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+
+    def _state_path(self, upload_id: str) -> Path:
+        if not re.fullmatch(r"[0-9a-f]{32}", upload_id):
+            raise UploadError(404, "Upload not found")
+        return self.state_dir / f"{upload_id}.json"
+
+    @contextmanager
+    def _locked(self, upload_id: str) -> Iterator[None]:
+        # flock excludes other open files too, so threads of one process are covered as well
+        fd = os.open(self._state_path(upload_id).with_suffix(".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def _load(self, upload_id: str) -> Dict[str, object]:
+        try:
+            return json.loads(self._state_path(upload_id).read_text())
+        except FileNotFoundError:
+            raise UploadError(404, "Upload not found") from None
+
+    def _save(self, session: Dict[str, object]) -> None:
+        path = self._state_path(session["upload_id"])
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(session))
+        os.replace(tmp, path)
+
+    def job_dir(self, session: Dict[str, object]) -> Path:
+        return self.output_dir / session["job_id"]
+
+    def create(
+        self,
+        job_id: str,
+        pilot_id: str,
+        location: str,
+        files: List[Dict[str, object]],
+        customer_id: Optional[str] = None,
+        priority: Optional[str] = None,
+        direct: bool = False,
+    ) -> Dict[str, object]:
+        if not files:
+            raise UploadError(400, "At least one file must be declared")
+        self.purge_expired()
+
+        entries: Dict[str, Dict[str, object]] = {}
+        for declared in files:
+            name = _safe_filename(str(declared.get("name", "")))
+            size = int(declared.get("size", -1))
+            if size < 0:
+                raise UploadError(400, f"Missing size for {name}")
+            if name in entries:
+                raise UploadError(400, f"Duplicate file name: {name}")
+            sha256 = declared.get("sha256")
+            entries[name] = {"size": size, "sha256": sha256.lower() if sha256 else None, "received": []}
+
+        session = {
+            "upload_id": uuid.uuid4().hex,
+            "job_id": job_id,
+            "pilot_id": pilot_id,
+            "location": location,
+            "customer_id": customer_id,
+            "priority": priority,
+            "created_at": time.time(),
+            "state": "open",
+            "direct": direct,
+            "files": entries,
+        }
+        job_dir = self.job_dir(session)
+        job_dir.mkdir(parents=True, exist_ok=True)
+        for name, entry in ({} if direct else entries).items():
+            fd = os.open(job_dir / name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                if entry["size"]:
+                    try:
+                        # Reserve the space up front so a full disk fails here, not mid-upload
+                        os.posix_fallocate(fd, 0, entry["size"])
+                    except OSError as exc:
+                        if exc.errno == errno.ENOSPC:
+                            raise UploadError(507, "Not enough disk space for this upload") from exc
+                        os.ftruncate(fd, entry["size"])
+            finally:
+                os.close(fd)
+
+        with self._locked(session["upload_id"]):
+            self._save(session)
+        return session
+
+    def open_range(self, upload_id: str, filename: str, start: int, end: int, total: int) -> RangeWriter:
+        session = self._load(upload_id)
+        if session["state"] != "open":
+            raise UploadError(409, "Upload has already been committed")
+        if session.get("direct"):
+            raise UploadError(409, "This upload takes its files through signed URLs")
+        entry = session["files"].get(filename)
+        if entry is None:
+            raise UploadError(404, f"File not declared in this upload: {filename}")
+        if total != entry["size"]:
+            raise UploadError(416, f"{filename} was declared as {entry['size']} bytes, not {total}")
+        if entry["size"] and not _missing_ranges(entry["received"], entry["size"]):
+            raise UploadError(409, f"{filename} is already complete")
+        return RangeWriter(self.job_dir(session) / filename, start, end)
+
+    def record_range(
+        self, upload_id: str, filename: str, writer: RangeWriter, chunk_sha256: Optional[str] = None
+    ) -> Dict[str, object]:
+        if not writer.complete:
+            raise UploadError(400, "Request body is shorter than its Content-Range")
+        if chunk_sha256 and writer.sha256.hexdigest() != chunk_sha256.lower():
+            raise UploadError(422, "Chunk checksum mismatch; resend this range")
+        with self._locked(upload_id):
+            session = self._load(upload_id)
+            entry = session["files"][filename]
+            was_complete = not _missing_ranges(entry["received"], entry["size"])
+            entry["received"] = _merge_range(entry["received"], writer.start, writer.end)
+            completed_now = not was_complete and not _missing_ranges(entry["received"], entry["size"])
+            self._save(session)
+
+        if completed_now:
+            # Ranges may arrive in any order, so the file is hashed once it is whole
+            self._file_completed(session, filename, entry)
+        return self._file_status(filename, entry)
+
+    def record_file(self, upload_id: str, filename: str, size: int) -> Dict[str, object]:
+        """Register a direct session's file as stored whole, `size` bytes as reported by storage."""
+        with self._locked(upload_id):
+            session = self._load(upload_id)
+            if session["state"] != "open":
+                raise UploadError(409, "Upload has already been committed")
+            entry = session["files"].get(filename)
+            if entry is None:
+                raise UploadError(404, f"File not declared in this upload: {filename}")
+            if size != entry["size"]:
+                raise UploadError(422, f"{filename} was declared as {entry['size']} bytes but {size} arrived")
+            if _missing_ranges(entry["received"], entry["size"]):
+                entry["received"] = [[0, size]] if size else []
+                self._save(session)
+        return self._file_status(filename, entry)
+
+    def adopt_file(self, upload_id: str, filename: str) -> str:
+        """Hash a direct session's file once it is in the job folder, check it and move it into the blob store."""
+        session = self._load(upload_id)
+        entry = session["files"][filename]
+        path = self.job_dir(session) / filename
+        digest = _file_sha256(path)
+        if entry["sha256"] and digest != entry["sha256"]:
+            raise UploadError(422, f"Checksum mismatch for {filename}")
+        if self.blobs is not None:
+            self.blobs.adopt(path, digest)
+        return digest
+
+    def _file_completed(self, session: Dict[str, object], filename: str, entry: Dict[str, object]) -> None:
+        path = self.job_dir(session) / filename
+        digest = _file_sha256(path)
+        if entry["sha256"] and digest != entry["sha256"]:
+            # The whole file is suspect; make the client send it again
+            with self._locked(session["upload_id"]):
+                session = self._load(session["upload_id"])
+                session["files"][filename]["received"] = []
+                self._save(session)
+            raise UploadError(422, f"Checksum mismatch for {filename}; upload it again")
+        if self.blobs is not None:
+            self.blobs.adopt(path, digest)
+        if self.on_file_complete is not None:
+            self.on_file_complete(session, path, digest)
+
+    @staticmethod
+    def _file_status(name: str, entry: Dict[str, object]) -> Dict[str, object]:
+        missing = _missing_ranges(entry["received"], entry["size"])
+        return {
+            "name": name,
+            "size": entry["size"],
+            "received": entry["received"],
+            "missing": missing,
+            "complete": not missing,
+        }
+
+    def status(self, upload_id: str) -> Dict[str, object]:
+        session = self._load(upload_id)
+        files = [self._file_status(name, entry) for name, entry in session["files"].items()]
+        return {
+            "upload_id": upload_id,
+            "job_id": session["job_id"],
+            "state": session["state"],
+            "direct": bool(session.get("direct")),
+            "chunk_size": CHUNK_SIZE,
+            "bytes_total": sum(f["size"] for f in files),
+            "bytes_received": sum(hi - lo for f in files for lo, hi in f["received"]),
+            "files": files,
+        }
+
+    def commit(self, upload_id: str) -> Tuple[Dict[str, object], bool]:
+        """Mark the upload committed once every file is complete.
+
+        Returns the session and whether this call committed it; a retried
+        commit gets the session back with False so the caller can answer
+        idempotently without starting the job twice.
+        """
+        with self._locked(upload_id):
+            session = self._load(upload_id)
+            if session["state"] == "committed":
+                return session, False
+            incomplete = [
+                name for name, entry in session["files"].items()
+                if _missing_ranges(entry["received"], entry["size"])
+            ]
+            if incomplete:
+                raise UploadError(409, f"{len(incomplete)} file(s) are incomplete, e.g. {incomplete[0]}")
+            session["state"] = "committed"
+            self._save(session)
+        return session, True
+
+    def reopen(self, upload_id: str) -> None:
+        """Undo a commit whose job could not be started."""
+        with self._locked(upload_id):
+            session = self._load(upload_id)
+            session["state"] = "open"
+            self._save(session)
+
+    def add_stream(self, upload_id: str, owner: str) -> None:
+        """Note that replica `owner` runs the per-file stages on some of this upload's files."""
+        with self._locked(upload_id):
+            session = self._load(upload_id)
+            owners = session.setdefault("streamed_by", [])
+            if owner not in owners:
+                owners.append(owner)
+                self._save(session)
+
+    def drop_stream(self, upload_id: str, owner: str) -> int:
+        """Note that `owner` has finished its files; returns how many replicas are still streaming."""
+        with self._locked(upload_id):
+            session = self._load(upload_id)
+            owners = [name for name in session.get("streamed_by", []) if name != owner]
+            session["streamed_by"] = owners
+            self._save(session)
+        return len(owners)
+
+    def purge_expired(self) -> None:
+        """Forget sessions older than the TTL; uncommitted ones take their job folder with them."""
+        cutoff = time.time() - self.ttl_seconds
+        for path in self.state_dir.glob("*.json"):
+            try:
+                session = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            if session.get("created_at", 0) >= cutoff:
+                continue
+            if session.get("state") != "committed":
+                shutil.rmtree(self.output_dir / session["job_id"], ignore_errors=True)
+            path.unlink(missing_ok=True)
+            path.with_suffix(".lock").unlink(missing_ok=True)
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        for block in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,232 @@
+"""Pre-forked, pre-warmed worker processes that run the pipeline stages in-process."""
+
+from __future__ import annotations
+
+import importlib
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import traceback
+from typing import List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerCrashed(RuntimeError):
+    """The worker process died (segfault, OOM kill, ...) while running a task."""
+
+
+class TaskTimedOut(RuntimeError):
+    """The task ran past its timeout; its worker's process tree was killed."""
+
+
+class TaskCancelled(RuntimeError):
+    """The caller's cancel event was set; the worker's process tree was killed."""
+
+
+class TaskFailed(RuntimeError):
+    """The task raised; `remote_traceback` holds the worker-side traceback."""
+
+    def __init__(self, message: str, remote_traceback: str) -> None:
+        super().__init__(message)
+        self.remote_traceback = remote_traceback
+
+
+def _resolve(target: str):
+    module_name, _, function_name = target.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def _worker_main(conn, preload: Sequence[str]) -> None:
+    # Own session and process group, so the whole tree can be signalled at once
+    os.setsid()
+    for module_name in preload:
+        try:
+            module = importlib.import_module(module_name)
+            warm_up = getattr(module, "warm_up", None)
+            if warm_up is not None:
+                warm_up()
+        except Exception:
+            logger.exception("Worker %d could not preload %s", os.getpid(), module_name)
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        target, args, kwargs = task
+        try:
+            reply = ("ok", _resolve(target)(*args, **kwargs))
+        except BaseException as exc:
+            reply = ("error", f"{target} failed: {type(exc).__name__}: {exc}", traceback.format_exc())
+        try:
+            conn.send(reply)
+        except Exception as exc:
+            conn.send(("error", f"{target} returned an unpicklable result: {exc}", traceback.format_exc()))
+
+
+class _Worker:
+    def __init__(self, context, preload: Sequence[str]) -> None:
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, list(preload)), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    def retire(self) -> None:
+        """Ask the worker to exit once idle; it is reaped by multiprocessing later."""
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.conn.close()
+
+    def kill(self) -> None:
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.process.join(1)
+        self.conn.close()
+
+
+class WorkerPool:
+    """Fixed number of warm worker processes running `module:function` targets.
+
+    Workers are forked from a forkserver that has already imported the heavy
+    libraries in `server_preload`, so their memory is shared copy-on-write.
+    Each worker then imports the `preload` modules and calls their
+    `warm_up()` hook, so fonts, styles and models are ready before the first
+    task. A worker is replaced after `max_tasks` tasks, and immediately if it
+    dies.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        max_tasks: int = 50,
+        preload: Sequence[str] = (),
+        server_preload: Sequence[str] = (),
+    ) -> None:
+        self.size = max(1, size)
+        self.max_tasks = max(1, max_tasks)
+        self.preload = list(preload)
+        self._context = multiprocessing.get_context("forkserver")
+        # The forkserver only survives import errors, so keep its list to installed libraries
+        self._context.set_forkserver_preload(list(server_preload))
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers: List[_Worker] = []
+        self.crashes = 0
+        self.recycled = 0
+        self.timeouts = 0
+
+    def start(self) -> None:
+        for _ in range(self.size):
+            self._idle.put(self._spawn())
+
+    def _spawn(self) -> _Worker:
+        worker = _Worker(self._context, self.preload)
+        with self._lock:
+            self._workers.append(worker)
+        return worker
+
+    def _forget(self, worker: _Worker) -> None:
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+
+    def _take(self) -> _Worker:
+        while True:
+            worker = self._idle.get()
+            if worker.process.is_alive():
+                return worker
+            # Died while idle (e.g. OOM killer); nothing was lost, just replace it
+            logger.warning("Idle worker %d exited with code %s", worker.pid, worker.process.exitcode)
+            self._forget(worker)
+            worker.kill()
+            self._idle.put(self._spawn())
+
+    def _replace(self, worker: _Worker) -> None:
+        self._forget(worker)
+        worker.kill()
+        self._idle.put(self._spawn())
+
+    def run(
+        self,
+        target: str,
+        *args,
+        timeout: Optional[float] = None,
+        cancel: Optional[threading.Event] = None,
+        **kwargs,
+    ):
+        """Run `module:function` in a worker and return its result.
+
+        Past `timeout` seconds, or once `cancel` is set, the worker and
+        anything it started are killed and replaced, and TaskTimedOut or
+        TaskCancelled is raised.
+        """
+        worker = self._take()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            worker.conn.send((target, args, kwargs))
+            while not worker.conn.poll(0.5):
+                if not worker.process.is_alive():
+                    break
+                if cancel is not None and cancel.is_set():
+                    self._replace(worker)
+                    raise TaskCancelled(f"{target} was cancelled")
+                if deadline is not None and time.monotonic() > deadline:
+                    self._replace(worker)
+                    self.timeouts += 1
+                    raise TaskTimedOut(f"{target} did not finish within {timeout:.0f}s")
+            reply = worker.conn.recv()
+        except (EOFError, OSError):
+            self.crashes += 1
+            self._replace(worker)
+            raise WorkerCrashed(
+                f"Worker {worker.pid} died running {target} (exit code {worker.process.exitcode})"
+            ) from None
+
+        worker.tasks += 1
+        if worker.tasks >= self.max_tasks:
+            self._forget(worker)
+            worker.retire()
+            self.recycled += 1
+            worker = self._spawn()
+        self._idle.put(worker)
+
+        if reply[0] == "error":
+            raise TaskFailed(reply[1], reply[2])
+        return reply[1]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = len(self._workers)
+        return {
+            "workers": total,
+            "idle": self._idle.qsize(),
+            "crashes": self.crashes,
+            "recycled": self.recycled,
+            "timeouts": self.timeouts,
+        }
+
+    def close(self, timeout: Optional[float] = 5.0) -> None:
+        with self._lock:
+            workers, self._workers = list(self._workers), []
+        for worker in workers:
+            worker.retire()
+        for worker in workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.kill()
@@ -3,7 +3,7 @@ import express from 'express';
 import next from 'next';
 import { storage } from './storage';
 import { setupAuth, isAuthenticated } from './replitAuth';
-import { createServer } from 'http';
+import { createServer, request as httpRequest } from 'http';
 import fs from 'fs';
 import path from 'path';
 import multer from 'multer';
@@ -56,6 +56,11 @@ export async function createApp(): Promise<express.Express> {
       const formData = new FormData();
       formData.append('pilot_id', pilotId ?? '');
       formData.append('location', location);
+      for (const key of ['priority', 'customer_id']) {
+        if (typeof req.body[key] === 'string' && req.body[key]) {
+          formData.append(key, req.body[key]);
+        }
+      }
 
       for (const file of tempFiles) {
         const buffer = await fs.promises.readFile(file.path);
@@ -77,25 +82,22 @@ export async function createApp(): Promise<express.Express> {
         console.error('Failed to parse Python response:', err);
       }
 
+      // Busy or low on disk: pass the refusal and its Retry-After through to the client
+      if (pythonRes.status === 429 || pythonRes.status === 503) {
+        const retryAfter = pythonRes.headers.get('retry-after');
+        if (retryAfter) {
+          res.set('Retry-After', retryAfter);
+        }
+        return res.status(pythonRes.status).json({ message: payload?.detail ?? 'Service busy, please retry later' });
+      }
+
       if (!pythonRes.ok || !payload) {
         throw new Error(payload?.detail || 'Python service failed to process job');
       }
 
-      await storage.upsertProcessingJob({
-        jobId: payload.job_id,
-        pilotId: pilotId ?? null,
-        location: location || null,
-        status: 'completed',
-      });
-
-      await storage.saveProcessingResult({
-        jobId: payload.job_id,
-        anomaliesFound: payload.anomalies_found ?? 0,
-        excelUrl: payload.excel_url,
-        pdfUrl: payload.pdf_url,
-      });
-
-      res.json(payload);
+      // The Python service queues the job and records its status and results
+      // in the shared database as the stages finish.
+      res.status(pythonRes.status).json(payload);
     } catch (error) {
       console.error('Processing error:', error);
       res.status(500).json({ message: 'Failed to process job' });
@@ -126,6 +128,113 @@ export async function createApp(): Promise<express.Express> {
     }
   });
 
+  app.delete('/api/job/:jobId', isAuthenticated, async (req: any, res) => {
+    try {
+      const pythonRes = await fetch(`${pythonApi}/jobs/${encodeURIComponent(req.params.jobId)}`, {
+        method: 'DELETE',
+      });
+      const payload = await pythonRes.json().catch(() => null);
+      if (!pythonRes.ok) {
+        return res.status(pythonRes.status).json({ message: payload?.detail ?? 'Failed to cancel job' });
+      }
+      res.status(pythonRes.status).json(payload);
+    } catch (error) {
+      console.error('Job cancel error:', error);
+      res.status(500).json({ message: 'Failed to cancel job' });
+    }
+  });
+
+  app.get('/api/job/:jobId/files', isAuthenticated, async (req: any, res) => {
+    try {
+      const query = new URLSearchParams();
+      for (const key of ['limit', 'after', 'anomalies_only']) {
+        if (typeof req.query[key] === 'string') {
+          query.set(key, req.query[key]);
+        }
+      }
+      const pythonRes = await fetch(
+        `${pythonApi}/jobs/${encodeURIComponent(req.params.jobId)}/files?${query.toString()}`,
+      );
+      const payload = await pythonRes.json().catch(() => null);
+      if (!payload) {
+        throw new Error('Python service returned an invalid response');
+      }
+      res.status(pythonRes.status).json(payload);
+    } catch (error) {
+      console.error('Job files error:', error);
+      res.status(500).json({ message: 'Failed to fetch job files' });
+    }
+  });
+
+  // Relays report and flight path downloads. Uses a raw request rather than fetch
+  // so precompressed bodies, byte ranges and 304s pass through untouched.
+  const forwardedOutputHeaders = ['range', 'if-range', 'if-none-match', 'accept-encoding'];
+  app.get('/outputs/*', isAuthenticated, (req: any, res) => {
+    const headers: Record<string, string> = {};
+    for (const name of forwardedOutputHeaders) {
+      const value = req.get(name);
+      if (value) {
+        headers[name] = value;
+      }
+    }
+
+    const upstream = httpRequest(`${pythonApi}${req.originalUrl}`, { headers }, (pythonRes) => {
+      res.writeHead(pythonRes.statusCode ?? 502, pythonRes.headers);
+      pythonRes.pipe(res);
+    });
+    upstream.on('error', (error) => {
+      console.error('Output download error:', error);
+      if (!res.headersSent) {
+        res.status(502).json({ message: 'Failed to fetch file' });
+      } else {
+        res.end();
+      }
+    });
+    req.on('close', () => upstream.destroy());
+    upstream.end();
+  });
+
+  // Relays the Python service's Server-Sent Events stream of job progress.
+  app.get('/api/job/:jobId/events', isAuthenticated, async (req: any, res) => {
+    const controller = new AbortController();
+    req.on('close', () => controller.abort());
+    try {
+      const headers: Record<string, string> = { Accept: 'text/event-stream' };
+      const lastEventId = req.get('Last-Event-ID');
+      if (lastEventId) {
+        headers['Last-Event-ID'] = lastEventId;
+      }
+
+      const pythonRes = await fetch(`${pythonApi}/jobs/${encodeURIComponent(req.params.jobId)}/events`, {
+        headers,
+        signal: controller.signal,
+      });
+      if (!pythonRes.ok || !pythonRes.body) {
+        return res.status(pythonRes.status === 404 ? 404 : 502).json({ message: 'Job events unavailable' });
+      }
+
+      res.writeHead(200, {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        Connection: 'keep-alive',
+        'X-Accel-Buffering': 'no',
+      });
+      for await (const chunk of pythonRes.body as unknown as AsyncIterable<Uint8Array>) {
+        res.write(chunk);
+      }
+      res.end();
+    } catch (error) {
+      if (!controller.signal.aborted) {
+        console.error('Job events error:', error);
+      }
+      if (res.headersSent) {
+        res.end();
+      } else {
+        res.status(502).json({ message: 'Job events unavailable' });
+      }
+    }
+  });
+
   app.post('/api/upload-kmz', isAuthenticated, upload.single('kmz'), async (req: any, res) => {
     const file = req.file as Express.Multer.File | undefined;
     try {
@@ -3,7 +3,9 @@
 
 import { sql } from 'drizzle-orm';
 import {
+  bigint,
   boolean,
+  doublePrecision,
   index,
   integer,
   jsonb,
@@ -159,15 +161,33 @@ export const inspectionJobs = pgTable("inspection_jobs", {
   updatedAt: timestamp("updated_at").defaultNow(),
 });
 
-// Automated processing jobs created by Python pipeline
+// Automated processing jobs created by Python pipeline; also the work queue shared by its workers
 export const processingJobs = pgTable("jobs", {
   id: serial("id").primaryKey(),
   jobId: text("job_id").notNull().unique(),
   pilotId: text("pilot_id"),
   location: text("location"),
   status: text("status").default('pending'),
+  customerId: text("customer_id"),
+  // rush | standard | backfill
+  priority: text("priority").notNull().default('standard'),
+  // Work item to run next: process | report
+  stage: text("stage").notNull().default('process'),
+  estimatedCost: doublePrecision("estimated_cost").notNull().default(0),
+  runSeconds: doublePrecision("run_seconds").notNull().default(0),
+  attempts: integer("attempts").notNull().default(0),
+  maxAttempts: integer("max_attempts").notNull().default(3),
+  availableAt: timestamp("available_at").defaultNow(),
+  lockedBy: text("locked_by"),
+  heartbeatAt: timestamp("heartbeat_at"),
+  startedAt: timestamp("started_at"),
+  finishedAt: timestamp("finished_at"),
+  lastError: text("last_error"),
   createdAt: timestamp("created_at").defaultNow(),
-});
+}, (table) => ({
+  queueIdx: index("jobs_status_available_at_idx").on(table.status, table.availableAt),
+  startedIdx: index("jobs_started_at_idx").on(table.startedAt),
+}));
 
 export const processingResults = pgTable("results", {
   id: serial("id").primaryKey(),
@@ -180,6 +200,24 @@ export const processingResults = pgTable("results", {
   jobUnique: uniqueIndex("results_job_id_unique").on(table.jobId),
 }));
 
+// Per-file detection records, bulk-loaded when a job completes
+export const jobFiles = pgTable("job_files", {
+  id: serial("id").primaryKey(),
+  jobId: text("job_id").notNull().references(() => processingJobs.jobId, { onDelete: 'cascade' }),
+  fileName: text("file_name").notNull(),
+  fileType: text("file_type"),
+  sizeBytes: bigint("size_bytes", { mode: "number" }),
+  anomalyDetected: boolean("anomaly_detected").notNull().default(false),
+  notes: text("notes"),
+  maxTempC: doublePrecision("max_temp_c"),
+  meanTempC: doublePrecision("mean_temp_c"),
+  deltaTC: doublePrecision("delta_t_c"),
+  details: jsonb("details"),
+  createdAt: timestamp("created_at").defaultNow(),
+}, (table) => ({
+  jobIdx: index("job_files_job_id_idx").on(table.jobId, table.id),
+}));
+
 export const flightPaths = pgTable("flight_paths", {
   id: serial("id").primaryKey(),
   jobId: text("job_id").references(() => processingJobs.jobId, { onDelete: 'cascade' }),
@@ -222,6 +260,7 @@ export const inspectionJobsRelations = relations(inspectionJobs, ({ one }) => ({
 
 export const processingJobsRelations = relations(processingJobs, ({ many }) => ({
   results: many(processingResults),
+  files: many(jobFiles),
   flightPaths: many(flightPaths),
 }));
 
@@ -232,6 +271,13 @@ export const processingResultsRelations = relations(processingResults, ({ one })
   }),
 }));
 
+export const jobFilesRelations = relations(jobFiles, ({ one }) => ({
+  job: one(processingJobs, {
+    fields: [jobFiles.jobId],
+    references: [processingJobs.jobId],
+  }),
+}));
+
 export const flightPathsRelations = relations(flightPaths, ({ one }) => ({
   job: one(processingJobs, {
     fields: [flightPaths.jobId],
@@ -250,6 +296,8 @@ export type ProcessingJob = typeof processingJobs.$inferSelect;
 export type ProcessingJobInsert = typeof processingJobs.$inferInsert;
 export type ProcessingResult = typeof processingResults.$inferSelect;
 export type ProcessingResultInsert = typeof processingResults.$inferInsert;
+export type JobFile = typeof jobFiles.$inferSelect;
+export type JobFileInsert = typeof jobFiles.$inferInsert;
 export type FlightPath = typeof flightPaths.$inferSelect;
 export type FlightPathInsert = typeof flightPaths.$inferInsert;
 
@@ -10,21 +10,30 @@ interface JobResult {
   pdf_url: string;
 }
 
-interface JobStatusResponse {
-  job: {
-    job_id: string;
-    pilot_id: string | null;
-    location: string | null;
-    status: string;
-    created_at: string;
-  };
-  result?: {
-    anomalies_found: number;
-    excel_url: string;
-    pdf_url: string;
-  } | null;
+interface JobQueuedResponse {
+  job_id: string;
+  status: string;
+  status_url: string;
+}
+
+interface JobStatusEvent {
+  status: string;
 }
 
+interface JobProgressEvent {
+  files_processed: number;
+  files_received: number;
+}
+
+interface JobResultEvent {
+  anomalies_found: number;
+  excel_url: string;
+  pdf_url: string;
+}
+
+// Statuses after which a job never changes again
+const FINAL_STATUSES = ["completed", "failed", "cancelled", "timed_out"];
+
 interface FlightPathResult {
   job_id: string;
   kmz_url: string;
@@ -38,11 +47,14 @@ export default function PilotUploadPage() {
   const [jobId, setJobId] = useState<string | null>(null);
   const [jobStatus, setJobStatus] = useState<string>("idle");
   const [result, setResult] = useState<JobResult | null>(null);
+  const [progress, setProgress] = useState<JobProgressEvent | null>(null);
   const [kmzFile, setKmzFile] = useState<File | null>(null);
   const [flightResult, setFlightResult] = useState<FlightPathResult | null>(null);
   const [error, setError] = useState<string | null>(null);
   const [isSubmitting, setIsSubmitting] = useState(false);
   const [isUploadingKmz, setIsUploadingKmz] = useState(false);
+  const [isCancelling, setIsCancelling] = useState(false);
+  const [isPreparingWorkbook, setIsPreparingWorkbook] = useState(false);
 
   const handleFiles = useCallback((incoming: FileList | null) => {
     if (!incoming) return;
@@ -93,10 +105,11 @@ export default function PilotUploadPage() {
         throw new Error(message?.message ?? "Failed to process job");
       }
 
-      const payload: JobResult = await response.json();
-      setResult(payload);
+      const payload: JobQueuedResponse = await response.json();
+      setResult(null);
+      setProgress(null);
       setJobId(payload.job_id);
-      setJobStatus("completed");
+      setJobStatus(payload.status ?? "queued");
     } catch (err) {
       console.error(err);
       setError(err instanceof Error ? err.message : "Failed to process job");
@@ -109,42 +122,86 @@ export default function PilotUploadPage() {
   useEffect(() => {
     if (!jobId) return;
 
-    let active = true;
-    const poll = async () => {
-      try {
-        const res = await fetch(`/api/job/${jobId}/status`);
-        if (!res.ok) return;
-        const data: JobStatusResponse = await res.json();
-        if (!active) return;
-        if (data.job?.status) {
-          setJobStatus(data.job.status);
-        }
-        if (data.result) {
-          setResult((prev) =>
-            prev
-              ? { ...prev, ...data.result, job_id: prev.job_id }
-              : {
-                  job_id: data.job.job_id,
-                  anomalies_found: data.result.anomalies_found ?? 0,
-                  excel_url: data.result.excel_url ?? "",
-                  pdf_url: data.result.pdf_url ?? "",
-                },
-          );
-        }
-      } catch (err) {
-        console.warn("Polling error", err);
-      }
-    };
+    // The browser reconnects on its own and resumes from the last event id
+    const source = new EventSource(`/api/job/${jobId}/events`);
 
-    const interval = window.setInterval(poll, 5000);
-    poll();
+    source.addEventListener("status", (event) => {
+      const data: JobStatusEvent = JSON.parse((event as MessageEvent).data);
+      setJobStatus(data.status);
+      if (FINAL_STATUSES.includes(data.status)) {
+        source.close();
+      }
+    });
+    source.addEventListener("progress", (event) => {
+      setProgress(JSON.parse((event as MessageEvent).data));
+    });
+    source.addEventListener("result", (event) => {
+      const data: JobResultEvent = JSON.parse((event as MessageEvent).data);
+      setResult((prev) =>
+        prev
+          ? { ...prev, ...data, job_id: prev.job_id }
+          : {
+              job_id: jobId,
+              anomalies_found: data.anomalies_found ?? 0,
+              excel_url: data.excel_url ?? "",
+              pdf_url: data.pdf_url ?? "",
+            },
+      );
+    });
 
     return () => {
-      active = false;
-      window.clearInterval(interval);
+      source.close();
     };
   }, [jobId]);
 
+  const cancelJob = useCallback(async () => {
+    if (!jobId) return;
+
+    setIsCancelling(true);
+    setError(null);
+    try {
+      const res = await fetch(`/api/job/${jobId}`, { method: "DELETE" });
+      if (!res.ok) {
+        const message = await res.json().catch(() => ({ message: "Failed to cancel job" }));
+        throw new Error(message?.message ?? "Failed to cancel job");
+      }
+      setJobStatus("cancelled");
+    } catch (err) {
+      console.error(err);
+      setError(err instanceof Error ? err.message : "Failed to cancel job");
+    } finally {
+      setIsCancelling(false);
+    }
+  }, [jobId]);
+
+  const downloadWorkbook = useCallback(async (url: string) => {
+    setIsPreparingWorkbook(true);
+    setError(null);
+    try {
+      // The workbook is built on first request; until it is ready the service answers 202 with Retry-After
+      let res = await fetch(url);
+      while (res.status === 202) {
+        const seconds = Number(res.headers.get("Retry-After")) || 2;
+        await new Promise((resolve) => setTimeout(resolve, seconds * 1000));
+        res = await fetch(url);
+      }
+      if (!res.ok) {
+        throw new Error("Failed to download Excel workbook");
+      }
+
+      const link = document.createElement("a");
+      link.href = URL.createObjectURL(await res.blob());
+      link.download = "Report_Input.xlsx";
+      link.click();
+      URL.revokeObjectURL(link.href);
+    } catch (err) {
+      console.error(err);
+      setError(err instanceof Error ? err.message : "Failed to download Excel workbook");
+    } finally {
+      setIsPreparingWorkbook(false);
+    }
+  }, []);
+
   const uploadKmz = useCallback(async () => {
     if (!jobId || !kmzFile) {
       setError("Upload a KMZ file after a job has been created.");
@@ -180,12 +237,22 @@ export default function PilotUploadPage() {
 
   const statusLabel = useMemo(() => {
     switch (jobStatus) {
+      case "uploading":
+        return "Uploading…";
+      case "queued":
+        return "Queued";
       case "processing":
         return "Processing…";
+      case "generating_report":
+        return "Generating report…";
       case "completed":
         return "Completed";
       case "failed":
         return "Failed";
+      case "cancelled":
+        return "Cancelled";
+      case "timed_out":
+        return "Timed out";
       default:
         return "Idle";
     }
@@ -206,14 +273,14 @@ export default function PilotUploadPage() {
         className="flex flex-col items-center justify-center rounded-lg border-2 border-dashed border-gray-300 bg-gray-50 p-10 text-center"
       >
         <p className="text-lg font-medium text-gray-700">Drop files here or click to upload</p>
-        <p className="mt-1 text-sm text-gray-500">Supported formats: JPEG, PNG, TIFF, KMZ, KML</p>
+        <p className="mt-1 text-sm text-gray-500">Supported formats: JPEG, PNG, TIFF, KMZ, KML, or a ZIP/TAR archive of them</p>
         <label className="mt-4 inline-flex cursor-pointer items-center rounded-md bg-blue-600 px-4 py-2 text-white shadow-sm hover:bg-blue-500">
           Browse files
           <input
             type="file"
             multiple
             className="hidden"
-            accept=".jpg,.jpeg,.png,.tif,.tiff,.kmz,.kml"
+            accept=".jpg,.jpeg,.png,.tif,.tiff,.kmz,.kml,.zip,.tar,.tgz,.gz"
             onChange={handleFileInput}
           />
         </label>
@@ -268,6 +335,21 @@ export default function PilotUploadPage() {
       <div className="rounded-lg border border-gray-200 bg-white p-4 shadow-sm">
         <h2 className="text-lg font-semibold text-gray-800">Job status</h2>
         <p className="mt-1 text-sm text-gray-600">Current status: {statusLabel}</p>
+        {jobId && !FINAL_STATUSES.includes(jobStatus) && (
+          <button
+            type="button"
+            onClick={cancelJob}
+            disabled={isCancelling}
+            className="mt-2 text-sm text-red-600 hover:text-red-500 disabled:cursor-not-allowed disabled:text-red-300"
+          >
+            {isCancelling ? "Cancelling…" : "Cancel job"}
+          </button>
+        )}
+        {progress && !result && (
+          <p className="mt-1 text-sm text-gray-600">
+            Files processed: {progress.files_processed} of {progress.files_received}
+          </p>
+        )}
         {result && (
           <div className="mt-4 space-y-2 text-sm text-gray-700">
             <p>
@@ -278,14 +360,14 @@ export default function PilotUploadPage() {
             </p>
             <div className="flex flex-wrap gap-3">
               {result.excel_url && (
-                <a
-                  href={result.excel_url}
-                  target="_blank"
-                  rel="noopener noreferrer"
-                  className="inline-flex items-center rounded-md border border-blue-600 px-3 py-1 text-blue-600 hover:bg-blue-50"
+                <button
+                  type="button"
+                  onClick={() => downloadWorkbook(result.excel_url)}
+                  disabled={isPreparingWorkbook}
+                  className="inline-flex items-center rounded-md border border-blue-600 px-3 py-1 text-blue-600 hover:bg-blue-50 disabled:cursor-not-allowed disabled:border-blue-300 disabled:text-blue-300"
                 >
-                  Download Excel
-                </a>
+                  {isPreparingWorkbook ? "Preparing Excel…" : "Download Excel"}
+                </button>
               )}
               {result.pdf_url && (
                 <a
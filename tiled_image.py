@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+"""
+Tiled Image Reader
+
+This module reads very large images (site panoramas, orthomosaics) one tile
+at a time so that memory use stays bounded no matter how big the file is:
+- Uncompressed TIFF/BigTIFF files are memory-mapped directly
+- JPEG files are cut into horizontal bands and tiles losslessly with
+  jpegtran, which can spill to temporary files instead of RAM
+- Anything else falls back to decoding the whole image
+"""
+
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+
+import cv2
+import numpy as np
+from PIL import Image
+
+DEFAULT_TILE_SIZE = 2048
+DEFAULT_OVERLAP = 64
+
+# Images above this many pixels go through the tiled path (a 48 MP zoom frame
+# is still read whole).
+LARGE_IMAGE_PIXELS = 50_000_000
+
+JPEGTRAN = shutil.which('jpegtran')
+JPEGTRAN_MAXMEMORY = os.getenv('JPEGTRAN_MAXMEMORY', '256M')
+
+# TIFF tags and field types used by tiff_layout
+_TIFF_TYPES = {3: ('H', 2), 4: ('I', 4), 16: ('Q', 8)}
+_WIDTH, _HEIGHT, _BITS, _COMPRESSION, _PHOTOMETRIC = 256, 257, 258, 259, 262
+_STRIP_OFFSETS, _SAMPLES, _STRIP_COUNTS, _PLANAR, _TILE_WIDTH = 273, 277, 279, 284, 322
+
+
+def _read_header(image_path, read):
+    limit = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None  # mosaics trip Pillow's decompression bomb check
+    try:
+        with Image.open(image_path) as img:
+            return read(img)
+    finally:
+        Image.MAX_IMAGE_PIXELS = limit
+
+
+def image_size(image_path):
+    """Return (width, height) from the file header without decoding pixels."""
+    return _read_header(image_path, lambda img: img.size)
+
+
+def jpeg_imcu_size(image_path):
+    """Return the (width, height) of a JPEG's iMCU, the unit of lossless crops."""
+    return _read_header(image_path, lambda img: (8 * max(h for _, h, _, _ in img.layer),
+                                                 8 * max(v for _, _, v, _ in img.layer)))
+
+
+def is_large_image(image_path, limit=LARGE_IMAGE_PIXELS):
+    """Check if an image is big enough to need tiled processing."""
+    try:
+        width, height = image_size(image_path)
+    except Exception:
+        return False
+    return width * height > limit
+
+
+def tiff_layout(image_path):
+    """
+    Locate the pixels of an uncompressed, chunky, 8-bit TIFF.
+
+    Returns:
+        (offset, (height, width, samples), is_rgb), or None if the pixel data
+        is compressed, tiled or not stored contiguously
+    """
+    with open(image_path, 'rb') as f:
+        header = f.read(16)
+        if header[:2] not in (b'II', b'MM'):
+            return None
+        order = '<' if header[:2] == b'II' else '>'
+        version = struct.unpack(order + 'H', header[2:4])[0]
+        if version == 42:
+            ifd_offset = struct.unpack(order + 'I', header[4:8])[0]
+            count_format, entry_size, inline_size = 'H', 12, 4
+        elif version == 43:
+            ifd_offset = struct.unpack(order + 'Q', header[8:16])[0]
+            count_format, entry_size, inline_size = 'Q', 20, 8
+        else:
+            return None
+
+        f.seek(ifd_offset)
+        count_size = struct.calcsize(count_format)
+        entry_count = struct.unpack(order + count_format, f.read(count_size))[0]
+        raw_entries = f.read(entry_count * entry_size)
+
+        tags = {}
+        for i in range(entry_count):
+            entry = raw_entries[i * entry_size:(i + 1) * entry_size]
+            tag, field_type = struct.unpack(order + 'HH', entry[:4])
+            if field_type not in _TIFF_TYPES:
+                continue
+            value_format, value_size = _TIFF_TYPES[field_type]
+            if version == 42:
+                count = struct.unpack(order + 'I', entry[4:8])[0]
+                value_bytes = entry[8:12]
+            else:
+                count = struct.unpack(order + 'Q', entry[4:12])[0]
+                value_bytes = entry[12:20]
+            if count * value_size > inline_size:
+                offset = struct.unpack(order + ('I' if version == 42 else 'Q'), value_bytes)[0]
+                position = f.tell()
+                f.seek(offset)
+                value_bytes = f.read(count * value_size)
+                f.seek(position)
+            tags[tag] = list(struct.unpack(order + value_format * count, value_bytes[:count * value_size]))
+
+    if _TILE_WIDTH in tags or tags.get(_COMPRESSION, [1])[0] != 1 or tags.get(_PLANAR, [1])[0] != 1:
+        return None
+    if any(bits != 8 for bits in tags.get(_BITS, [8])):
+        return None
+
+    width, height = tags[_WIDTH][0], tags[_HEIGHT][0]
+    samples = tags.get(_SAMPLES, [1])[0]
+    offsets, counts = tags.get(_STRIP_OFFSETS), tags.get(_STRIP_COUNTS)
+    if not offsets or not counts:
+        return None
+    for offset, count, next_offset in zip(offsets, counts, offsets[1:]):
+        if offset + count != next_offset:
+            return None
+    if sum(counts) < width * height * samples:
+        return None
+
+    return offsets[0], (height, width, samples), tags.get(_PHOTOMETRIC, [2])[0] == 2
+
+
+def tiff_memmap(image_path, mode='r', rows=None):
+    """
+    Memory-map the pixels of an uncompressed TIFF (see tiff_layout).
+
+    Mapped pages count towards resident memory for as long as the map lives,
+    so map only the rows needed (rows=(first, count)) and drop the array
+    when done with them.
+
+    Returns:
+        (array, is_rgb) with array shaped (rows, width, samples), or None
+    """
+    layout = tiff_layout(image_path)
+    if layout is None:
+        return None
+    offset, (height, width, samples), is_rgb = layout
+    first, count = rows or (0, height)
+    array = np.memmap(image_path, dtype=np.uint8, mode=mode, offset=offset + first * width * samples,
+                      shape=(count, width, samples))
+    return array, is_rgb
+
+
+def _to_bgr(pixels, is_rgb):
+    """Convert a memory-mapped region to a 3-channel BGR array."""
+    channels = pixels.shape[2]
+    if channels == 1:
+        return cv2.cvtColor(np.ascontiguousarray(pixels[:, :, 0]), cv2.COLOR_GRAY2BGR)
+    pixels = np.ascontiguousarray(pixels[:, :, :3])
+    return cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR) if is_rgb else pixels
+
+
+class Tile:
+    """
+    One tile of a large image.
+
+    x, y are the tile's top-left corner in image coordinates. core is the
+    (x0, y0, x1, y1) area this tile owns; cores of neighbouring tiles do not
+    overlap, so per-pixel counts should only look at the core.
+    """
+
+    def __init__(self, x, y, image, core):
+        self.x = x
+        self.y = y
+        self.image = image
+        self.core = core
+
+
+class TiledImage:
+    """
+    Read a large image tile by tile with bounded memory.
+
+    Use as a context manager:
+        with TiledImage('mosaic.tif') as mosaic:
+            for tile in mosaic.tiles():
+                ...
+    """
+
+    def __init__(self, image_path, tile_size=DEFAULT_TILE_SIZE, overlap=DEFAULT_OVERLAP):
+        self.image_path = image_path
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.width, self.height = image_size(image_path)
+        self._tiff = None
+        self._is_rgb = True
+        self._mcu = None
+        self._decoded = None
+        self._temp_dir = None
+        self._band = None  # (band_path, band_x, band_y, band_height)
+
+        layout = tiff_layout(image_path) if image_path.lower().endswith(('.tif', '.tiff')) else None
+        if layout is not None:
+            self._tiff = layout
+            self._is_rgb = layout[2]
+        elif image_path.lower().endswith(('.jpg', '.jpeg')) and JPEGTRAN:
+            self._mcu = jpeg_imcu_size(image_path)
+            self._temp_dir = tempfile.TemporaryDirectory()
+        else:
+            print(f"Warning: {image_path} cannot be read in tiles, decoding it whole")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._decoded = None
+        if self._temp_dir is not None:
+            self._temp_dir.cleanup()
+            self._temp_dir = None
+
+    @property
+    def mode(self):
+        if self._tiff is not None:
+            return 'memmap'
+        if self._mcu is not None:
+            return 'jpeg'
+        return 'decoded'
+
+    def _jpeg_crop(self, source, x, y, w, h, out_name):
+        """Losslessly crop a JPEG; returns (path, x_shift, y_shift) of the crop."""
+        mcu_w, mcu_h = self._mcu
+        aligned_x, aligned_y = (x // mcu_w) * mcu_w, (y // mcu_h) * mcu_h
+        out_path = os.path.join(self._temp_dir.name, out_name)
+        subprocess.run([JPEGTRAN, '-maxmemory', JPEGTRAN_MAXMEMORY, '-copy', 'none', '-crop',
+                        f"{w + x - aligned_x}x{h + y - aligned_y}+{aligned_x}+{aligned_y}",
+                        '-outfile', out_path, source], check=True, capture_output=True)
+        return out_path, x - aligned_x, y - aligned_y
+
+    def _load_band(self, y, h):
+        """Cut the full-width band covering rows y..y+h out of the source JPEG."""
+        band = self._band
+        if band is not None and band[2] <= y and y + h <= band[2] + band[3]:
+            return band
+        band_path, _, shift_y = self._jpeg_crop(self.image_path, 0, y, self.width, h, 'band.jpg')
+        self._band = (band_path, 0, y - shift_y, h + shift_y)
+        return self._band
+
+    def read_region(self, x, y, w, h):
+        """Read the (x, y, w, h) region as a BGR array, clipped to the image."""
+        x, y = max(0, x), max(0, y)
+        w, h = min(w, self.width - x), min(h, self.height - y)
+        if self._tiff is not None:
+            # Map just these rows; the map is dropped once converted
+            offset, (_, width, samples), _ = self._tiff
+            rows = np.memmap(self.image_path, dtype=np.uint8, mode='r',
+                             offset=offset + y * width * samples, shape=(h, width, samples))
+            return _to_bgr(rows[:, x:x + w], self._is_rgb)
+
+        if self._mcu is not None:
+            band_path, band_x, band_y, band_h = self._band or (None, 0, 0, 0)
+            if band_path and band_y <= y and y + h <= band_y + band_h:
+                source, offset_y = band_path, band_y
+            else:
+                source, offset_y = self.image_path, 0
+            crop_path, shift_x, shift_y = self._jpeg_crop(source, x, y - offset_y, w, h, 'region.jpg')
+            crop = cv2.imread(crop_path)
+            return crop[shift_y:shift_y + h, shift_x:shift_x + w]
+
+        if self._decoded is None:
+            self._decoded = cv2.imread(self.image_path)
+        return self._decoded[y:y + h, x:x + w]
+
+    def tile_origins(self):
+        """Top-left corners of all tiles, row by row."""
+        step = max(1, self.tile_size - self.overlap)
+        xs = list(range(0, max(1, self.width - self.overlap), step))
+        ys = list(range(0, max(1, self.height - self.overlap), step))
+        return [(x, y) for y in ys for x in xs]
+
+    def tiles(self):
+        """Yield Tile objects covering the image with the configured overlap."""
+        half = self.overlap // 2
+        for x, y in self.tile_origins():
+            w = min(self.tile_size, self.width - x)
+            h = min(self.tile_size, self.height - y)
+            if self._mcu is not None:
+                self._load_band(y, h)
+            core = (
+                x + half if x > 0 else 0,
+                y + half if y > 0 else 0,
+                x + w - half if x + w < self.width else self.width,
+                y + h - half if y + h < self.height else self.height,
+            )
+            yield Tile(x, y, self.read_region(x, y, w, h), core)
+
+
+def merge_boxes(boxes, gap=2):
+    """
+    Merge (x, y, w, h) boxes that overlap or lie within `gap` pixels of each
+    other, e.g. pieces of one detection split by tile seams.
+    """
+    merged = [list(box) for box in boxes]
+    changed = True
+    while changed:
+        changed = False
+        result = []
+        while merged:
+            x, y, w, h = merged.pop()
+            i = 0
+            while i < len(merged):
+                ox, oy, ow, oh = merged[i]
+                if ox <= x + w + gap and x <= ox + ow + gap and oy <= y + h + gap and y <= oy + oh + gap:
+                    x0, y0 = min(x, ox), min(y, oy)
+                    x, w = x0, max(x + w, ox + ow) - x0
+                    y, h = y0, max(y + h, oy + oh) - y0
+                    merged.pop(i)
+                    changed = True
+                else:
+                    i += 1
+            result.append([x, y, w, h])
+        merged = result
+    return [tuple(box) for box in merged]